@@ -0,0 +1,123 @@
+# This class writes posts to the database without blocking an asyncio event loop.
+# Posts are collected in an async queue and written in micro-batches, either once enough posts are queued or once
+# the oldest queued post waited long enough. The blocking database calls run in a separate thread.
+# On shutdown, all queued posts are flushed before the writer stops.
+
+from mysqlwrapper import MySQLWrapper
+from forums import ForumPost, insertAuthors, insertPosts
+from spool import PostSpool, encodePost
+
+from concurrent.futures import ThreadPoolExecutor
+import MySQLdb
+import asyncio
+import time
+import traceback
+
+class AsyncPostWriter:
+
+    # Constructor
+    # mysql: Database connection, which must not be used by anything else while the writer is running
+    # maxBatchSize: Number of queued posts that triggers a write
+    # maxDelay: Maximum time in seconds a post waits in the queue before it's written
+    # maxQueueSize: Maximum number of queued posts. Adding posts waits while the queue is full.
+    # spool: Spool the batches are appended to instead of writing them to the database, or None
+    def __init__(self, mysql: MySQLWrapper, maxBatchSize: int = 50, maxDelay: float = 2.0, maxQueueSize: int = 1000, spool: PostSpool = None):
+        self.mysql = mysql
+        self.spool = spool
+        self.maxBatchSize = maxBatchSize
+        self.maxDelay = maxDelay
+        self.maxQueueSize = maxQueueSize
+
+        # A single thread, as the database connection can't be used by several threads at once
+        self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "dbwriter")
+        self.queue = None
+        self.task = None
+
+    # Starts writing in the background. Must be called from within the event loop.
+    def start(self):
+        self.queue = asyncio.Queue(self.maxQueueSize)
+        self.task = asyncio.get_running_loop().create_task(self.__run())
+
+    # Queues a post for writing
+    # post: Post to be written. Its thread ID must already be set.
+    async def put(self, post: ForumPost):
+        await self.queue.put(post)
+
+    # Runs a function with the database connection in the writer's thread, so it doesn't interfere with the writes
+    # function: Function that is called with the database connection and the given arguments
+    # Returns the result of the function
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.__runInTransaction, function, *args)
+
+    # Calls a function with the database connection, rolling back its uncommitted changes if it fails
+    def __runInTransaction(self, function, *args):
+        try:
+            return function(self.mysql, *args)
+
+        except Exception:
+            try:
+                self.mysql.rollback()
+            except MySQLdb.Error:
+                pass
+
+            raise
+
+    # Writes queued posts until the writer is closed
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+
+        while not closing:
+            # Waits for the first post of the next batch
+            post = await self.queue.get()
+            if post is None:
+                break
+
+            batch = [post]
+            deadline = time.monotonic() + self.maxDelay
+
+            # Collects further posts until the batch is full or the first post waited long enough
+            while len(batch) < self.maxBatchSize:
+                remainingTime = deadline - time.monotonic()
+                if remainingTime <= 0:
+                    break
+
+                try:
+                    post = await asyncio.wait_for(self.queue.get(), remainingTime)
+                except asyncio.TimeoutError:
+                    break
+
+                if post is None:
+                    closing = True
+                    break
+
+                batch += [post]
+
+            try:
+                await loop.run_in_executor(self.executor, self.__runInTransaction, self.__write, batch)
+            except Exception:
+                print(f"Failed to write {len(batch)} posts:")
+                traceback.print_exc()
+
+    # Writes a batch of posts with their authors to the database
+    # mysql: Database connection of the writer
+    # posts: List of posts
+    def __write(self, mysql: MySQLWrapper, posts: list):
+        # The spool's drainer writes the posts once the database is reachable
+        if self.spool is not None:
+            self.spool.append({"posts": [encodePost(post) for post in posts]})
+            return
+
+        insertAuthors(mysql, [post.author for post in posts])
+        insertPosts(mysql, posts)
+        mysql.commit()
+
+    # Writes all queued posts and stops the writer
+    async def close(self):
+        if self.task is not None:
+            # The marker is queued behind all posts, so they are written before the writer stops
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+        self.executor.shutdown()
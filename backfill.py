@@ -0,0 +1,181 @@
+# This script reads the history of the observed forums, which hltv_scan.py doesn't see as it only reads the first
+# index page of every forum. It walks the index pages of each forum from newest to oldest and reads every listed
+# thread that isn't stored completely yet. Stored threads are skipped and partially stored ones are continued at
+# their cursor, so the backfill and the live scanner never read the same posts twice.
+# After every index page, the URL of the next one is saved in the BackfillProgress table. If the backfill is stopped
+# or crashes, it continues at that page, so months of history can be pulled in many short runs.
+# The backfill has its own, lower request rate and can run alongside the live scanner.
+#
+# Usage:
+#   python backfill.py [--forum 17/off-topic] [--max-pages 100] [--rate 0.1]
+#
+# Stop it with SIGTERM or Ctrl+C, it finishes the current thread page first.
+
+from mysqlwrapper import MySQLWrapper
+from authorization import AuthorizationInfo
+from forums import *
+from threadtracker import ThreadTracker
+from fetcher import Fetcher
+from control import ControlChannel
+from metrics import metrics
+from httpcache import getTransferredBytes
+from classification import PostClassifier
+from classificationcache import ClassificationCache
+import hltvparser
+import hltv_scan
+
+import argparse
+import os
+
+# Request rate of the backfill. It's added to the rate of the live scanner, so it's kept well below it.
+BACKFILL_REQUESTS_PER_SECOND = 0.1
+
+# Returns the URL of the next index page to be read and whether the forum was read completely
+# mysql: Database connection
+# forum: Forum whose progress is looked up
+def getBackfillProgress(mysql: MySQLWrapper, forum: Forum):
+    mysql.query("SELECT PageURL, Completed FROM BackfillProgress WHERE ForumID=%s;", (forum.sqlID,))
+    results = mysql.fetchResults()
+
+    if results is None:
+        return (forum.getURL(), False)
+    else:
+        return (results[0][0], results[0][1] == 1)
+
+# Saves the URL of the next index page to be read
+# mysql: Database connection
+# forum: Forum that is backfilled
+# nextURL: URL of the next index page, or None if the last page was read
+def saveBackfillProgress(mysql: MySQLWrapper, forum: Forum, nextURL):
+    completed = 1 if nextURL is None else 0
+    pageURL = nextURL if nextURL is not None else ""
+
+    mysql.query(
+        (
+            "INSERT INTO BackfillProgress (ForumID, PageURL, PageCount, Completed, Time) VALUES (%s, %s, 1, %s, NOW()) "
+            "ON DUPLICATE KEY UPDATE PageURL=VALUES(PageURL), PageCount=PageCount+1, Completed=VALUES(Completed), Time=NOW();"
+        ),
+        (forum.sqlID, pageURL, completed,)
+    )
+    mysql.commit()
+
+# Returns the threads listed on an index page and the URL of the next, older index page
+# fetcher: Fetcher used to download the page
+# forum: Forum the page belongs to
+# url: URL of the index page
+def getIndexPage(fetcher: Fetcher, forum: Forum, url: str):
+    # Older index pages are always downloaded in full, there is no earlier response to compare them to
+    response = fetcher.fetch(url, False)
+    metrics.increment("forum_bytes_total", getTransferredBytes(response), {"forum_id": forum.sqlID})
+
+    with metrics.timer("parse_seconds", {"page": "index"}):
+        document = hltvparser.parseDocument(response.text)
+        rows = hltvparser.extractForumThreads(document, url)
+        nextURL = hltvparser.extractNextPageURL(document, url)
+
+    threads = []
+    for row in rows:
+        author = ForumAuthor(row.authorName, url = row.authorURL)
+        threads += [ForumThread(row.title, author, forum.sqlID, url = row.url, replyCount = row.replyCount)]
+
+    return (threads, nextURL)
+
+# Reads the threads of an index page that aren't stored completely yet
+# Returns False if a stop was requested before all threads were read
+# mysql: Database connection
+# fetcher: Fetcher used to download the thread pages
+# classifier: Classifier used to rate the posts
+# tracker: Thread tracker used to skip stored threads and continue partially stored ones
+# control: Control channel, reading stops at the next page once a stop is requested
+# threads: Threads listed on the index page
+def backfillThreads(mysql: MySQLWrapper, fetcher: Fetcher, classifier: PostClassifier, tracker: ThreadTracker, control: ControlChannel, threads: list) -> bool:
+    # Only loads the threads of this page, as the stored state of a whole forum's history can be large
+    tracker.loadThreads(mysql, threads)
+    threads = [thread for thread in threads if tracker.hasChanged(thread)]
+
+    for thread in threads:
+        pages = hltv_scan.iterThreadPages(fetcher, thread, tracker.getResumeURL(thread), tracker.getLastReplyNum(thread), False, control)
+
+        for page in pages:
+            with metrics.timer("parse_seconds", {"page": "thread"}):
+                hltv_scan.parseThreadPage(page)
+
+            hltv_scan.classifyPosts(classifier, page.posts)
+            hltv_scan.saveThreadPage(mysql, tracker, page)
+
+        # No further page was requested once a stop was requested
+        if control.isStopRequested():
+            return False
+
+        print(f"\tThread: {thread.title}")
+
+    # The threads of the next index page are loaded again
+    tracker.clear()
+    return True
+
+# Reads the history of a forum, starting at the saved progress
+# Returns False if a stop was requested
+# maxPages: Maximum number of index pages to be read, or None to read all of them
+def backfillForum(mysql: MySQLWrapper, fetcher: Fetcher, classifier: PostClassifier, tracker: ThreadTracker, control: ControlChannel, forum: Forum, maxPages = None) -> bool:
+    url, completed = getBackfillProgress(mysql, forum)
+    if completed:
+        print(f"Forum {forum.name} is backfilled completely.")
+        return True
+
+    pageCount = 0
+    while url is not None and (maxPages is None or pageCount < maxPages):
+        print(f"Backfilling {forum.name}: {url}")
+
+        threads, nextURL = getIndexPage(fetcher, forum, url)
+
+        # The page is only marked as read once all of its threads are saved
+        if not backfillThreads(mysql, fetcher, classifier, tracker, control, threads):
+            return False
+
+        saveBackfillProgress(mysql, forum, nextURL)
+
+        url = nextURL
+        pageCount += 1
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Reads the history of the observed forums")
+    parser.add_argument("--forum", default = None, help = "HLTVID of the forum to be backfilled, e.g. 17/off-topic. By default all observed forums are backfilled.")
+    parser.add_argument("--max-pages", type = int, default = None, help = "maximum number of index pages read per forum in this run")
+    parser.add_argument("--rate", type = float, default = BACKFILL_REQUESTS_PER_SECOND, help = "requests per second")
+    args = parser.parse_args()
+
+    # Runs with lower CPU priority than the live scanner on the same host
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+    auth = AuthorizationInfo("auth.json")
+    mysql = MySQLWrapper(auth)
+    initializeTables(mysql, False)
+    warmIdentityMaps(mysql)
+
+    forums = hltv_scan.getForums(mysql)
+    if args.forum is not None:
+        forums = [forum for forum in forums if forum.hltvID == args.forum]
+
+    fetcher = Fetcher(args.rate)
+    classifier = PostClassifier(cache = ClassificationCache(path = "classification_cache.db"))
+    tracker = ThreadTracker()
+
+    # Only reacts to signals of this process, so stopping the backfill doesn't affect the live scanner
+    control = ControlChannel(mysql, controlFile = None)
+    control.installSignalHandlers()
+
+    for forum in forums:
+        if not backfillForum(mysql, fetcher, classifier, tracker, control, forum, args.max_pages):
+            break
+
+    print("Stopping backfill...")
+    classifier.close()
+    fetcher.close()
+
+
+if __name__ == "__main__":
+    main()
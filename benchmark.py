@@ -0,0 +1,190 @@
+# This script measures the performance of the scraper without accessing hltv.org.
+# Recorded pages (see parsercheck.py) are served by a local HTTP server, which replaces HLTV's base URL.
+# Every forum index in the fixture directory is scanned like in hltv_scan.py: the index and threads are fetched,
+# parsed, classified and saved to a local MySQL/MariaDB database.
+# The database is configured in a separate auth file, so the production database is never touched.
+#
+# Usage:
+#   python benchmark.py [--auth bench_auth.json] [--runs 3] [--no-db] [--cache] [--json results.json]
+#
+# Reports posts per second, percentiles of the per-stage latencies and database round trips per post.
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import forums
+from forums import Forum, initializeTables
+from mysqlwrapper import MySQLWrapper
+from authorization import AuthorizationInfo
+from metrics import metrics
+from fetcher import Fetcher
+from classification import PostClassifier
+from classificationcache import ClassificationCache
+from threadtracker import ThreadTracker
+from parsercheck import FIXTURE_DIR, BASE_URL, getFixturePath
+import hltv_scan
+
+import argparse
+import json
+import os
+import threading
+import time
+
+# Summaries that are reported, with the labels of their stages
+REPORTED_SUMMARIES = ["fetch_seconds", "parse_seconds", "classify_batch_seconds", "classify_seconds_per_post", "persist_seconds", "db_query_seconds"]
+
+# Serves the fixture files, mapping the URL path /forums/17/off-topic to fixtures/forums/17/off-topic.html
+# and paginated pages like /forums/threads/2331207/best-player?offset=5 to best-player@offset=5.html
+class FixtureHandler(SimpleHTTPRequestHandler):
+
+    def translate_path(self, path):
+        return getFixturePath(BASE_URL + path.split('#', 1)[0])
+
+    # Suppresses the default request logging
+    def log_message(self, format, *args):
+        pass
+
+# Starts the fixture server in a background thread and returns its base URL
+def startFixtureServer() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target = server.serve_forever, name = "fixtures", daemon = True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+# Returns the forums that have a recorded index page
+def getFixtureForums() -> list:
+    forumDir = os.path.join(FIXTURE_DIR, "forums")
+    fixtureForums = []
+
+    if not os.path.isdir(forumDir):
+        return fixtureForums
+
+    for forumNum in sorted(os.listdir(forumDir)):
+        if forumNum == "threads" or not os.path.isdir(os.path.join(forumDir, forumNum)):
+            continue
+
+        for fileName in sorted(os.listdir(os.path.join(forumDir, forumNum))):
+            # Skips further pages of an index
+            if fileName.endswith(".html") and "@" not in fileName:
+                slug = fileName[:-len(".html")]
+                fixtureForums += [Forum(slug, f"{forumNum}/{slug}")]
+
+    return fixtureForums
+
+# Scans all forums once, stage by stage, and returns the number of processed posts
+# fetcher: Fetcher that requests pages from the fixture server
+# classifier: Classifier used to rate the posts
+# mysql: Database connection, or None to skip saving
+# tracker: Thread tracker, or None to process every thread in full
+# fixtureForums: Forums to be scanned
+def runScan(fetcher: Fetcher, classifier: PostClassifier, mysql: MySQLWrapper, tracker: ThreadTracker, fixtureForums: list) -> int:
+    postCount = 0
+
+    for forum in fixtureForums:
+        threads = hltv_scan.getForumThreads(fetcher, forum)
+        if mysql is not None:
+            tracker.loadThreads(mysql, threads)
+
+        if tracker is not None:
+            threads = [thread for thread in threads if tracker.hasChanged(thread)]
+
+        for thread in threads:
+            if tracker is not None:
+                pages = hltv_scan.iterThreadPages(fetcher, thread, tracker.getResumeURL(thread), tracker.getLastReplyNum(thread), False)
+            else:
+                pages = hltv_scan.iterThreadPages(fetcher, thread, thread.getURL(), None, False)
+
+            for page in pages:
+                with metrics.timer("parse_seconds", {"page": "thread"}):
+                    hltv_scan.parseThreadPage(page)
+
+                hltv_scan.classifyPosts(classifier, page.posts)
+
+                if mysql is not None:
+                    with metrics.timer("persist_seconds"):
+                        hltv_scan.saveThreadPage(mysql, tracker, page)
+
+                postCount += len(page.posts)
+
+    return postCount
+
+# Returns the percentiles of all reported summaries
+def collectLatencies() -> dict:
+    latencies = {}
+
+    for name in REPORTED_SUMMARIES:
+        for labels in metrics.getSummaryLabels(name):
+            summary = metrics.getSummary(name, labels, [50, 90, 99])
+            labelStr = ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+            latencies[f"{name}{{{labelStr}}}" if labelStr else name] = summary
+
+    return latencies
+
+# Returns the number of database statements executed so far
+def getRoundTrips() -> int:
+    return sum(metrics.getSummary("db_query_seconds", labels)["count"] for labels in metrics.getSummaryLabels("db_query_seconds"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks the scraper with recorded HLTV pages")
+    parser.add_argument("--auth", default = "bench_auth.json", help = "auth file of a local benchmark database, its tables are reset")
+    parser.add_argument("--runs", type = int, default = 1, help = "number of scans; later runs measure the incremental path")
+    parser.add_argument("--no-db", action = "store_true", help = "only fetch, parse and classify")
+    parser.add_argument("--cache", action = "store_true", help = "use an in-memory classification cache")
+    parser.add_argument("--json", default = None, help = "path of a JSON file the results are written to")
+    args = parser.parse_args()
+
+    fixtureForums = getFixtureForums()
+    if len(fixtureForums) == 0:
+        print(f"No recorded forum index pages found in {FIXTURE_DIR}. Record some with parsercheck.py first.")
+        return
+
+    # Replays the fixtures instead of requesting hltv.org
+    forums.HLTV_URL = startFixtureServer()
+
+    metrics.configure(True)
+    fetcher = Fetcher(requestsPerSecond = 1000.0, jitter = 0.0)
+    classifier = PostClassifier(cache = ClassificationCache() if args.cache else None)
+
+    mysql = None
+    tracker = None
+    if not args.no_db:
+        mysql = MySQLWrapper(AuthorizationInfo(args.auth))
+        initializeTables(mysql, True)
+        tracker = ThreadTracker()
+
+        for forum in fixtureForums:
+            forum.insert(mysql)
+        mysql.commit()
+
+    results = []
+
+    for run in range(args.runs):
+        metrics.reset()
+
+        startTime = time.perf_counter()
+        postCount = runScan(fetcher, classifier, mysql, tracker, fixtureForums)
+        duration = time.perf_counter() - startTime
+
+        roundTrips = getRoundTrips() if mysql is not None else 0
+        result = {
+            "run": run + 1,
+            "posts": postCount,
+            "seconds": duration,
+            "postsPerSecond": postCount / duration if duration > 0 else 0.0,
+            "roundTripsPerPost": roundTrips / postCount if postCount > 0 else 0.0,
+            "latencies": collectLatencies()
+        }
+        results += [result]
+
+        print(f"Run {run + 1}: {postCount} posts in {duration:.2f}s, {result['postsPerSecond']:.1f} posts/s, {result['roundTripsPerPost']:.2f} round trips/post")
+        for name, summary in result["latencies"].items():
+            print(f"\t{name}: n={summary['count']} p50={summary['p50']*1000:.2f}ms p90={summary['p90']*1000:.2f}ms p99={summary['p99']*1000:.2f}ms")
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent = 4)
+
+    fetcher.close()
+
+
+if __name__ == "__main__":
+    main()
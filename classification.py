@@ -0,0 +1,128 @@
+# This class rates posts for hatespeech and offensive language using the hatesonar model.
+# Instead of calling Sonar.ping for every single post, posts are collected and scored in one vectorized batch by a
+# classifier backend (see classifierbackends.py).
+# The results are the same confidences Sonar.ping returns for the classes 'hate_speech' and 'offensive_language'.
+# If a classification cache is given, texts that were already rated aren't passed to the model again.
+# Optionally the model runs in a pool of worker processes, so several batches can be rated on different cores.
+
+from classifierbackends import ClassifierBackend, createBackend
+from classificationcache import ClassificationCache
+from metrics import metrics
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+
+# Returns the text a post is rated by. The scanners and rescore.py must rate the same text, so their ratings match.
+# authorName: Name of the post's author
+# content: Content of the post
+def getClassificationText(authorName: str, content: str) -> str:
+    # Replaces underscores with spaces so that the net can analyze the name properly
+    return f"{authorName.replace('_', ' ')}: {content}"
+
+# Classifier used by each worker process of a process pool
+workerClassifier = None
+
+# Loads the model in a new worker process
+def initWorker():
+    global workerClassifier
+
+    # Each process rates with a single thread, as the pool already uses one process per core
+    workerClassifier = PostClassifier(backend = createBackend(threads = 1))
+
+# Returns the version of the model loaded in a worker process
+def getWorkerVersion() -> str:
+    return workerClassifier.version
+
+# Rates several texts in a worker process
+# texts: List of texts to be rated
+def scoreInWorker(texts: list) -> list:
+    return workerClassifier.scoreBatch(texts)
+
+
+class PostClassifier:
+
+    # Constructor
+    # backend: Classifier backend to be used, the fastest available one is loaded if none is given
+    # cache: Classification cache to be checked before rating texts, or None to always use the model
+    # processes: Number of worker processes that run the model. If 0, the model runs in the calling thread.
+    def __init__(self, backend: ClassifierBackend = None, cache: ClassificationCache = None, processes: int = 0):
+        self.cache = cache
+        self.pool = None
+        self.backend = None
+
+        # The model is only loaded in the worker processes if a pool is used, so one of them reports its version
+        if processes > 0:
+            self.pool = ProcessPoolExecutor(max_workers = processes, initializer = initWorker)
+            self.version = self.pool.submit(getWorkerVersion).result()
+        else:
+            self.backend = createBackend() if backend is None else backend
+            self.version = self.backend.version
+
+        # Results are cached per version of the model that rated them, so ratings of another model are never reused
+        if self.cache is not None:
+            self.cache.modelVersion = self.version
+
+    # Rates a single text
+    # text: Text to be rated
+    # Returns a tuple of (hateRating, offRating)
+    def rate(self, text: str) -> tuple:
+        return self.rateBatch([text])[0]
+
+    # Rates several texts, using cached results where possible
+    # texts: List of texts to be rated
+    # Returns a list of (hateRating, offRating) tuples in the same order as the texts
+    def rateBatch(self, texts: list) -> list:
+        if self.cache is None:
+            return self.scoreBatch(texts)
+
+        ratings = [self.cache.get(text) for text in texts]
+
+        missCount = ratings.count(None)
+        metrics.increment("classification_cache_requests_total", len(texts) - missCount, {"result": "hit"})
+        metrics.increment("classification_cache_requests_total", missCount, {"result": "miss"})
+
+        if missCount == 0:
+            return ratings
+
+        # Rates every uncached text only once, even if it appears several times in the batch
+        missingTexts = list(dict.fromkeys(text for text, rating in zip(texts, ratings) if rating is None))
+
+        missingRatings = self.scoreBatch(missingTexts)
+        self.cache.putBatch(missingTexts, missingRatings)
+
+        newRatings = dict(zip(missingTexts, missingRatings))
+        return [newRatings[text] if rating is None else rating for text, rating in zip(texts, ratings)]
+
+    # Rates several texts in one pass through the model
+    # texts: List of texts to be rated
+    # Returns a list of (hateRating, offRating) tuples in the same order as the texts
+    def scoreBatch(self, texts: list) -> list:
+        if len(texts) == 0:
+            return []
+
+        startTime = time.perf_counter()
+        ratings = self.__scoreBatch(texts)
+
+        # Records the model time per post, so batches of different sizes can be compared
+        if metrics.enabled:
+            batchTime = time.perf_counter() - startTime
+            metrics.observe("classify_batch_seconds", batchTime)
+            metrics.observe("classify_seconds_per_post", batchTime / len(texts))
+            metrics.increment("classified_posts_total", len(texts))
+
+        return ratings
+
+    # Rates several texts in one pass through the model, without recording metrics
+    def __scoreBatch(self, texts: list) -> list:
+        # Waits for a worker process, so several threads can keep all processes busy
+        if self.pool is not None:
+            return self.pool.submit(scoreInWorker, texts).result()
+
+        hateRatings, offRatings = self.backend.score(texts)
+        return list(zip(hateRatings.tolist(), offRatings.tolist()))
+
+    # Stops the worker processes
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
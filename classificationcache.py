@@ -0,0 +1,87 @@
+# This class caches classification results, so identical texts (quotes, copypastas, re-scraped pages)
+# don't have to be rated again.
+# Results are kept in an in-memory LRU cache and optionally in an SQLite file on disk, so they survive restarts.
+# The key is a hash of the normalized text and the model version, so results of older models are never reused.
+
+from lrucache import LRUCache
+
+import hashlib
+import sqlite3
+import threading
+
+# Returns the version of the installed hatesonar model
+def getModelVersion() -> str:
+    try:
+        from importlib.metadata import version
+        return f"hatesonar-{version('hatesonar')}"
+    except Exception:
+        return "hatesonar-unknown"
+
+# Normalizes a text before hashing. Only whitespace is collapsed, as it doesn't change the model's rating.
+# text: Text to be normalized
+def normalizeText(text: str) -> str:
+    return " ".join(text.split())
+
+
+class ClassificationCache:
+
+    # Constructor
+    # maxSize: Maximum number of results kept in memory
+    # path: Path of the SQLite file used as on-disk store, or None to only cache in memory
+    # modelVersion: Version of the model whose results are cached. PostClassifier sets it to the version of its backend.
+    def __init__(self, maxSize: int = 100000, path: str = None, modelVersion: str = None):
+        self.modelVersion = modelVersion
+        self.memory = LRUCache(maxSize)
+        self.db = None
+        self.dbLock = threading.Lock()
+
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread = False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS Ratings (TextHash TEXT PRIMARY KEY, HateRating REAL, OffRating REAL);")
+            self.db.commit()
+
+    # Returns the cache key of a text
+    # text: Text that was rated
+    def getKey(self, text: str) -> str:
+        keyInput = f"{self.modelVersion}\n{normalizeText(text)}"
+        return hashlib.sha1(keyInput.encode("utf-8")).hexdigest()
+
+    # Returns the cached (hateRating, offRating) tuple of a text, or None if it wasn't rated yet
+    # text: Text to be looked up
+    def get(self, text: str):
+        key = self.getKey(text)
+        rating = self.memory.get(key)
+
+        if rating is None and self.db is not None:
+            with self.dbLock:
+                row = self.db.execute("SELECT HateRating, OffRating FROM Ratings WHERE TextHash=?;", (key,)).fetchone()
+
+            if row is not None:
+                rating = (row[0], row[1])
+                self.memory.put(key, rating)
+
+        return rating
+
+    # Stores the ratings of several texts
+    # texts: List of rated texts
+    # ratings: List of (hateRating, offRating) tuples in the same order as the texts
+    def putBatch(self, texts: list, ratings: list):
+        keys = [self.getKey(text) for text in texts]
+
+        for key, rating in zip(keys, ratings):
+            self.memory.put(key, rating)
+
+        if self.db is not None:
+            with self.dbLock:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO Ratings (TextHash, HateRating, OffRating) VALUES (?, ?, ?);",
+                    [(key, rating[0], rating[1]) for key, rating in zip(keys, ratings)]
+                )
+                self.db.commit()
+
+    # Closes the on-disk store
+    def close(self):
+        if self.db is not None:
+            with self.dbLock:
+                self.db.close()
+                self.db = None
@@ -0,0 +1,293 @@
+# This module contains the backends that run the hate speech model for PostClassifier.
+# A backend rates a batch of texts at once and returns the confidences for hate speech and offensive language as numpy
+# arrays. These are the same confidences Sonar.ping returns for the classes 'hate_speech' and 'offensive_language'.
+#   SonarBackend: Runs the model of the installed hatesonar version through the Sonar object
+#   OnnxBackend: Runs the ONNX model of hatesonar 0.1.0 and newer directly, with a fixed number of threads per process
+#   LinearModelBackend: Runs the TF-IDF vectorizer and logistic regression of hatesonar 0.0.7 from an exported file of
+#       plain numpy arrays. It doesn't need scikit-learn, scipy or joblib, so worker processes start faster and use less
+#       memory. Once the model was exported, it's used instead of hatesonar. The export stores the version of the
+#       model, and it's refused once another hatesonar version is installed, so it has to be exported again.
+#
+# Usage:
+#   python classifierbackends.py export                  Exports the installed hatesonar 0.0.7 model to sonar_model.npz
+#   python classifierbackends.py check [--texts <file>]  Compares the ratings of the backend with Sonar.ping
+
+from classificationcache import getModelVersion
+
+import argparse
+import os
+import re
+import sys
+import numpy as np
+
+# Path of the exported model
+EXPORTED_MODEL_PATH = "sonar_model.npz"
+
+# Indices of the classes in the model output (see Sonar.ping)
+HATE_CLASS = 0
+OFFENSIVE_CLASS = 1
+
+# Labels of the classes 'hate_speech', 'offensive_language' and 'neither' in the model output
+MODEL_CLASSES = [0, 1, 2]
+
+# Texts that are rated by the equivalence check if no other texts are given
+CHECK_TEXTS = [
+    "",
+    "gg wp",
+    "s1mple is the best player of all time",
+    "You are a fucking idiot, uninstall the game",
+    "Why do you even post here? Nobody cares about your opinion.",
+    "Greetings from Germany! Great match yesterday :)",
+    "these people should all be deported, they are animals",
+    "LOL NAVI CHOKED AGAIN",
+    "Ich hoffe, das Spiel wird morgen besser.",
+    "shut up you retarded faggot"
+]
+
+# Extracts the confidence values for hate speech and offensive language from a Sonar.ping result
+# rating: Result dictionary returned by Sonar.ping
+# Returns a tuple of (hateRating, offRating)
+def extractRatings(rating) -> tuple:
+    hateRating = 0
+    offRating = 0
+
+    for ratingClass in rating['classes']:
+        if ratingClass['class_name'] == 'hate_speech':
+            hateRating = ratingClass['confidence']
+        elif ratingClass['class_name'] == 'offensive_language':
+            offRating = ratingClass['confidence']
+
+    return (hateRating, offRating)
+
+# Converts the probabilities returned by the ONNX model to an array with one row per text and one column per class.
+# The model of hatesonar 0.1.0 ends with a ZipMap, which returns a {class: probability} dictionary per text instead.
+# probabilities: Second output of the ONNX session
+def getProbabilityArray(probabilities) -> np.ndarray:
+    if len(probabilities) > 0 and isinstance(probabilities[0], dict):
+        probabilities = [[row[modelClass] for modelClass in MODEL_CLASSES] for row in probabilities]
+
+    return np.asarray(probabilities, dtype = np.float64).reshape(-1, len(MODEL_CLASSES))
+
+# Returns the fastest backend that is available
+# threads: Number of threads a backend may use to rate a batch, 0 to let the backend decide.
+#          Worker processes use 1, so several processes don't compete for the same cores.
+def createBackend(threads: int = 0):
+    if os.path.exists(EXPORTED_MODEL_PATH):
+        return LinearModelBackend(EXPORTED_MODEL_PATH, getModelVersion())
+
+    import hatesonar.api
+    if hasattr(hatesonar.api, "DEFAULT_MODEL_FILE"):
+        return OnnxBackend(hatesonar.api.DEFAULT_MODEL_FILE, threads)
+
+    return SonarBackend()
+
+
+class ClassifierBackend:
+
+    # Version of the model, e.g. to store ratings per model version
+    version = "unknown"
+
+    # Rates several texts in one pass through the model
+    # texts: List of texts to be rated
+    # Returns a tuple of (hateRatings, offRatings), numpy arrays in the same order as the texts
+    def score(self, texts: list) -> tuple:
+        raise NotImplementedError()
+
+
+class SonarBackend(ClassifierBackend):
+
+    # Constructor
+    # sonar: Sonar instance to be used, a new one is loaded if none is given
+    def __init__(self, sonar = None):
+        if sonar is None:
+            from hatesonar import Sonar
+            sonar = Sonar()
+
+        self.sonar = sonar
+        self.version = getModelVersion()
+
+    def score(self, texts: list) -> tuple:
+        # Older hatesonar versions use a scikit-learn vectorizer and estimator
+        if hasattr(self.sonar, 'preprocessor') and hasattr(self.sonar, 'estimator'):
+            vectors = self.sonar.preprocessor.transform(texts)
+            probabilities = self.sonar.estimator.predict_proba(vectors)
+
+        # Newer hatesonar versions run an ONNX pipeline that accepts the raw texts
+        elif hasattr(self.sonar, 'sess'):
+            inputName = self.sonar.sess.get_inputs()[0].name
+            labels, probabilities = self.sonar.sess.run(None, {inputName: np.array(texts, dtype = object)})
+            probabilities = getProbabilityArray(probabilities)
+
+        # Falls back to rating each text on its own for unknown versions
+        else:
+            ratings = np.array([extractRatings(self.sonar.ping(text)) for text in texts], dtype = np.float64).reshape(-1, 2)
+            return (ratings[:, 0], ratings[:, 1])
+
+        probabilities = np.asarray(probabilities, dtype = np.float64)
+        return (probabilities[:, HATE_CLASS], probabilities[:, OFFENSIVE_CLASS])
+
+
+class OnnxBackend(ClassifierBackend):
+
+    # Constructor
+    # modelFile: Path of the ONNX model of hatesonar
+    # threads: Number of threads used to rate a batch, 0 for one per core
+    def __init__(self, modelFile, threads: int = 0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+
+        self.session = onnxruntime.InferenceSession(str(modelFile), options, providers = ["CPUExecutionProvider"])
+        self.version = getModelVersion()
+
+        # The texts are passed to the only input of the model, whatever it's named
+        self.inputName = self.session.get_inputs()[0].name
+
+    def score(self, texts: list) -> tuple:
+        labels, probabilities = self.session.run(None, {self.inputName: np.array(texts, dtype = object)})
+
+        probabilities = getProbabilityArray(probabilities)
+        return (probabilities[:, HATE_CLASS], probabilities[:, OFFENSIVE_CLASS])
+
+
+class LinearModelBackend(ClassifierBackend):
+
+    # Constructor
+    # Raises a ValueError if the model was exported from another version than the expected one
+    # path: Path of a model exported with exportSonarModel
+    # expectedVersion: Version of the installed model, or None to accept any version
+    def __init__(self, path: str = EXPORTED_MODEL_PATH, expectedVersion: str = None):
+        with np.load(path, allow_pickle = False) as model:
+            self.version = str(model["version"]) if "version" in model.files else "unknown"
+
+            if expectedVersion is not None and self.version != expectedVersion:
+                raise ValueError(f"{path} was exported from {self.version}, but {expectedVersion} is installed. Export the model again or delete {path}.")
+
+            terms = model["terms"].tolist()
+            self.idf = model["idf"]
+            self.coef = model["coef"]
+            self.intercept = model["intercept"]
+            self.tokenPattern = re.compile(str(model["tokenPattern"]))
+
+        self.vocabulary = {term: index for index, term in enumerate(terms)}
+
+    def score(self, texts: list) -> tuple:
+        # Collects the (text, term) pair of every known token, like the word analyzer of scikit-learn's TfidfVectorizer
+        rows = []
+        columns = []
+
+        for row, text in enumerate(texts):
+            for token in self.tokenPattern.findall(text.lower()):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    rows += [row]
+                    columns += [column]
+
+        # Counts how often each term occurs in each text
+        termCount = len(self.idf)
+        keys, counts = np.unique(np.array(rows, dtype = np.int64) * termCount + np.array(columns, dtype = np.int64), return_counts = True)
+        rows = keys // termCount
+        columns = keys % termCount
+
+        # TF-IDF weights, normalized to a euclidean length of 1 per text
+        weights = counts * self.idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights * weights, minlength = len(texts)))
+        norms[norms == 0] = 1
+        weights /= norms[rows]
+
+        # Decision function of each class, then one-vs-rest probabilities like LogisticRegression.predict_proba
+        decisions = np.stack([
+            np.bincount(rows, weights * self.coef[columns, classIndex], minlength = len(texts))
+            for classIndex in range(self.coef.shape[1])
+        ], axis = 1) + self.intercept
+
+        probabilities = 1 / (1 + np.exp(-decisions))
+        probabilities /= probabilities.sum(axis = 1, keepdims = True)
+
+        return (probabilities[:, HATE_CLASS], probabilities[:, OFFENSIVE_CLASS])
+
+
+# Exports the model of hatesonar 0.0.7 for LinearModelBackend
+# path: Path of the exported model
+# sonar: Sonar instance whose model is exported, a new one is loaded if none is given
+def exportSonarModel(path: str = EXPORTED_MODEL_PATH, sonar = None):
+    if sonar is None:
+        from hatesonar import Sonar
+        sonar = Sonar()
+
+    if not hasattr(sonar, 'preprocessor') or not hasattr(sonar, 'estimator'):
+        raise ValueError("Only the scikit-learn model of older hatesonar versions can be exported, newer versions run an ONNX model (see OnnxBackend)")
+
+    vectorizer = sonar.preprocessor
+    estimator = sonar.estimator
+
+    # LinearModelBackend only implements the configuration hatesonar was trained with
+    if (vectorizer.analyzer != "word" or tuple(vectorizer.ngram_range) != (1, 1) or not vectorizer.lowercase
+            or vectorizer.tokenizer is not None or vectorizer.preprocessor is not None or vectorizer.strip_accents is not None
+            or vectorizer.binary or vectorizer.norm != "l2" or not vectorizer.use_idf or vectorizer.sublinear_tf):
+        raise ValueError("The vectorizer of the model uses options that LinearModelBackend doesn't support")
+
+    # liblinear always fits one binary classifier per class
+    if (estimator.solver != "liblinear" and getattr(estimator, "multi_class", None) != "ovr") or estimator.coef_.shape[0] < 3:
+        raise ValueError("The estimator of the model isn't a one-vs-rest logistic regression")
+
+    terms = sorted(vectorizer.vocabulary_, key = vectorizer.vocabulary_.get)
+
+    np.savez_compressed(
+        path,
+        terms = np.array(terms),
+        idf = np.asarray(vectorizer.idf_, dtype = np.float64),
+        coef = np.ascontiguousarray(estimator.coef_.T, dtype = np.float64),
+        intercept = np.asarray(estimator.intercept_, dtype = np.float64),
+        tokenPattern = np.array(vectorizer.token_pattern),
+        version = np.array(getModelVersion())
+    )
+
+# Compares the ratings of a backend with the ratings of Sonar.ping
+# backend: Backend to be checked
+# texts: List of texts to be rated
+# Returns the largest difference of a rating
+def compareWithSonar(backend: ClassifierBackend, texts: list) -> float:
+    from hatesonar import Sonar
+    sonar = Sonar()
+
+    expected = np.array([extractRatings(sonar.ping(text)) for text in texts], dtype = np.float64).reshape(-1, 2)
+    hateRatings, offRatings = backend.score(texts)
+
+    return float(max(np.max(np.abs(hateRatings - expected[:, 0]), initial = 0), np.max(np.abs(offRatings - expected[:, 1]), initial = 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Exports and checks the backends of the hate speech classifier")
+    parser.add_argument("command", choices = ["export", "check"], help = "export the installed hatesonar model, or check that a backend rates like Sonar.ping")
+    parser.add_argument("--path", default = EXPORTED_MODEL_PATH, help = "path of the exported model")
+    parser.add_argument("--texts", default = None, help = "file with one text per line to be rated by the check")
+    parser.add_argument("--tolerance", type = float, default = 1e-6, help = "largest difference to Sonar.ping that is accepted")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        exportSonarModel(args.path)
+        print(f"Exported the model to {args.path} ({os.path.getsize(args.path)} bytes).")
+        return
+
+    if os.path.exists(args.path):
+        backend = LinearModelBackend(args.path, getModelVersion())
+    else:
+        backend = createBackend()
+
+    texts = CHECK_TEXTS
+    if args.texts is not None:
+        with open(args.texts, "r", encoding = "utf-8") as f:
+            texts = [line.rstrip("\n") for line in f]
+
+    difference = compareWithSonar(backend, texts)
+    print(f"{type(backend).__name__} ({backend.version}): largest difference to Sonar.ping on {len(texts)} texts is {difference:.2e}")
+
+    if difference > args.tolerance:
+        print("The backend doesn't rate like Sonar.ping.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# This module controls the scraper through the Signals table and a local fast path.
+# Signals:
+#   End: If set to 1, the scraper stops at the next thread boundary
+#   Refresh: Time in minutes between refreshs
+# Reading the Signals table is cached for a few seconds, so checking for a stop signal between threads is cheap.
+# While the database is unavailable, the last values that were read are used.
+# Additionally, the scraper reacts immediately to:
+#   - SIGTERM/SIGINT: Stop at the next thread boundary
+#   - SIGHUP: Re-read the signals from the database
+#   - The control file (control.txt by default). It is read and deleted as soon as it appears and may contain:
+#       stop            Stop at the next thread boundary
+#       refresh <min>   Change the time between refreshs
+
+from mysqlwrapper import MySQLWrapper, TRANSIENT_ERRORS
+from datetime import datetime, timedelta
+
+import os
+import signal
+import threading
+import time
+
+# Default path of the control file
+CONTROL_FILE = "control.txt"
+
+# Returns the time between refreshs in minutes
+# mysql: Database connection
+def getRefreshTime(mysql: MySQLWrapper):
+    mysql.query("SELECT Value FROM Signals WHERE SignalName='Refresh';")
+    results = mysql.fetchResults()
+
+    if results is None:
+        return 30
+    else:
+        return results[0][0]
+
+# Sets the time between refreshs in minutes
+# mysql: Database connection
+# minutes: Time between refreshs
+def setRefreshTime(mysql: MySQLWrapper, minutes: int):
+    mysql.query("INSERT INTO Signals (SignalName, Value) VALUES (%s, %s) ON DUPLICATE KEY UPDATE Value=%s;", ('Refresh', minutes, minutes,))
+    mysql.commit()
+
+# Sets the End-Signal of the database
+def setEndSignal(mysql: MySQLWrapper, enable: bool):
+    enableInt = 0
+    if enable:
+        enableInt = 1
+    mysql.query("INSERT INTO Signals (SignalName, Value) VALUES (%s, %s) ON DUPLICATE KEY UPDATE Value=%s;", ('End', enableInt, enableInt,))
+    mysql.commit()
+
+# Retrieves the End-Signal of the database
+def getEndSignal(mysql: MySQLWrapper):
+    mysql.query("SELECT Value FROM Signals WHERE SignalName='End';")
+    results = mysql.fetchResults()
+
+    if results is None or results[0][0] == 1:
+        return True
+    else:
+        return False
+
+# Writes a command to the control file of a running scraper on the same host
+# command: Command to be written, e.g. "stop" or "refresh 5"
+# path: Path of the control file
+def sendLocalCommand(command: str, path: str = CONTROL_FILE):
+    with open(path, "a") as f:
+        f.write(f"{command}\n")
+
+
+class ControlChannel:
+
+    # Constructor
+    # mysql: Database connection used to read the signals. It should use autocommit to see changes of other connections.
+    # ttl: Time in seconds for which signal values from the database are reused
+    # controlFile: Path of the control file, or None to disable it
+    def __init__(self, mysql: MySQLWrapper, ttl: float = 30.0, controlFile: str = CONTROL_FILE):
+        self.mysql = mysql
+        self.ttl = ttl
+        self.controlFile = controlFile
+
+        # Set as soon as a stop is requested. Can be checked from any thread.
+        self.stopEvent = threading.Event()
+
+        # Set whenever the cached signals should be re-read or the refresh time changed
+        self.changeEvent = threading.Event()
+
+        self.endSignal = False
+        self.refreshTime = 15
+        self.lastRead = None
+
+    # Resets the End-Signal and removes stale control commands from a previous run
+    def reset(self):
+        setEndSignal(self.mysql, False)
+
+        if self.controlFile is not None and os.path.exists(self.controlFile):
+            os.remove(self.controlFile)
+
+        self.stopEvent.clear()
+        self.lastRead = None
+
+    # Installs handlers for SIGTERM, SIGINT and SIGHUP. Must be called from the main thread.
+    def installSignalHandlers(self):
+        signal.signal(signal.SIGTERM, self.__handleStopSignal)
+        signal.signal(signal.SIGINT, self.__handleStopSignal)
+
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.__handleReloadSignal)
+
+    def __handleStopSignal(self, signum, frame):
+        print("Received stop signal, stopping after the current thread.")
+        self.requestStop()
+
+    def __handleReloadSignal(self, signum, frame):
+        self.invalidate()
+
+    # Requests the scraper to stop at the next thread boundary
+    def requestStop(self):
+        self.stopEvent.set()
+        self.changeEvent.set()
+
+    # Forces the signals to be re-read from the database on the next check
+    def invalidate(self):
+        self.lastRead = None
+        self.changeEvent.set()
+
+    # Returns True if a stop was requested. Only checks local state, so it's safe to call from any thread.
+    def isStopRequested(self) -> bool:
+        return self.stopEvent.is_set()
+
+    # Executes the commands of the control file and deletes it
+    def __readControlFile(self):
+        if self.controlFile is None or not os.path.exists(self.controlFile):
+            return
+
+        with open(self.controlFile, "r") as f:
+            commands = f.read().splitlines()
+
+        os.remove(self.controlFile)
+
+        for command in commands:
+            words = command.split()
+
+            if len(words) == 1 and words[0] == "stop":
+                self.requestStop()
+
+            elif len(words) == 2 and words[0] == "refresh" and words[1].isdigit():
+                self.refreshTime = int(words[1])
+                self.changeEvent.set()
+
+                try:
+                    setRefreshTime(self.mysql, int(words[1]))
+                except TRANSIENT_ERRORS as e:
+                    print(f"Database unavailable, the refresh time only changed until the signals are read again: {e}")
+
+            elif len(words) > 0:
+                print(f"Unknown control command: {command}")
+
+    # Re-reads the signals from the database if the cached values expired
+    def __readSignals(self):
+        if self.lastRead is not None and time.monotonic() - self.lastRead < self.ttl:
+            return
+
+        # The check is repeated after the ttl, so an unavailable database isn't queried on every check
+        self.lastRead = time.monotonic()
+
+        try:
+            endSignal = getEndSignal(self.mysql)
+            refreshTime = getRefreshTime(self.mysql)
+        except TRANSIENT_ERRORS as e:
+            print(f"Database unavailable, using the last signals: {e}")
+            return
+
+        self.endSignal = endSignal
+        self.refreshTime = refreshTime
+
+        if self.endSignal:
+            self.requestStop()
+
+    # Returns True if the scraper should stop. Must only be called from the thread that owns the database connection.
+    def shouldStop(self) -> bool:
+        if not self.stopEvent.is_set():
+            self.__readControlFile()
+            self.__readSignals()
+
+        return self.stopEvent.is_set()
+
+    # Returns the time between refreshs in minutes
+    def getRefreshTime(self) -> int:
+        self.__readSignals()
+        return self.refreshTime
+
+    # Waits for a number of seconds or until a stop is requested
+    # seconds: Maximum time to wait
+    def sleep(self, seconds: float):
+        endTime = time.monotonic() + seconds
+
+        while not self.shouldStop():
+            remainingTime = endTime - time.monotonic()
+            if remainingTime <= 0:
+                return
+
+            self.changeEvent.wait(min(remainingTime, 1.0))
+            self.changeEvent.clear()
+
+    # Waits until the next refresh cycle should start or a stop is requested.
+    # Changes of the refresh time are applied while waiting.
+    # lastUpdateTime: Start time of the last refresh cycle
+    def waitForNextCycle(self, lastUpdateTime: datetime):
+        while not self.shouldStop():
+            nextUpdateTime = lastUpdateTime + timedelta(minutes = self.getRefreshTime())
+            remainingTime = (nextUpdateTime - datetime.now()).total_seconds()
+
+            if remainingTime <= 0:
+                return
+
+            # Wakes up early on stop requests or refresh changes, and at least every second to check the control file
+            self.changeEvent.wait(min(remainingTime, 1.0))
+            self.changeEvent.clear()
@@ -1,52 +1,312 @@
 from authorization import AuthorizationInfo
-from mysqlwrapper import MySQLWrapper
+from mysqlwrapper import MySQLWrapper, TRANSIENT_ERRORS
 from forums import *
 
 import discord
 from discord.ext import commands
 
-from hatesonar import Sonar
+from classification import PostClassifier, getClassificationText
+from classificationcache import ClassificationCache
+from asyncwriter import AsyncPostWriter
+from spool import PostSpool, SpoolDrainer, encodePost, decodePost
 
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import sys
+import traceback
+
+
+# Channels that are observed by default, as (channel ID, forum name, channel name)
+DEFAULT_CHANNELS = [
+    ("456834448558653451", "ECC-Discord", "#general-chat"),
+    ("468121733929369610", "ECC-Discord", "#shitposting-and-media")
+]
+
+
+# Number of messages that are classified and written at once while reading the history of a channel
+HISTORY_BATCH_SIZE = 100
+
+# Pause in seconds after every batch of the history, on top of the rate limits handled by discord.py,
+# so reading the history doesn't slow down the bot
+HISTORY_BATCH_DELAY = 1.0
+
+
+# A Discord channel that is observed. Its thread is created in the database when its first message arrives.
+class ObservedChannel:
+
+    def __init__(self, channelID: str, forumName: str, channelName: str):
+        self.channelID = channelID
+        self.forumName = forumName
+        self.channelName = channelName
+        self.thread = None
+
+
+# Adds a channel to the observed channels, unless it's already configured
+# mysql: Database connection
+# channelID: Discord ID of the channel
+# forumName: Name of the forum the channel belongs to, usually one per server
+# channelName: Name of the channel
+# guildID: Discord ID of the server, or None
+def addChannel(mysql: MySQLWrapper, channelID: str, forumName: str, channelName: str, guildID: str = None):
+    mysql.query(
+        "INSERT IGNORE INTO DiscordChannels (ChannelID, GuildID, ForumName, ChannelName) VALUES (%s, %s, %s, %s);",
+        (channelID, guildID, forumName, channelName,)
+    )
+    mysql.commit()
+
+# Returns a dictionary mapping the IDs of all enabled channels to ObservedChannel objects
+# mysql: Database connection
+def loadChannels(mysql: MySQLWrapper) -> dict:
+    mysql.query("SELECT ChannelID, ForumName, ChannelName FROM DiscordChannels WHERE Enabled=1;")
+    results = mysql.fetchResults()
+
+    if results is None:
+        return {}
+
+    # Keys are the integer IDs discord.py uses, so messages can be looked up without conversion
+    return {int(row[0]): ObservedChannel(row[0], row[1], row[2]) for row in results}
+
+# Creates the forum and thread of a channel in the database, or looks them up if they exist
+# mysql: Database connection
+# channel: Observed channel
+# author: Author of the thread
+def createChannelThread(mysql: MySQLWrapper, channel: ObservedChannel, author: ForumAuthor) -> ForumThread:
+    forum = Forum(channel.forumName, channel.forumName)
+    forum.insert(mysql)
+
+    thread = ForumThread(channel.channelName, author, forum.sqlID, hltvID = channel.channelID)
+    thread.insert(mysql)
+    mysql.commit()
+
+    return thread
+
+
+# Returns the ID of the message after which the history of a channel is read, or None if none of its messages are stored
+# mysql: Database connection
+# channel: Observed channel
+# thread: Thread of the channel
+def getHistoryCheckpoint(mysql: MySQLWrapper, channel: ObservedChannel, thread: ForumThread):
+    mysql.query("SELECT LastMessageID FROM DiscordBackfill WHERE ChannelID=%s;", (channel.channelID,))
+    results = mysql.fetchResults()
+
+    if results is not None:
+        return results[0][0]
+
+    # Without a checkpoint, e.g. for channels observed before the history was read, reading continues after the newest
+    # stored message. The HLTVID of a message is '#' followed by its ID.
+    mysql.query(
+        "SELECT MAX(CAST(SUBSTRING(HLTVID, 2) AS UNSIGNED)) FROM Posts WHERE ThreadID=%s AND HLTVID LIKE '#%%';",
+        (thread.sqlID,)
+    )
+    results = mysql.fetchResults()
+
+    if results is None:
+        return None
+    else:
+        return results[0][0]
+
+# Moves the checkpoint of a channel's history behind a message. The checkpoint only moves forward.
+# mysql: Database connection
+# channelID: ID of the observed channel
+# lastMessageID: ID of the newest message that was read
+def saveHistoryCheckpoint(mysql: MySQLWrapper, channelID: str, lastMessageID: int):
+    mysql.query(
+        (
+            "INSERT INTO DiscordBackfill (ChannelID, LastMessageID) VALUES (%s, %s) "
+            "ON DUPLICATE KEY UPDATE LastMessageID=GREATEST(LastMessageID, VALUES(LastMessageID));"
+        ),
+        (channelID, lastMessageID,)
+    )
+
+# Writes a batch of messages from the history of a channel and moves its checkpoint behind them in one transaction
+# mysql: Database connection
+# spool: Spool the batch is appended to instead of writing it to the database, or None
+# channel: Observed channel
+# posts: Posts of the messages, in the order in which they were written
+# lastMessageID: ID of the newest message of the batch
+def writeHistoryBatch(mysql: MySQLWrapper, spool: PostSpool, channel: ObservedChannel, posts: list, lastMessageID: int):
+    # The spool's drainer writes the posts and moves the checkpoint once the database is reachable
+    if spool is not None:
+        spool.append({
+            "posts": [encodePost(post) for post in posts],
+            "checkpoint": {"channelID": channel.channelID, "lastMessageID": lastMessageID}
+        })
+        return
+
+    insertAuthors(mysql, [post.author for post in posts])
+    insertPosts(mysql, posts)
+    saveHistoryCheckpoint(mysql, channel.channelID, lastMessageID)
+    mysql.commit()
+
+# Writes spooled records to the database: the posts of new messages and of history batches, and the checkpoints of the
+# history batches. The checkpoints are committed together with their posts, so a checkpoint never skips unsaved messages.
+# mysql: Database connection of the spool drainer
+# records: Spooled records
+def replayMessages(mysql: MySQLWrapper, records: list):
+    posts = [decodePost(post) for record in records for post in record["posts"]]
+
+    insertAuthors(mysql, [post.author for post in posts])
+    insertPosts(mysql, posts)
+
+    for record in records:
+        checkpoint = record.get("checkpoint")
+        if checkpoint is not None:
+            saveHistoryCheckpoint(mysql, checkpoint["channelID"], checkpoint["lastMessageID"])
+
+    mysql.commit()
 
 
 class MainCog(commands.Cog):
 
-    def __init__(self, bot, mysql: MySQLWrapper):
+    def __init__(self, bot, mysql: MySQLWrapper, spool: PostSpool = None):
         self.bot = bot
         self.mysql = mysql
-        self.sonar = Sonar()
-
-        self.discordForum = Forum("ECC-Discord", "ECC-Discord")
-        self.discordForum.insert(self.mysql)
+        self.classifier = PostClassifier(cache = ClassificationCache(path = "classification_cache.db"))
 
         self.discordAuthor = ForumAuthor("Discord", "-1")
         self.discordAuthor.insert(self.mysql)
+        self.mysql.commit()
+
+        for channelID, forumName, channelName in DEFAULT_CHANNELS:
+            addChannel(self.mysql, channelID, forumName, channelName)
+
+        # Maps channel IDs to observed channels
+        self.channels = loadChannels(self.mysql)
+
+        # Classification and database writes run outside of the event loop, so they don't stall the bot
+        self.classificationExecutor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "classifier")
+        self.spool = spool
+        self.writer = AsyncPostWriter(self.mysql, spool = spool)
+
+        # Set while the history of the channels is read, so it's only read once at a time
+        self.readingHistory = False
+        self.historyTask = None
 
-        # self.generalThread = ForumThread("#general-chat", self.discordAuthor, self.discordForum.sqlID, hltvID = "709753463323754539")
-        self.generalThread = ForumThread("#general-chat", self.discordAuthor, self.discordForum.sqlID, hltvID = "456834448558653451")
-        self.generalThread.insert(self.mysql)
+    # Writes all queued posts and stops the background workers
+    async def close(self):
+        await self.writer.close()
+        self.classificationExecutor.shutdown()
 
-        # self.shitpostingThread = ForumThread("#shitposting-and-media", self.discordAuthor, self.discordForum.sqlID, hltvID = "727107131416903750")
-        self.shitpostingThread = ForumThread("#shitposting-and-media", self.discordAuthor, self.discordForum.sqlID, hltvID = "468121733929369610")
-        self.shitpostingThread.insert(self.mysql)
+    # Returns the thread of an observed channel, creating it in the database on its first message
+    async def getThread(self, channel: ObservedChannel) -> ForumThread:
+        if channel.thread is None:
+            channel.thread = await self.writer.run(createChannelThread, channel, self.discordAuthor)
 
-        self.mysql.db.commit()
-    
+        return channel.thread
+
+    # Reloads the observed channels from the DiscordChannels table
+    @commands.command(name = "reload")
+    @commands.is_owner()
+    async def reloadChannels(self, ctx):
+        self.channels = await self.writer.run(loadChannels)
+        await ctx.send(f"Observing {len(self.channels)} channels.")
+
+    # Reads the messages of all observed channels that were sent while the bot was offline.
+    # Each channel is read from its checkpoint or its newest stored message, or from its first message if none is stored.
+    async def readHistory(self):
+        if self.readingHistory:
+            return
+
+        self.readingHistory = True
+
+        try:
+            for channel in list(self.channels.values()):
+                try:
+                    messageCount = await self.readChannelHistory(channel)
+                    print(f"Read {messageCount} messages from the history of {channel.channelName}.")
+
+                except discord.HTTPException as e:
+                    print(f"Failed to read the history of {channel.channelName}: {e}")
+
+                # The history of the channel is read again on the next reconnect or with .ecchistory
+                except TRANSIENT_ERRORS as e:
+                    print(f"Database unavailable, skipping the history of {channel.channelName}: {e}")
+
+        finally:
+            self.readingHistory = False
+
+    # Reads the history of a channel after its checkpoint in batches
+    # Returns the number of messages that were read
+    # channel: Observed channel
+    async def readChannelHistory(self, channel: ObservedChannel) -> int:
+        discordChannel = self.bot.get_channel(int(channel.channelID))
+        if discordChannel is None:
+            return 0
+
+        thread = await self.getThread(channel)
+        lastMessageID = await self.writer.run(getHistoryCheckpoint, channel, thread)
+        after = discord.Object(id = lastMessageID) if lastMessageID is not None else None
+
+        messageCount = 0
+        batch = []
+
+        # Messages that were already stored by on_message are read again, but not duplicated, as posts are upserted
+        async for message in discordChannel.history(limit = None, after = after, oldest_first = True):
+            batch += [message]
+
+            if len(batch) >= HISTORY_BATCH_SIZE:
+                await self.saveHistoryBatch(channel, thread, batch)
+                messageCount += len(batch)
+                batch = []
+
+                await asyncio.sleep(HISTORY_BATCH_DELAY)
+
+        if len(batch) > 0:
+            await self.saveHistoryBatch(channel, thread, batch)
+            messageCount += len(batch)
+
+        return messageCount
+
+    # Classifies a batch of messages at once and writes them together with the new checkpoint, through the spool if
+    # there is one
+    # channel: Observed channel
+    # thread: Thread of the channel
+    # messages: Messages in the order in which they were sent
+    async def saveHistoryBatch(self, channel: ObservedChannel, thread: ForumThread, messages: list):
+        texts = [getClassificationText(message.author.name, message.clean_content) for message in messages]
+
+        loop = asyncio.get_running_loop()
+        ratings = await loop.run_in_executor(self.classificationExecutor, self.classifier.rateBatch, texts)
+
+        posts = []
+        for message, (hateRating, offRating) in zip(messages, ratings):
+            author = ForumAuthor(message.author.name, str(message.author.id))
+            posts += [ForumPost(message.id, thread.sqlID, -1, author, message.clean_content, message.created_at, hateRating, offRating)]
+
+        await self.writer.run(writeHistoryBatch, self.spool, channel, posts, messages[-1].id)
+
+    # Reads the history of all observed channels
+    @commands.command(name = "history")
+    @commands.is_owner()
+    async def readHistoryCommand(self, ctx):
+        await ctx.send("Reading the history of all observed channels.")
+        await self.readHistory()
+        await ctx.send("Finished reading the history.")
+
+    # Prints the error of a history task that failed
+    # task: Finished task
+    def logHistoryTask(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print("Failed to read the history:")
+            traceback.print_exception(type(task.exception()), task.exception(), task.exception().__traceback__)
+
+    # Reads the messages sent while the bot was offline whenever it (re-)connects
     @commands.Cog.listener()
-    async def on_message(self, message):
+    async def on_ready(self):
+        # The reference keeps the task from being garbage collected while it runs
+        self.historyTask = asyncio.get_running_loop().create_task(self.readHistory())
+        self.historyTask.add_done_callback(self.logHistoryTask)
 
-        # Checks if the message is in an observed channel and saves thread ID
-        channelID = str(message.channel.id)
-        threadID = 0
+    @commands.Cog.listener()
+    async def on_message(self, message):
 
-        if channelID == self.generalThread.hltvID:
-            threadID = self.generalThread.sqlID
-        elif channelID == self.shitpostingThread.hltvID:
-            threadID = self.shitpostingThread.sqlID
-        else:
+        # Ignores messages of channels that aren't observed before doing anything else
+        channel = self.channels.get(message.channel.id)
+        if channel is None:
             return
 
+        thread = await self.getThread(channel)
+
         # Compiles message info
         messageID = message.id
         content = message.clean_content
@@ -55,25 +315,27 @@ class MainCog(commands.Cog):
         timestamp = message.created_at
 
         # Calculates hate speech and offensive language rating
-        rating = self.sonar.ping(f"{authorName}: {content}")
-        hateRating = 0
-        offRating = 0
+        loop = asyncio.get_running_loop()
+        hateRating, offRating = await loop.run_in_executor(self.classificationExecutor, self.classifier.rate, getClassificationText(authorName, content))
+
+        # Queues the post, it's written to the database with the next batch
+        if self.writer.task is None:
+            self.writer.start()
 
-        # Extracts confidence values for hate speech and offensive language from result
-        for ratingClass in rating['classes']:
-            if ratingClass['class_name'] == 'hate_speech':
-                hateRating = ratingClass['confidence']
-            elif ratingClass['class_name'] == 'offensive_language':
-                offRating = ratingClass['confidence']
+        author = ForumAuthor(authorName, str(authorID))
+        post = ForumPost(messageID, thread.sqlID, -1, author, content, timestamp, hateRating, offRating)
+        await self.writer.put(post)
 
-        author = ForumAuthor(authorName, authorID)
-        author.insert(self.mysql)
 
-        post = ForumPost(messageID, threadID, -1, author, content, timestamp, hateRating, offRating)
-        post.insert(self.mysql)
+# Bot that flushes the queued posts of the cog before it disconnects
+class ScanBot(commands.Bot):
 
-        self.mysql.db.commit()
-      
+    async def close(self):
+        cog = self.get_cog("MainCog")
+        if cog is not None:
+            await cog.close()
+
+        await super().close()
 
 
 
@@ -83,9 +345,21 @@ print("Connecting to database...")
 mysql = MySQLWrapper(auth)
 initializeTables(mysql, False)
 
+# Loads the SQL IDs of known forums, threads and authors to skip redundant upserts
+warmIdentityMaps(mysql)
+
+# New messages and the history are spooled to disk first and written to the database in the background, so they survive outages
+spool = PostSpool("discord_spool")
+drainer = SpoolDrainer(spool, auth, replayMessages)
+drainer.start()
+
 print("Initializing bot...")
-bot = commands.Bot(command_prefix = '.ecc')
-bot.add_cog(MainCog(bot, mysql))
+bot = ScanBot(command_prefix = '.ecc')
+bot.add_cog(MainCog(bot, mysql, spool))
 
 print("Starting bot...")
-bot.run(auth.discordToken)
\ No newline at end of file
+bot.run(auth.discordToken)
+
+# Writes the remaining spooled messages. Messages that can't be written stay in the spool until the next start.
+drainer.close()
+spool.close()
\ No newline at end of file
@@ -0,0 +1,254 @@
+# This script exports the posts with their thread, forum and author into files for analysis, so analysts don't have
+# to run their joins against the live database.
+# The joined rows are read with a server-side cursor in constant memory and written in chunks of at most ROWS_PER_FILE
+# rows per file, as Parquet if pyarrow is installed and as CSV otherwise.
+# Exports are incremental: the highest exported PostID is saved as a watermark in the output directory, and the next
+# export only reads newer posts. Every chunk is written to a temporary file first, and the watermark is only moved once
+# the chunk is complete, so an interrupted export continues with the first incomplete chunk.
+# Several connections insert posts concurrently, so a post can be committed after posts with a higher PostID and would
+# be skipped once the watermark passed it. Every export therefore remembers the highest PostID at its start, and posts
+# are only exported up to the highest PostID that existed EXPORT_SAFETY_SECONDS ago, by when all transactions that
+# inserted lower PostIDs are committed. If no earlier export remembered one, the export waits for the safety time.
+# Posts that were updated after they were exported (e.g. rescored) aren't exported again; start a new output
+# directory for a full export.
+#
+# Usage:
+#   python export.py <output directory> [--format parquet|csv] [--auth replica_auth.json] [--no-content]
+#
+# Use the auth file of a read replica if there is one, so the export doesn't slow down the scraper.
+
+from mysqlwrapper import MySQLWrapper
+from authorization import AuthorizationInfo
+
+import argparse
+import csv
+import json
+import os
+import time
+
+# Parquet files are only written if pyarrow is installed, otherwise CSV is used
+try:
+    import pyarrow
+    import pyarrow.parquet
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Number of rows read from the server at once, which is also the size of the row groups in Parquet files
+BATCH_SIZE = 10000
+
+# Maximum number of rows per file
+ROWS_PER_FILE = 1000000
+
+# Name of the file in the output directory that stores the highest exported PostID
+WATERMARK_FILE = "watermark.json"
+
+# Time in seconds after which all posts up to the highest PostID at that time are assumed to be committed, like
+# ROLLUP_SAFETY_SECONDS in rollups.py
+EXPORT_SAFETY_SECONDS = 300
+
+# Exported columns as (column name, SQL expression, type). The PostID has to be the first column.
+EXPORT_COLUMNS = [
+    ("PostID", "Posts.PostID", "int"),
+    ("PostHLTVID", "Posts.HLTVID", "str"),
+    ("ReplyNum", "Posts.ReplyNum", "int"),
+    ("Time", "Posts.Time", "datetime"),
+    ("HateRating", "Posts.HateRating", "float"),
+    ("OffRating", "Posts.OffRating", "float"),
+    ("AuthorID", "Posts.AuthorID", "int"),
+    ("AuthorHLTVID", "Authors.HLTVID", "str"),
+    ("AuthorName", "Authors.Name", "str"),
+    ("ThreadID", "Posts.ThreadID", "int"),
+    ("ThreadHLTVID", "Threads.HLTVID", "str"),
+    ("ThreadTitle", "Threads.Title", "str"),
+    ("ForumID", "Threads.ForumID", "int"),
+    ("ForumName", "Forums.Name", "str"),
+    ("Content", "Posts.Content", "str")
+]
+
+# Returns the highest exported PostID of an output directory, 0 if nothing was exported yet, and the highest PostIDs
+# seen by earlier exports as a list of [time, PostID] pairs
+# outputDir: Output directory of the export
+def loadWatermark(outputDir: str) -> tuple:
+    path = os.path.join(outputDir, WATERMARK_FILE)
+
+    if not os.path.exists(path):
+        return (0, [])
+
+    with open(path, "r") as f:
+        watermark = json.load(f)
+
+    return (watermark["lastPostID"], watermark.get("maxPostIDs", []))
+
+# Saves the highest exported PostID of an output directory
+# outputDir: Output directory of the export
+# lastPostID: Highest PostID of the last complete chunk
+# maxPostIDs: Highest PostIDs seen by exports that aren't older than the safety time yet, as [time, PostID] pairs
+def saveWatermark(outputDir: str, lastPostID: int, maxPostIDs: list):
+    path = os.path.join(outputDir, WATERMARK_FILE)
+    temporaryPath = f"{path}.tmp"
+
+    with open(temporaryPath, "w") as f:
+        json.dump({"lastPostID": lastPostID, "maxPostIDs": maxPostIDs}, f)
+
+    os.replace(temporaryPath, path)
+
+# Returns the highest PostID up to which all posts are committed, waiting for the safety time if necessary
+# mysql: Database connection
+# maxPostIDs: Highest PostIDs seen by earlier exports as [time, PostID] pairs. The current one is added, and the ones
+#             that are used up are removed.
+# safetySeconds: Time after which all posts up to the highest PostID at that time are assumed to be committed
+def getSettledPostID(mysql: MySQLWrapper, maxPostIDs: list, safetySeconds: float) -> int:
+    mysql.query("SELECT MAX(PostID) FROM Posts;")
+    results = mysql.fetchResults()
+
+    # Ends the read snapshot, so posts committed in the meantime are visible to the export
+    mysql.commit()
+
+    now = time.time()
+    maxPostIDs += [[now, results[0][0] if results is not None else 0]]
+
+    settledPostIDs = [postID for seenAt, postID in maxPostIDs if seenAt <= now - safetySeconds]
+    if len(settledPostIDs) == 0:
+        print(f"Waiting {safetySeconds:.0f}s until the newest posts are committed...")
+        time.sleep(safetySeconds)
+        settledPostIDs = [maxPostIDs[-1][1]]
+
+    maxPostIDs[:] = [[seenAt, postID] for seenAt, postID in maxPostIDs if seenAt > now - safetySeconds and postID > max(settledPostIDs)]
+    return max(settledPostIDs)
+
+
+# Writes rows to a CSV file
+class CSVChunkWriter:
+
+    # Constructor
+    # path: Path of the file
+    # columns: Exported columns
+    def __init__(self, path: str, columns: list):
+        self.file = open(path, "w", newline = "", encoding = "utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, expression, columnType in columns])
+
+    # Writes a batch of rows
+    def writeRows(self, rows: list):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+# Writes rows to a Parquet file, one row group per batch
+class ParquetChunkWriter:
+
+    # Maps the column types to Arrow types
+    ARROW_TYPES = {
+        "int": lambda: pyarrow.int64(),
+        "float": lambda: pyarrow.float32(),
+        "str": lambda: pyarrow.string(),
+        "datetime": lambda: pyarrow.timestamp("s")
+    }
+
+    # Constructor
+    # path: Path of the file
+    # columns: Exported columns
+    def __init__(self, path: str, columns: list):
+        self.schema = pyarrow.schema([
+            (name, ParquetChunkWriter.ARROW_TYPES[columnType]()) for name, expression, columnType in columns
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression = "zstd")
+
+    # Writes a batch of rows
+    def writeRows(self, rows: list):
+        columns = [[row[index] for row in rows] for index in range(len(self.schema))]
+        self.writer.write_table(pyarrow.Table.from_arrays(columns, schema = self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+# Exports all committed posts newer than the watermark of the output directory
+# Returns the number of exported posts
+# mysql: Database connection, preferably to a read replica
+# outputDir: Output directory of the export
+# fileFormat: "parquet" or "csv"
+# columns: Exported columns
+# safetySeconds: Time after which all posts up to the highest PostID at that time are assumed to be committed
+def exportPosts(mysql: MySQLWrapper, outputDir: str, fileFormat: str, columns: list = EXPORT_COLUMNS, safetySeconds: float = EXPORT_SAFETY_SECONDS) -> int:
+    os.makedirs(outputDir, exist_ok = True)
+    lastPostID, maxPostIDs = loadWatermark(outputDir)
+    settledPostID = getSettledPostID(mysql, maxPostIDs, safetySeconds)
+    writerClass = ParquetChunkWriter if fileFormat == "parquet" else CSVChunkWriter
+
+    # Reads the posts in the order of the primary key, so the server doesn't have to sort them
+    expressions = ", ".join(expression for name, expression, columnType in columns)
+    operation = (
+        f"SELECT {expressions} FROM Posts "
+        "JOIN Threads ON Threads.ThreadID = Posts.ThreadID "
+        "JOIN Authors ON Authors.AuthorID = Posts.AuthorID "
+        "JOIN Forums ON Forums.ForumID = Threads.ForumID "
+        "WHERE Posts.PostID > %s AND Posts.PostID <= %s ORDER BY Posts.PostID;"
+    )
+
+    postCount = 0
+    writer = None
+    rowsInFile = 0
+
+    for rows in mysql.stream(operation, (lastPostID, settledPostID,), BATCH_SIZE):
+        if writer is None:
+            firstPostID = rows[0][0]
+            temporaryPath = os.path.join(outputDir, f"posts-{firstPostID:010d}.{fileFormat}.tmp")
+            writer = writerClass(temporaryPath, columns)
+            rowsInFile = 0
+
+        writer.writeRows(rows)
+        rowsInFile += len(rows)
+        postCount += len(rows)
+        lastPostID = rows[-1][0]
+
+        # Completes the chunk, the file name contains the range of its PostIDs
+        if rowsInFile >= ROWS_PER_FILE:
+            writer.close()
+            writer = None
+            os.replace(temporaryPath, os.path.join(outputDir, f"posts-{firstPostID:010d}-{lastPostID:010d}.{fileFormat}"))
+            saveWatermark(outputDir, lastPostID, maxPostIDs)
+            print(f"Exported posts up to {lastPostID}.")
+
+    if writer is not None:
+        writer.close()
+        os.replace(temporaryPath, os.path.join(outputDir, f"posts-{firstPostID:010d}-{lastPostID:010d}.{fileFormat}"))
+
+    # Also saves the highest PostID seen by this export if no posts were exported, so the next export can use it
+    saveWatermark(outputDir, lastPostID, maxPostIDs)
+
+    return postCount
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Exports posts with their thread, forum and author")
+    parser.add_argument("output", help = "output directory, it keeps the watermark for incremental exports")
+    parser.add_argument("--format", choices = ["parquet", "csv"], default = "parquet" if PARQUET_AVAILABLE else "csv")
+    parser.add_argument("--auth", default = "auth.json", help = "auth file of the database, preferably a read replica")
+    parser.add_argument("--no-content", action = "store_true", help = "leaves out the post contents")
+    args = parser.parse_args()
+
+    if args.format == "parquet" and not PARQUET_AVAILABLE:
+        print("Parquet export requires pyarrow, use --format csv instead.")
+        return
+
+    columns = EXPORT_COLUMNS
+    if args.no_content:
+        columns = [column for column in columns if column[0] != "Content"]
+
+    mysql = MySQLWrapper(AuthorizationInfo(args.auth))
+
+    # The server waits for the export to write each batch, which may take longer than the default write timeout
+    mysql.query("SET SESSION net_write_timeout=600;")
+
+    postCount = exportPosts(mysql, args.output, args.format, columns)
+    print(f"Exported {postCount} posts to {args.output}.")
+
+    mysql.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# This class downloads pages while keeping the requests per host politely spaced.
+# Every host has its own token bucket that limits the request rate. The fetcher can be used by several threads at
+# once, e.g. the fetch stage of the scan pipeline, which also determines the number of requests in flight.
+# If an HTTP cache is given, pages are requested conditionally. Unchanged pages are then returned as
+# responses with status code 304 and an empty body. The validators of a downloaded page are only used once the caller
+# confirms them in the HTTP cache after saving the page.
+
+from requests_html import HTMLSession
+from httpcache import HTTPCache, getTransferredBytes
+from metrics import metrics
+from urllib.parse import urlparse
+
+import random
+import threading
+import time
+
+class TokenBucket:
+
+    # Constructor
+    # rate: Number of tokens added per second
+    # capacity: Maximum number of tokens that can be saved up for bursts
+    # jitter: Maximum random delay in seconds added to every acquisition
+    def __init__(self, rate: float, capacity: float = 1.0, jitter: float = 0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.jitter = jitter
+        self.tokens = capacity
+        self.lastRefill = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Blocks until a token is available and takes it
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate)
+            self.lastRefill = now
+
+            # Reserves a token, going into debt if none is available, so waiting callers are served in order
+            self.tokens -= 1.0
+            waitTime = 0.0
+            if self.tokens < 0.0:
+                waitTime = -self.tokens / self.rate
+
+        waitTime += random.random() * self.jitter
+        if waitTime > 0.0:
+            time.sleep(waitTime)
+
+    # Changes the number of tokens added per second, tokens saved up so far are kept
+    # rate: New number of tokens added per second
+    def setRate(self, rate: float):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate)
+            self.lastRefill = now
+            self.rate = rate
+
+
+class Fetcher:
+
+    # Constructor
+    # requestsPerSecond: Maximum request rate per host
+    # jitter: Maximum random delay in seconds added to every request
+    # httpCache: Cache used for conditional requests, or None to always download pages in full
+    def __init__(self, requestsPerSecond: float = 0.4, jitter: float = 1.0, httpCache: HTTPCache = None):
+        self.requestsPerSecond = requestsPerSecond
+        self.jitter = jitter
+        self.httpCache = httpCache
+
+        self.buckets = {}
+        self.bucketLock = threading.Lock()
+        self.sessions = threading.local()
+
+        # All sessions of all threads, so they can be closed
+        self.openSessions = []
+        self.sessionLock = threading.Lock()
+
+        self.byteCount = 0
+        self.byteCountLock = threading.Lock()
+
+    # Returns the token bucket of the host of a URL
+    # url: URL that should be requested
+    def getBucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc
+
+        with self.bucketLock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.requestsPerSecond, 1.0, self.jitter)
+
+            return self.buckets[host]
+
+    # Changes the maximum request rate of all hosts, e.g. when the request budget is shared with other scanners
+    # requestsPerSecond: New maximum request rate per host
+    def setRate(self, requestsPerSecond: float):
+        with self.bucketLock:
+            self.requestsPerSecond = requestsPerSecond
+
+            for bucket in self.buckets.values():
+                bucket.setRate(requestsPerSecond)
+
+    # Returns the HTML session of the current thread, as sessions aren't shared between threads
+    def getSession(self) -> HTMLSession:
+        if not hasattr(self.sessions, "session"):
+            self.sessions.session = HTMLSession()
+
+            with self.sessionLock:
+                self.openSessions += [self.sessions.session]
+
+        return self.sessions.session
+
+    # Requests a page, waiting until the rate limit of its host allows it
+    # url: URL of the page
+    # conditional: If False, the page is downloaded in full even if it's cached
+    def fetch(self, url: str, conditional: bool = True):
+        headers = None
+        if self.httpCache is not None and conditional:
+            headers = self.httpCache.getRequestHeaders(url)
+
+        host = urlparse(url).netloc
+        with metrics.timer("fetch_wait_seconds", {"host": host}):
+            self.getBucket(url).acquire()
+
+        with metrics.timer("fetch_seconds", {"host": host}):
+            response = self.getSession().get(url, headers = headers)
+
+        metrics.increment("fetch_requests_total", 1, {"host": host, "status": response.status_code})
+        metrics.increment("fetch_bytes_total", getTransferredBytes(response), {"host": host})
+
+        if self.httpCache is not None:
+            self.httpCache.update(url, response)
+
+        with self.byteCountLock:
+            self.byteCount += getTransferredBytes(response)
+
+        return response
+
+    # Returns the number of bytes downloaded since the last reset and resets the counter
+    def resetByteCount(self) -> int:
+        with self.byteCountLock:
+            byteCount = self.byteCount
+            self.byteCount = 0
+            return byteCount
+
+    # Closes the sessions of all threads
+    def close(self):
+        with self.sessionLock:
+            for session in self.openSessions:
+                session.close()
+
+            self.openSessions = []
@@ -1,6 +1,15 @@
 from mysqlwrapper import MySQLWrapper
+from urllib.parse import urlparse
+from identitymap import IdentityMap
+from metrics import metrics
+from migrations import migrate
 from datetime import datetime, timedelta
 
+import hashlib
+
+# Base URL of HLTV. Can be changed to replay recorded pages from a local server.
+HLTV_URL = "https://www.hltv.org"
+
 def initializeTables(mysql: MySQLWrapper, overwrite: bool = False):
     # Creates database tables
     # They all follow the same guidelines:
@@ -11,6 +20,7 @@ def initializeTables(mysql: MySQLWrapper, overwrite: bool = False):
     # Posts: Contains all posts (responses to threads, or the initial post in a thread)
     # HLTVID - For https://www.hltv.org/forums/threads/2329019/whos-dumber#r43857044 it'd be: '2329019/whos-dumber#r43857044'
     #           (This has an overlap with the Thread HLTVID, but without it the uniqueness of a post couldn't be checked easily with ON DUPLICATE)
+    # HLTVHash - MD5 hash of the HLTVID. Posts are identified by it, as a unique index on the long HLTVID would be large.
     # ThreadID - SQL ID of the thread the post is a response to
     # AuthorID - SQL ID of the author of the post
     # ReplyNum - Number of the reply in the thread (e.g. 3 for the 3rd response to a thread). 0 for the initial post.
@@ -21,6 +31,7 @@ def initializeTables(mysql: MySQLWrapper, overwrite: bool = False):
     mysql.createTable("Posts", (
         "PostID INT AUTO_INCREMENT, "
         "HLTVID VARCHAR(511) NOT NULL, "
+        "HLTVHash BINARY(16) DEFAULT NULL, "
         "ThreadID INT NOT NULL, "
         "AuthorID INT NOT NULL, "
         "ReplyNum INT NOT NULL, "
@@ -29,7 +40,10 @@ def initializeTables(mysql: MySQLWrapper, overwrite: bool = False):
         "HateRating FLOAT DEFAULT 0, "
         "OffRating FLOAT DEFAULT 0, "
         "PRIMARY KEY(PostID), "
-        "UNIQUE (HLTVID)"
+        "UNIQUE (HLTVHash), "
+        "INDEX ThreadReply (ThreadID, ReplyNum), "
+        "INDEX Author (AuthorID), "
+        "INDEX PostTime (Time)"
     ), 
     "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
     overwrite)
@@ -51,7 +65,7 @@ def initializeTables(mysql: MySQLWrapper, overwrite: bool = False):
     # HLTVID - For https://www.hltv.org/forums/threads/2329019/whos-dumber it'd be '2329019/whos-dumber'
     # ForumID - SQL ID of the forum the post was made in
     # AuthorID - SQL ID of the author who created the thread
-    # NumResponses - The number of posts in the thread
+    # NumResponses - The number of posts in the thread as listed on the forum index, NULL until it was scanned completely
     # Time - The time at which the thread was created
     mysql.createTable("Threads", (
         "ThreadID INT AUTO_INCREMENT, "
@@ -62,7 +76,8 @@ def initializeTables(mysql: MySQLWrapper, overwrite: bool = False):
         "NumResponses INT DEFAULT 0, "
         "Time DATETIME DEFAULT NOW(), "
         "PRIMARY KEY(ThreadID), "
-        "UNIQUE (HLTVID)"
+        "UNIQUE (HLTVID), "
+        "INDEX Forum (ForumID)"
     ), 
     "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
     overwrite)
@@ -80,6 +95,166 @@ def initializeTables(mysql: MySQLWrapper, overwrite: bool = False):
     "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
     overwrite)
 
+    # ThreadCursors: Remembers how far each thread was read, so only new replies have to be fetched
+    # ThreadID - SQL ID of the thread
+    # LastReplyNum - Highest reply number that was stored for the thread
+    # PageURL - URL of the thread page containing that reply, where reading continues
+    mysql.createTable("ThreadCursors", (
+        "ThreadID INT NOT NULL, "
+        "LastReplyNum INT NOT NULL, "
+        "PageURL VARCHAR(1023) NOT NULL, "
+        "PRIMARY KEY(ThreadID)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
+    # ForumClaims: Leases of forums for scanners running in sharded mode, so every forum is scanned by one worker at a time
+    # ForumID - SQL ID of the forum
+    # Owner - Name of the worker currently scanning the forum, NULL if the forum isn't claimed
+    # ExpiresAt - Time at which the claim expires if the owner stops renewing it, e.g. because it crashed
+    # ClaimedAt - Time at which the current or last scan of the forum started
+    # NextScan - Time after which the forum should be scanned again
+    mysql.createTable("ForumClaims", (
+        "ForumID INT NOT NULL, "
+        "Owner VARCHAR(127) DEFAULT NULL, "
+        "ExpiresAt DATETIME DEFAULT NULL, "
+        "ClaimedAt DATETIME DEFAULT NULL, "
+        "NextScan DATETIME DEFAULT NOW(), "
+        "PRIMARY KEY(ForumID)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
+    # ScanWorkers: Scanners running in sharded mode. The global request rate is split evenly between them.
+    # Owner - Name of the worker, e.g. 'host:1234'
+    # Heartbeat - Time at which the worker last reported that it's alive
+    mysql.createTable("ScanWorkers", (
+        "Owner VARCHAR(127) NOT NULL, "
+        "Heartbeat DATETIME DEFAULT NOW(), "
+        "PRIMARY KEY(Owner)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
+    # BackfillProgress: Remembers how far backfill.py read the older index pages of each forum, so it can be restarted
+    # ForumID - SQL ID of the forum
+    # PageURL - URL of the next index page to be read
+    # PageCount - Number of index pages that were read completely
+    # Completed - 1 once the last index page of the forum was read
+    # Time - The time at which the progress was last saved
+    mysql.createTable("BackfillProgress", (
+        "ForumID INT NOT NULL, "
+        "PageURL VARCHAR(1023) NOT NULL, "
+        "PageCount INT DEFAULT 0, "
+        "Completed TINYINT DEFAULT 0, "
+        "Time DATETIME DEFAULT NOW(), "
+        "PRIMARY KEY(ForumID)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
+    # AuthorStats, ForumStats, ThreadStats, DailyStats: Aggregated ratings, maintained by rollups.py
+    # The first columns are the key of the aggregate:
+    #   AuthorStats - AuthorID of the post author
+    #   ForumStats - ForumID of the forum the post was made in
+    #   ThreadStats - ThreadID of the thread the post is a response to
+    #   DailyStats - Day on which the post was made and ForumID of its forum
+    # NumPosts - The number of posts
+    # HateSum, OffSum - Sums of HateRating and OffRating, the mean is the sum divided by NumPosts
+    # HateCount, OffCount - The number of posts whose rating is at least the threshold defined in rollups.py
+    statsColumns = (
+        "NumPosts INT DEFAULT 0, "
+        "HateSum DOUBLE DEFAULT 0, "
+        "OffSum DOUBLE DEFAULT 0, "
+        "HateCount INT DEFAULT 0, "
+        "OffCount INT DEFAULT 0, "
+    )
+    mysql.createTable("AuthorStats", "AuthorID INT NOT NULL, " + statsColumns + "PRIMARY KEY(AuthorID)", "", overwrite)
+    mysql.createTable("ForumStats", "ForumID INT NOT NULL, " + statsColumns + "PRIMARY KEY(ForumID)", "", overwrite)
+    mysql.createTable("ThreadStats", "ThreadID INT NOT NULL, " + statsColumns + "PRIMARY KEY(ThreadID)", "", overwrite)
+    mysql.createTable("DailyStats", "Day DATE NOT NULL, ForumID INT NOT NULL, " + statsColumns + "PRIMARY KEY(Day, ForumID)", "", overwrite)
+
+    # RollupState: Remembers up to which post the aggregates are maintained
+    # Name - Name of the aggregated data, currently only 'Posts'
+    # LastPostID - Watermark of the aggregates: all posts up to this PostID are included in them
+    mysql.createTable("RollupState", (
+        "Name VARCHAR(63) NOT NULL, "
+        "LastPostID INT DEFAULT 0, "
+        "PRIMARY KEY(Name)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
+    # RollupPosts: Posts after the watermark in RollupState that are already included in the aggregates. Posts can become
+    # visible after posts with higher PostIDs, so the watermark is held back until they are, see rollups.py.
+    # PostID - SQL ID of the aggregated post
+    # Pending - 1 while the post is added to the aggregates
+    # AggregatedAt - The time at which the post was added to the aggregates
+    mysql.createTable("RollupPosts", (
+        "PostID INT NOT NULL, "
+        "Pending TINYINT DEFAULT 0, "
+        "AggregatedAt DATETIME DEFAULT NOW(), "
+        "PRIMARY KEY(PostID), "
+        "INDEX Pending (Pending)"
+    ),
+    "",
+    overwrite)
+
+    # PostRatings: Ratings of the stored posts by other model versions, written by rescore.py
+    # PostID - SQL ID of the rated post
+    # ModelVersion - Version of the model that rated the post, e.g. 'hatesonar-0.1.0'
+    # HateRating, OffRating - The same confidence scores as in Posts
+    mysql.createTable("PostRatings", (
+        "PostID INT NOT NULL, "
+        "ModelVersion VARCHAR(63) NOT NULL, "
+        "HateRating FLOAT DEFAULT 0, "
+        "OffRating FLOAT DEFAULT 0, "
+        "PRIMARY KEY(ModelVersion, PostID)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
+    # RescoreProgress: Remembers up to which post the stored posts were rated by each model version
+    # ModelVersion - Version of the model
+    # LastPostID - Highest PostID whose rating is stored in PostRatings
+    # Time - The time at which the progress was last saved
+    mysql.createTable("RescoreProgress", (
+        "ModelVersion VARCHAR(63) NOT NULL, "
+        "LastPostID INT DEFAULT 0, "
+        "Time DATETIME DEFAULT NOW(), "
+        "PRIMARY KEY(ModelVersion)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
+    # DiscordChannels: Discord channels observed by discord_scan.py. Each server is stored as a forum and each channel as a thread.
+    # ChannelID - Discord ID of the channel, which is also the HLTVID of its thread
+    # GuildID - Discord ID of the server, only informative
+    # ForumName - Name of the forum the channel belongs to, which is also its HLTVID, e.g. 'ECC-Discord'
+    # ChannelName - Title of the thread, e.g. '#general-chat'
+    # Enabled - Messages are only stored while this is 1
+    mysql.createTable("DiscordChannels", (
+        "ChannelID VARCHAR(63) NOT NULL, "
+        "GuildID VARCHAR(63) DEFAULT NULL, "
+        "ForumName VARCHAR(63) NOT NULL, "
+        "ChannelName VARCHAR(511) NOT NULL, "
+        "Enabled TINYINT DEFAULT 1, "
+        "PRIMARY KEY(ChannelID)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
+    # DiscordBackfill: Remembers up to which message the history of each Discord channel was read, see discord_scan.py
+    # ChannelID - Discord ID of the channel
+    # LastMessageID - Discord ID of the newest message up to which the history is stored completely
+    mysql.createTable("DiscordBackfill", (
+        "ChannelID VARCHAR(63) NOT NULL, "
+        "LastMessageID BIGINT UNSIGNED NOT NULL, "
+        "PRIMARY KEY(ChannelID)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci",
+    overwrite)
+
     # Signals: Used to pause or exit the program cleanly
     # Currently required signals:
     # End: If set to 1, this program will terminate after the end of the current refresh
@@ -93,8 +268,15 @@ def initializeTables(mysql: MySQLWrapper, overwrite: bool = False):
     overwrite)
 
 
+    # Brings tables created by earlier versions up to date
+    migrate(mysql)
+
+
 class Forum:
 
+    # Maps forum HLTVIDs to SQL IDs of forums that are already in the database
+    identityMap = IdentityMap(1000, "forums")
+
     def __init__(self, name, hltvID = None, sqlID = None):
         self.name = name
         self.hltvID = hltvID
@@ -102,15 +284,21 @@ class Forum:
 
     # Example: https://www.hltv.org/forums/17/off-topic
     def getURL(self):
-        return f"https://www.hltv.org/forums/{self.hltvID}"
+        return f"{HLTV_URL}/forums/{self.hltvID}"
 
     def insert(self, mysql: MySQLWrapper):
+        # Skips the database if the forum is already stored with the same name
+        self.sqlID = Forum.identityMap.lookup(self.hltvID, self.name)
+        if self.sqlID is not None:
+            return
+
         mysql.query(
             "INSERT INTO Forums (HLTVID, Name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE Name=%s;",
             (self.hltvID, self.name, self.name,)
         )
 
         self.sqlID = self.getSQLID(mysql)
+        Forum.identityMap.remember(self.hltvID, self.sqlID, self.name, mysql)
 
     def getSQLID(self, mysql: MySQLWrapper):
         mysql.query(
@@ -128,24 +316,33 @@ class Forum:
 
 class ForumAuthor:
 
+    # Maps author HLTVIDs to SQL IDs of authors that are already in the database
+    identityMap = IdentityMap(100000, "authors")
+
     def __init__(self, name, hltvID = None, url = None):
         self.name = name
         self.hltvID = hltvID
         self.sqlID = None
         if url is not None:
-            self.hltvID = url[29:]
+            self.hltvID = urlparse(url).path[len("/profile/"):]
 
     # Example: https://www.hltv.org/profile/766189/nabaski
     def getURL(self):
-        return f"https://www.hltv.org/profile/{self.hltvID}"
+        return f"{HLTV_URL}/profile/{self.hltvID}"
 
     def insert(self, mysql: MySQLWrapper):
+        # Skips the database if the author is already stored with the same name
+        self.sqlID = ForumAuthor.identityMap.lookup(self.hltvID, self.name)
+        if self.sqlID is not None:
+            return
+
         mysql.query(
             "INSERT INTO Authors (HLTVID, Name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE Name=%s;",
             (self.hltvID, self.name, self.name,)
         )
 
         self.sqlID = self.getSQLID(mysql)
+        ForumAuthor.identityMap.remember(self.hltvID, self.sqlID, self.name, mysql)
 
     def getSQLID(self, mysql: MySQLWrapper):
         mysql.query(
@@ -161,6 +358,12 @@ class ForumAuthor:
             return result[0][0]
 
 
+# Returns the hash a post is identified by in the database, the same as UNHEX(MD5(HLTVID)) in SQL
+# hltvID: HLTVID of the post
+def getPostHash(hltvID: str) -> bytes:
+    return hashlib.md5(hltvID.encode("utf-8")).digest()
+
+
 class ForumPost:
 
     def __init__(self, shortID, threadID, index, author, content, timestamp, hateRating, offRating):
@@ -184,24 +387,24 @@ class ForumPost:
 
     # Example: https://www.hltv.org/forums/threads/2329019/whos-dumber#r43857044
     def getURL(self):
-        return f"https://www.hltv.org/forums/threads/{self.getHLTVID()}"
+        return f"{HLTV_URL}/forums/threads/{self.getHLTVID()}"
 
     def insert(self, mysql: MySQLWrapper):
         mysql.query(
             (
-                "INSERT INTO Posts (HLTVID, ThreadID, ReplyNum, AuthorID, Content, Time, HateRating, OffRating) VALUES "
-                "(%s, %s, %s, %s, %s, %s, %s, %s) "
+                "INSERT INTO Posts (HLTVID, HLTVHash, ThreadID, ReplyNum, AuthorID, Content, Time, HateRating, OffRating) VALUES "
+                "(%s, %s, %s, %s, %s, %s, %s, %s, %s) "
                 "ON DUPLICATE KEY UPDATE HLTVID=%s;"
             ),
-            (self.getHLTVID(), self.threadID, self.index, self.author.sqlID, self.content, self.timestamp, self.hateRating, self.offRating, self.getHLTVID(),)
+            (self.getHLTVID(), getPostHash(self.getHLTVID()), self.threadID, self.index, self.author.sqlID, self.content, self.timestamp, self.hateRating, self.offRating, self.getHLTVID(),)
         )
 
         self.sqlID = self.getSQLID(mysql)
 
     def getSQLID(self, mysql: MySQLWrapper):
         mysql.query(
-            "SELECT PostID FROM Posts WHERE HLTVID=%s;",
-            (self.getHLTVID(),)
+            "SELECT PostID FROM Posts WHERE HLTVHash=%s;",
+            (getPostHash(self.getHLTVID()),)
         )
 
         result = mysql.fetchResults()
@@ -214,36 +417,50 @@ class ForumPost:
 
 class ForumThread:
 
-    def __init__(self, title, author, forumID, hltvID = None, url = None):
+    # Maps thread HLTVIDs to SQL IDs of threads that are already in the database
+    identityMap = IdentityMap(20000, "threads")
+
+    def __init__(self, title, author, forumID, hltvID = None, url = None, replyCount = None):
         self.sqlID = None
         self.title = title
         self.author = author
         self.forumID = forumID
 
+        # Number of replies as listed on the forum index, None if unknown
+        self.replyCount = replyCount
+
         self.content = None
         self.timestamp = None
-        self.posts = []
 
         if hltvID is None:
-            self.hltvID = url[36:]
+            self.hltvID = urlparse(url).path[len("/forums/threads/"):]
         else:
             self.hltvID = hltvID   
 
     # Example: https://www.hltv.org/forums/threads/2329019/whos-dumber
     def getURL(self):
-        return f"https://www.hltv.org/forums/threads/{self.hltvID}"
+        return f"{HLTV_URL}/forums/threads/{self.hltvID}"
 
     def insert(self, mysql: MySQLWrapper):
+        # Skips the database if the thread is already stored, as existing threads aren't updated by the upsert
+        self.sqlID = ForumThread.identityMap.lookup(self.hltvID)
+        if self.sqlID is not None:
+            return
+
+        # NumResponses stays NULL until all pages of the thread are saved (see ThreadTracker.markUpdated), so a thread
+        # whose first scan was interrupted isn't skipped as unchanged
+
         mysql.query(
             (
                 "INSERT INTO Threads (HLTVID, ForumID, AuthorID, Title, NumResponses, Time) VALUES "
                 "(%s, %s, %s, %s, %s, %s) "
                 "ON DUPLICATE KEY UPDATE HLTVID=%s;"
             ),
-            (self.hltvID, self.forumID, self.author.sqlID, self.title, len(self.posts), self.timestamp, self.hltvID,)
+            (self.hltvID, self.forumID, self.author.sqlID, self.title, None, self.timestamp, self.hltvID,)
         )
 
         self.sqlID = self.getSQLID(mysql)
+        ForumThread.identityMap.remember(self.hltvID, self.sqlID, mysql = mysql)
 
     def getSQLID(self, mysql: MySQLWrapper):
         mysql.query(
@@ -257,3 +474,98 @@ class ForumThread:
             return None
         else:
             return result[0][0]
+
+
+# Maximum number of HLTVIDs that are resolved to SQL IDs in a single query
+MAX_IDS_PER_QUERY = 500
+
+# Returns a dictionary mapping HLTVIDs to SQL IDs for all given HLTVIDs that exist in a table
+# mysql: Database connection
+# table: Name of the table
+# idColumn: Name of the SQL ID column of the table
+# hltvIDs: List of HLTVIDs to be resolved
+# keyColumn: Name of the column the HLTVIDs are compared to, e.g. HLTVHash for the hashes of posts
+def getSQLIDs(mysql: MySQLWrapper, table: str, idColumn: str, hltvIDs: list, keyColumn: str = "HLTVID") -> dict:
+    sqlIDs = {}
+
+    for start in range(0, len(hltvIDs), MAX_IDS_PER_QUERY):
+        chunk = hltvIDs[start:start + MAX_IDS_PER_QUERY]
+        placeholders = ", ".join(["%s"] * len(chunk))
+
+        mysql.query(f"SELECT {keyColumn}, {idColumn} FROM {table} WHERE {keyColumn} IN ({placeholders});", tuple(chunk))
+        results = mysql.fetchResults()
+
+        if results is not None:
+            for row in results:
+                sqlIDs[row[0]] = row[1]
+
+    return sqlIDs
+
+# Adds several authors to the database with a single multi-row statement, or updates them if they already exist.
+# Afterwards the SQL IDs of all authors are set.
+# mysql: Database connection
+# authors: List of ForumAuthor objects
+def insertAuthors(mysql: MySQLWrapper, authors: list):
+    # Every author is only written once, even if they posted several times.
+    # Authors that are already stored with the same name are skipped.
+    uniqueAuthors = {}
+    for author in authors:
+        author.sqlID = ForumAuthor.identityMap.lookup(author.hltvID, author.name)
+
+        if author.sqlID is None:
+            uniqueAuthors[author.hltvID] = author
+
+    if len(uniqueAuthors) == 0:
+        return
+
+    mysql.queryMany(
+        "INSERT INTO Authors (HLTVID, Name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE Name=VALUES(Name);",
+        [(author.hltvID, author.name,) for author in uniqueAuthors.values()]
+    )
+
+    sqlIDs = getSQLIDs(mysql, "Authors", "AuthorID", list(uniqueAuthors.keys()))
+
+    for author in uniqueAuthors.values():
+        ForumAuthor.identityMap.remember(author.hltvID, sqlIDs.get(author.hltvID), author.name, mysql)
+
+    for author in authors:
+        if author.sqlID is None:
+            author.sqlID = sqlIDs.get(author.hltvID)
+
+# Adds several posts to the database with a single multi-row statement, or ignores the ones that already exist.
+# The authors of the posts must have been inserted before. Afterwards the SQL IDs of all posts are set.
+# mysql: Database connection
+# posts: List of ForumPost objects
+def insertPosts(mysql: MySQLWrapper, posts: list):
+    if len(posts) == 0:
+        return
+
+    # The hashes are calculated here rather than with MD5() in SQL, so executemany can still send a single statement
+    mysql.queryMany(
+        (
+            "INSERT INTO Posts (HLTVID, HLTVHash, ThreadID, ReplyNum, AuthorID, Content, Time, HateRating, OffRating) VALUES "
+            "(%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE HLTVID=VALUES(HLTVID);"
+        ),
+        [
+            (post.getHLTVID(), getPostHash(post.getHLTVID()), post.threadID, post.index, post.author.sqlID, post.content, post.timestamp, post.hateRating, post.offRating,)
+            for post in posts
+        ]
+    )
+
+    # Without CLIENT_FOUND_ROWS, posts that already exist are unchanged by the update and don't count as affected rows,
+    # so only the inserted posts are counted
+    metrics.increment("posts_saved_total", mysql.getAffectedRows())
+
+    sqlIDs = getSQLIDs(mysql, "Posts", "PostID", [getPostHash(post.getHLTVID()) for post in posts], "HLTVHash")
+
+    for post in posts:
+        post.sqlID = sqlIDs.get(getPostHash(post.getHLTVID()))
+
+# Fills the identity maps of forums, threads and authors from the database, so known entities don't have to be
+# upserted again after a restart. Without warming, the maps are filled lazily on the first insert of each entity.
+# mysql: Database connection
+def warmIdentityMaps(mysql: MySQLWrapper):
+    Forum.identityMap.warm(mysql, "SELECT HLTVID, ForumID, Name FROM Forums;")
+    ForumThread.identityMap.warm(mysql, "SELECT HLTVID, ThreadID FROM Threads ORDER BY ThreadID DESC LIMIT %s;", (ForumThread.identityMap.entries.maxSize,))
+    ForumAuthor.identityMap.warm(mysql, "SELECT HLTVID, AuthorID, Name FROM Authors ORDER BY AuthorID DESC LIMIT %s;", (ForumAuthor.identityMap.entries.maxSize,))
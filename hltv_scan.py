@@ -1,112 +1,232 @@
-from requests_html import HTMLSession
-from mysqlwrapper import MySQLWrapper
+from mysqlwrapper import MySQLWrapper, MySQLPool, TRANSIENT_ERRORS
 from authorization import AuthorizationInfo
 from forums import *
-
-from hatesonar import Sonar
-sonar = Sonar()
-
-totalByteCount = 0
-byteCount = 0
-
-import time
+from threadtracker import ThreadTracker
+from fetcher import Fetcher
+from httpcache import HTTPCache
+import hltvparser
+
+from pipeline import Pipeline, PipelineStage
+from control import ControlChannel, CONTROL_FILE
+from sharding import ShardCoordinator, getWorkerPath
+from rollups import updateRollups
+from spool import PostSpool, SpoolDrainer, encodeThread, decodeThread, encodePost, decodePost
+from metrics import metrics
+from httpcache import getTransferredBytes
+
+from classification import PostClassifier, getClassificationText
+from classificationcache import ClassificationCache
+
+# Request rate per host and number of concurrent requests to HLTV.
+# The rate matches the previous fixed delay of 2-3s between requests.
+REQUESTS_PER_SECOND = 0.4
+MAX_CONCURRENT_REQUESTS = 4
+
+# Number of processes that run the classification model
+CLASSIFIER_PROCESSES = 2
+
+# Maximum number of pages waiting in front of each pipeline stage
+PIPELINE_QUEUE_SIZE = 16
+
+# Number of threads saving pages to the database in parallel, each with its own pooled connection
+PERSIST_WORKERS = 1
+
+# Metrics of fetch, parse, classification and database times. Disabled metrics cost almost nothing.
+# METRICS_FILE is rewritten after every cycle in the Prometheus text format, METRICS_PORT serves the same on /metrics.
+METRICS_ENABLED = False
+METRICS_FILE = "metrics.prom"
+METRICS_LOG = "metrics.jsonl"
+METRICS_PORT = None
+
+# If True, threads are read from the page of the last stored reply instead of from the first page
+RESUME_THREADS = True
+
+# If True, several scanners can run at once, on one or several hosts. They claim forums through the ForumClaims table
+# and split REQUESTS_PER_SECOND evenly between them, so the load on HLTV stays the same.
+# Scanners on the same host are started with different --worker names, which are appended to their local files
+# (spool, HTTP cache, control file, classification cache and metrics files), so they don't overwrite each other's.
+# Claims of a scanner that stopped renewing them expire after CLAIM_LEASE_TIME seconds.
+# Scanners without a forum to claim check again at least every CLAIM_POLL_INTERVAL seconds.
+SHARDED = False
+CLAIM_LEASE_TIME = 300
+CLAIM_POLL_INTERVAL = 30
+
+# Directory of the spool that saved pages are written to before the database, so they survive database outages.
+# If None, pages are written to the database directly.
+SPOOL_DIR = "spool"
+
+# Local files of the scanner
+HTTP_CACHE_FILE = "http_cache.json"
+CLASSIFICATION_CACHE_FILE = "classification_cache.db"
+
+# If True, the aggregated statistics (see rollups.py) are updated with the new posts after every cycle
+UPDATE_ROLLUPS = True
+
+import argparse
 from datetime import datetime, timedelta
-import random
 
 
 # Returns all threads on HLTV offtopic main page
-def getForumThreads(session: HTMLSession, forum: Forum):
+def getForumThreads(fetcher: Fetcher, forum: Forum):
     # Requests the offtopic page HTML
-    response = session.get(forum.getURL())
+    response = fetcher.fetch(forum.getURL())
+    threads = []
 
-    global byteCount
-    byteCount += len(response.content)
+    metrics.increment("forum_bytes_total", getTransferredBytes(response), {"forum_id": forum.sqlID})
 
-    # Selects the div containing the forum thread list
-    forumDiv = response.html.find('.forumthreads')[0]
+    # If the index didn't change since the last request, neither did any of its threads
+    if response.status_code == 304:
+        return threads
 
-    # Fetches all rows from the thread list
-    tableRows = forumDiv.find('tr.tablerow')
-    threads = []
+    with metrics.timer("parse_seconds", {"page": "index"}):
+        rows = hltvparser.parseForumThreads(response.text, response.url)
 
-    # Converts every row into a thread object
-    for row in tableRows:
-        # Gets thread title and URL
-        tdName = row.find('td.name')[0]
-        threadURL = tdName.absolute_links.pop()
-        threadName = tdName.text
-
-        # Gets reply count
-        tdReplies = row.find('td.replies')[0]
-        replyCount = int(tdReplies.text)
-
-        # Gets thread author
-        tdAuthor = row.find('td.author')[0]
-        authorURL = tdAuthor.absolute_links.pop()
-        authorName = tdAuthor.text
-        author = ForumAuthor(authorName, url = authorURL)
-
-        # Creates thread object and adds it to list
-        newThread = ForumThread(threadName, author, forum.sqlID, url = threadURL)
+    # Converts every row of the thread list into a thread object
+    for row in rows:
+        author = ForumAuthor(row.authorName, url = row.authorURL)
+        newThread = ForumThread(row.title, author, forum.sqlID, url = row.url, replyCount = row.replyCount)
         threads += [newThread]
-    
+
     return threads
 
 
 
-# Loads info for a given forum thread
-def loadThreadContent(session: HTMLSession, thread: ForumThread):
-    # Requests the thread HTML
-    response = session.get(thread.getURL())
+# A page of a thread as it passes through the scan pipeline
+class ThreadPage:
+
+    # Constructor
+    # thread: Thread the page belongs to
+    # url: URL of the page
+    # document: Parsed HTML document of the page
+    # isLastPage: True if there are no further pages
+    # lastReplyNum: Replies up to this number are already stored and skipped, None to keep all posts
+    def __init__(self, thread: ForumThread, url: str, document, isLastPage: bool, lastReplyNum = None):
+        self.thread = thread
+        self.url = url
+        self.document = document
+        self.isLastPage = isLastPage
+        self.lastReplyNum = lastReplyNum
+        self.posts = []
+
+
+# Returns a JSON-compatible representation of a parsed and classified page, as it's written to the spool
+def encodePage(page: ThreadPage) -> dict:
+    return {
+        "thread": encodeThread(page.thread),
+        "url": page.url,
+        "isLastPage": page.isLastPage,
+        "posts": [encodePost(post) for post in page.posts]
+    }
 
-    global byteCount
-    byteCount += len(response.content)
+# Creates a page from its JSON representation
+def decodePage(record: dict) -> ThreadPage:
+    page = ThreadPage(decodeThread(record["thread"]), record["url"], None, record["isLastPage"])
+    page.posts = [decodePost(post) for post in record["posts"]]
+    return page
+
+# Saves spooled pages to the database in the order in which they were spooled
+# mysql: Database connection of the spool drainer
+# tracker: Tracker whose cursors are moved to the saved pages
+# records: Spooled pages
+def replayPages(mysql: MySQLWrapper, tracker: ThreadTracker, records: list):
+    for record in records:
+        saveThreadPage(mysql, tracker, decodePage(record))
 
-    # Extracts all posts from it
-    replies = response.html.find('.post, .forumthread')
 
-    for reply in replies:
-        replyNumAnchors = reply.find('.replyNum')
-        replyNum = 0
+# Requests the pages of a thread one after another, following the links to the next page
+# fetcher: Fetcher used to download the pages
+# thread: Thread to be read
+# startURL: URL of the first page to be read
+# lastReplyNum: Replies up to this number are skipped, None to keep all posts
+# conditional: If True, reading stops at the first further page that didn't change since it was last saved
+# control: Control channel, no further page is requested once a stop is requested. None to read all pages.
+# Yields a ThreadPage for every page as soon as it's downloaded
+def iterThreadPages(fetcher: Fetcher, thread: ForumThread, startURL: str, lastReplyNum = None, conditional: bool = True, control: ControlChannel = None):
+    url = startURL
 
-        # Retrieves the post content
-        content = reply.find('.forum-middle')[0].text 
-        timestampStr = reply.find('.forum-bottombar')[0].text
-        timestamp = datetime.strptime(timestampStr, "%Y-%m-%d %H:%M")
-        postID = ''
+    while url is not None:
+        # The cursor lets the next run continue at the page that wasn't requested
+        if control is not None and control.isStopRequested():
+            return
 
-        # These fields only exist for replies, not the top post, so their existence is checked
-        if len(replyNumAnchors) > 0:
-            replyNumStr = reply.find('.replyNum')[0].text
-            replyNum = int(replyNumStr[1:])
-        
-            postID = reply.attrs['id']
-        else:
-            thread.timestamp = timestamp
+        # The start page is always downloaded in full. It's the page of the last stored reply, so it may be unchanged
+        # while new replies were added to the following pages.
+        response = fetcher.fetch(url, conditional and url != startURL)
+        metrics.increment("forum_bytes_total", getTransferredBytes(response), {"forum_id": thread.forumID})
+
+        # New replies are always added to the last pages, so an unchanged page means there is nothing new
+        if response.status_code == 304:
+            return
+
+        with metrics.timer("parse_seconds", {"page": "document"}):
+            document = hltvparser.parseDocument(response.text)
+            nextURL = hltvparser.extractNextPageURL(document, url)
+
+        yield ThreadPage(thread, url, document, nextURL is None, lastReplyNum)
+        url = nextURL
+
+
+# Extracts the posts of a thread page that aren't stored yet
+def parseThreadPage(page: ThreadPage):
+    thread = page.thread
+
+    for row in hltvparser.extractPosts(page.document, page.url):
+        # The initial post has no reply number and defines the creation time of the thread
+        if row.postID == '':
+            thread.timestamp = row.timestamp
+
+        # Skips replies that were stored in a previous scan
+        if page.lastReplyNum is not None and row.replyNum <= page.lastReplyNum:
+            continue
+
+        author = ForumAuthor(row.authorName, url = row.authorURL)
+        newPost = ForumPost(row.postID, thread.sqlID, row.replyNum, author, row.content, row.timestamp, 0, 0)
+        page.posts += [newPost]
+
+    # The document isn't needed anymore, so its memory can be freed while the page waits in the pipeline
+    page.document = None
+
+
+# Calculates hate speech and offensive language ratings for several posts at once
+def classifyPosts(classifier: PostClassifier, posts: list):
+    texts = [getClassificationText(post.author.name, post.content) for post in posts]
+    ratings = classifier.rateBatch(texts)
+
+    for post, (hateRating, offRating) in zip(posts, ratings):
+        post.hateRating = hateRating
+        post.offRating = offRating
+
+
+# Saves the thread, authors and posts to the database
+def savePosts(mysql: MySQLWrapper, thread: ForumThread, posts: list):
+    # Adds the thread author and all post authors to the database, or updates them if they already exist
+    insertAuthors(mysql, [thread.author] + [post.author for post in posts])
 
-        # Retrieves author information
-        authorAnchor = reply.find('.authorAnchor')[0]
-        authorName = authorAnchor.text
-        authorURL = authorAnchor.absolute_links.pop()
-        author = ForumAuthor(authorName, url = authorURL)
+    # Inserts the thread into the database, or updates it if it already exists
+    thread.insert(mysql)
 
-        # Replaces underscores with spaces so that the net can analyze the name properly
-        authorNameWithSpaces = authorName.replace('_', ' ')
+    # Adds all posts with the linked thread SQL ID, or ignores the ones that already exist
+    for post in posts:
+        post.threadID = thread.sqlID
+        post.threadHLTVID = thread.hltvID
 
-        # Calculates hate speech and offensive language rating
-        rating = sonar.ping(f"{authorNameWithSpaces}: {content}")
-        hateRating = 0
-        offRating = 0
+    insertPosts(mysql, posts)
 
-        # Extracts confidence values for hate speech and offensive language from result
-        for ratingClass in rating['classes']:
-            if ratingClass['class_name'] == 'hate_speech':
-                hateRating = ratingClass['confidence']
-            elif ratingClass['class_name'] == 'offensive_language':
-                offRating = ratingClass['confidence']
 
-        newPost = ForumPost(postID, thread.sqlID, replyNum, author, content, timestamp, hateRating, offRating)
-        thread.posts += [newPost]
+# Saves the new posts of a thread page to the database and moves the cursor of the thread to the page
+def saveThreadPage(mysql: MySQLWrapper, tracker: ThreadTracker, page: ThreadPage):
+    thread = page.thread
+    savePosts(mysql, thread, page.posts)
+
+    if len(page.posts) > 0:
+        tracker.saveCursor(mysql, thread, max(post.index for post in page.posts), page.url)
+
+    # Once the last page is saved, the thread is skipped until it changes
+    if page.isLastPage:
+        tracker.markUpdated(mysql, thread)
+
+    # Commits all changes of the page at once
+    mysql.commit()
 
 
 # Returns the list of forums that should be observed
@@ -131,121 +251,360 @@ def getForums(mysql: MySQLWrapper):
         return forums
 
 
-def getRefreshTime(mysql: MySQLWrapper):
-    mysql.query("SELECT Value FROM Signals WHERE SignalName='Refresh';")
-    results = mysql.fetchResults()
+# Adds the posts saved since the last update to the aggregated statistics
+# While the database is unavailable, the posts are added after a later update.
+# pool: Pool of database connections. The update needs its own transactions, so the autocommitting main connection can't be used.
+def saveRollups(pool: MySQLPool):
+    try:
+        with metrics.timer("rollup_seconds"):
+            with pool.connection() as mysql:
+                postCount = updateRollups(mysql)
+
+    except TRANSIENT_ERRORS as e:
+        print(f"Database unavailable, the aggregated statistics are updated later: {e}")
+        return
+
+    print(f"Added {postCount} posts to the aggregated statistics.")
+
+
+# Passes the threads of a forum that changed since the last scan to the pipeline
+# This blocks while the pipeline is full, but doesn't wait until the threads are saved.
+# Returns True if all changed threads were passed on, so the index can be confirmed in the HTTP cache once they are saved
+# mysql: Database connection of the main thread
+# fetcher: Fetcher used to download the forum index
+# tracker: Tracker that is loaded with the stored state of the forum's threads
+# pipeline: Scan pipeline the threads are passed to
+# control: Control channel, no further threads are passed on once a stop is requested
+# forum: Forum to be scanned
+def scanForum(mysql: MySQLWrapper, fetcher: Fetcher, tracker: ThreadTracker, pipeline: Pipeline, control: ControlChannel, forum: Forum):
+    # Loads the stored state of the listed threads and skips the ones without new replies
+    listedThreads = getForumThreads(fetcher, forum)
+
+    # While the database is unavailable, the threads without a loaded state are read from their first page, so their
+    # pages still reach the spool. Posts are upserted, so reading them again is safe.
+    try:
+        tracker.loadThreads(mysql, listedThreads)
+    except TRANSIENT_ERRORS as e:
+        print(f"Database unavailable, reading all listed threads of {forum.name}: {e}")
+
+    threads = [thread for thread in listedThreads if tracker.hasChanged(thread)]
+    print(f"\t{len(listedThreads) - len(threads)}/{len(listedThreads)} threads unchanged")
+
+    for thread in threads:
+        if control.shouldStop():
+            return False
+
+        pipeline.put(thread)
+
+    return True
+
+
+# Returns the number of pages that failed in any stage of the pipeline
+def getPipelineErrorCount(pipeline: Pipeline) -> int:
+    return sum(stats["errors"] for stats in pipeline.getStats())
+
+
+# Scans forums as one of several sharded scanners until a stop is requested.
+# Instead of cycling through all forums, the scanner repeatedly claims the forum that has been due for the longest time.
+# auth: Authorization info used for the coordinator's own connection
+# mysql: Database connection of the main thread
+# pool: Pool of database connections, used to update the aggregated statistics
+# drainer: Drainer of the spool the pipeline writes to, or None
+# fetcher: Fetcher whose rate is set to this scanner's share of the request budget
+# httpCache: HTTP cache that is saved after every forum
+# tracker: Thread tracker of the scanner
+# pipeline: Started scan pipeline
+# control: Control channel of the scanner
+# metricsFile: Path of the Prometheus file that is rewritten after every forum
+def runShardedScanner(auth: AuthorizationInfo, mysql: MySQLWrapper, pool: MySQLPool, drainer: SpoolDrainer, fetcher: Fetcher, httpCache: HTTPCache, tracker: ThreadTracker, pipeline: Pipeline, control: ControlChannel, metricsFile: str):
+    coordinator = ShardCoordinator(auth, REQUESTS_PER_SECOND, CLAIM_LEASE_TIME)
+    coordinator.start()
+    print(f"Scanning as sharded worker {coordinator.owner}")
+
+    try:
+        while not control.shouldStop():
+            try:
+                forums = getForums(mysql)
+                coordinator.register(forums)
+                forum = coordinator.claimNextForum(forums)
+
+            except TRANSIENT_ERRORS as e:
+                print(f"Database unavailable, trying again in {CLAIM_POLL_INTERVAL}s: {e}")
+                control.sleep(CLAIM_POLL_INTERVAL)
+                continue
+
+            if forum is None:
+                # Waits until the next forum is due, checking regularly for forums released by other scanners
+                waitTime = coordinator.getSecondsUntilNextScan()
+                if waitTime is None:
+                    waitTime = CLAIM_POLL_INTERVAL
+
+                control.sleep(max(1, min(waitTime, CLAIM_POLL_INTERVAL)))
+                continue
+
+            # Uses this scanner's share of the request budget, which changes as scanners join or leave
+            fetcher.setRate(coordinator.getRequestRate())
+            print(f"Updating forum {forum.name} ({coordinator.workerCount} workers, {fetcher.requestsPerSecond:.3f} requests/s)")
+
+            scanStartTime = datetime.now()
+            errorCount = getPipelineErrorCount(pipeline)
+
+            try:
+                isComplete = scanForum(mysql, fetcher, tracker, pipeline, control, forum)
+            except TRANSIENT_ERRORS as e:
+                print(f"Database unavailable, skipping forum {forum.name}: {e}")
+                isComplete = False
+
+            # The claim is only released once all threads of the forum are saved, so the next scanner sees their cursors
+            pipeline.join()
+            if drainer is not None:
+                drainer.waitUntilDrained()
+            tracker.clear()
+
+            # An unchanged index is only skipped in the next scan if all of its threads were saved
+            if isComplete and getPipelineErrorCount(pipeline) == errorCount:
+                httpCache.confirm(forum.getURL())
+            httpCache.save()
+
+            # Forums whose scan was interrupted are released right away, so another scanner can continue them.
+            # If the claim can't be released, it expires after its lease time.
+            try:
+                if control.isStopRequested() or not isComplete:
+                    coordinator.release(forum)
+                else:
+                    coordinator.release(forum, control.getRefreshTime())
+
+            except TRANSIENT_ERRORS as e:
+                print(f"Database unavailable, the claim of forum {forum.name} expires: {e}")
+
+            if UPDATE_ROLLUPS:
+                saveRollups(pool)
+
+            scanDuration = (datetime.now() - scanStartTime).total_seconds()
+            print(f"Forum {forum.name} updated in {scanDuration:.0f}s.")
+            metrics.logEvent("forum", forum = forum.name, duration = scanDuration, workers = coordinator.workerCount)
+            metrics.writePrometheusFile(metricsFile)
+
+    finally:
+        coordinator.close()
+
+
+# Creates the pipeline that downloads, parses, classifies and saves threads page by page.
+# Every stage runs in its own threads, so the stages overlap. Bounded queues between them limit the memory usage.
+# fetcher: Fetcher used to download thread pages
+# classifier: Classifier used to rate the posts
+# pool: Pool of database connections used by the persist stage
+# tracker: Tracker that provides the cursors of the threads and is updated once a page is saved
+# control: Control channel, queued threads are skipped once a stop is requested
+# spool: Spool the pages are written to instead of the database, or None
+def createScanPipeline(fetcher: Fetcher, classifier: PostClassifier, pool: MySQLPool, tracker: ThreadTracker, control: ControlChannel, spool: PostSpool = None) -> Pipeline:
+
+    # Passes on every page of a thread as soon as it arrived, and stops at the next page once a stop is requested
+    def fetchThread(thread):
+        if RESUME_THREADS:
+            yield from iterThreadPages(fetcher, thread, tracker.getResumeURL(thread), tracker.getLastReplyNum(thread), control = control)
+        else:
+            yield from iterThreadPages(fetcher, thread, thread.getURL(), control = control)
 
-    if results is None:
-        return 30
-    else:
-        return results[0][0]
-
-# Sets the End-Signal of the database
-def setEndSignal(mysql: MySQLWrapper, enable: bool):
-    enableInt = 0
-    if enable:
-        enableInt = 1
-    mysql.query("INSERT INTO Signals (SignalName, Value) VALUES (%s, %s) ON DUPLICATE KEY UPDATE Value=%s;", ('End', enableInt, enableInt,))
-    mysql.db.commit()
-
-# Retrieves the End-Signal of the database
-def getEndSignal(mysql: MySQLWrapper):
-    mysql.query("SELECT Value FROM Signals WHERE SignalName='End';")
-    results = mysql.fetchResults()
+    def parsePage(page):
+        with metrics.timer("parse_seconds", {"page": "thread"}):
+            parseThreadPage(page)
 
-    if results is None or results[0][0] == 1:
-        return True
-    else:
-        return False
+        return page
 
+    def ratePage(page):
+        classifyPosts(classifier, page.posts)
+        return page
 
-# Connect to MySQL database
-auth = AuthorizationInfo("auth.json")
-mysql = MySQLWrapper(auth)
-overwrite = False
+    def persistPage(page):
+        # The spool's drainer saves the page to the database in the background
+        if spool is not None:
+            spool.append(encodePage(page))
+        else:
+            with pool.connection() as mysql:
+                saveThreadPage(mysql, tracker, page)
 
-# Creates required tables
-initializeTables(mysql, overwrite)
+        # The page is only skipped as unchanged once it's saved
+        if fetcher.httpCache is not None:
+            fetcher.httpCache.confirm(page.url)
 
-# Defines forums to be observed
-forums = []
-forums += [Forum("Offtopic", "17/off-topic")]
-forums += [Forum("CSGO", "28/counter-strike-global-offensive")]
-forums += [Forum("Hardware", "16/hardware-tweaks")]
+        print(f"\tThread: {page.thread.title} ({len(page.posts)} new posts on {page.url})")
 
-for forum in forums:
-    forum.insert(mysql)
+    return Pipeline([
+        PipelineStage("fetch", fetchThread, MAX_CONCURRENT_REQUESTS, PIPELINE_QUEUE_SIZE),
+        PipelineStage("parse", parsePage, 1, PIPELINE_QUEUE_SIZE),
+        PipelineStage("classify", ratePage, max(1, CLASSIFIER_PROCESSES), PIPELINE_QUEUE_SIZE),
+        PipelineStage("persist", persistPage, PERSIST_WORKERS, PIPELINE_QUEUE_SIZE)
+    ])
 
-# By default, the forums are scraped every 15min
-mysql.query("INSERT INTO Signals (SignalName, Value) VALUES ('Refresh', 15) ON DUPLICATE KEY UPDATE SignalName='Refresh';")
-mysql.db.commit()
 
-# Starts a new HTML-session
-session = HTMLSession()
+def main():
+    parser = argparse.ArgumentParser(description = "Scans the observed HLTV forums for new posts and rates them")
+    parser.add_argument("--worker", default = None, help = "name of this scanner if several sharded scanners run on the same host, it's appended to the scanner's local files")
+    args = parser.parse_args()
 
-setEndSignal(mysql, False)
-while not getEndSignal(mysql):
-    # Resets the refresh timer and debug output
-    lastUpdateTime = datetime.now()
-    timeStr = lastUpdateTime.strftime("%d.%m.%Y, %H:%M:%S")
-    print(f"Starting new update at {timeStr}!")
+    metricsFile = getWorkerPath(METRICS_FILE, args.worker)
+    metrics.configure(METRICS_ENABLED, getWorkerPath(METRICS_LOG, args.worker))
+    if METRICS_ENABLED and METRICS_PORT is not None:
+        metrics.startHTTPServer(METRICS_PORT)
 
-    # Resets data counter each cycle
-    byteCount = 0
+    # Connect to MySQL database. The connection autocommits, so it sees signals and pages written by other connections.
+    auth = AuthorizationInfo("auth.json")
+    mysql = MySQLWrapper(auth, autocommit = True)
+    overwrite = False
 
-    # Loads all forums that should be observed
-    forums = getForums(mysql)
+    # Creates required tables
+    initializeTables(mysql, overwrite)
+
+    # Loads the SQL IDs of known forums, threads and authors to skip redundant upserts
+    warmIdentityMaps(mysql)
+
+    # Defines forums to be observed
+    forums = []
+    forums += [Forum("Offtopic", "17/off-topic")]
+    forums += [Forum("CSGO", "28/counter-strike-global-offensive")]
+    forums += [Forum("Hardware", "16/hardware-tweaks")]
 
-    forumCount = 1
     for forum in forums:
-        print(f"Updating forum {forumCount}/{len(forums)}: {forum.name}")
+        forum.insert(mysql)
+
+    # By default, the forums are scraped every 15min
+    mysql.query("INSERT INTO Signals (SignalName, Value) VALUES ('Refresh', 15) ON DUPLICATE KEY UPDATE SignalName='Refresh';")
+    mysql.commit()
+
+    # Starts the fetcher that downloads pages concurrently within the rate limit
+    # Pages are requested conditionally, so unchanged pages aren't downloaded again
+    httpCache = HTTPCache(getWorkerPath(HTTP_CACHE_FILE, args.worker))
+    fetcher = Fetcher(REQUESTS_PER_SECOND, httpCache = httpCache)
+
+    # Loads the classification model in separate processes
+    classifier = PostClassifier(cache = ClassificationCache(path = getWorkerPath(CLASSIFICATION_CACHE_FILE, args.worker)), processes = CLASSIFIER_PROCESSES)
 
-        # Loads all threads for the forum
-        threads = getForumThreads(session, forum)
+    # Remembers the reply counts of scanned threads to skip unchanged ones
+    tracker = ThreadTracker()
 
-        threadCount = 1
-        for thread in threads:
-            loadThreadContent(session, thread)
+    # Reacts to the Signals table, Unix signals and the control file
+    control = ControlChannel(mysql, controlFile = getWorkerPath(CONTROL_FILE, args.worker))
+    control.reset()
+    control.installSignalHandlers()
 
-            # Adds the thread author to the database, or updates them if they already exist
-            thread.author.insert(mysql)
+    # The pipeline writes through its own connections, as connections can't be shared between threads
+    pool = MySQLPool(auth, PERSIST_WORKERS)
 
-            # Inserts the thread into the database, or updates it if it already exists
-            thread.insert(mysql)
-            mysql.db.commit()
+    # Saved pages are spooled to disk first, and pages left from a previous run are written to the database
+    spool = None
+    drainer = None
+    if SPOOL_DIR is not None:
+        spool = PostSpool(getWorkerPath(SPOOL_DIR, args.worker))
+        drainer = SpoolDrainer(spool, auth, lambda drainerMySQL, records: replayPages(drainerMySQL, tracker, records))
+        drainer.start()
+
+    pipeline = createScanPipeline(fetcher, classifier, pool, tracker, control, spool)
+    pipeline.start()
+
+    # Sharded scanners claim single forums, otherwise all forums are scanned in cycles
+    if SHARDED:
+        runShardedScanner(auth, mysql, pool, drainer, fetcher, httpCache, tracker, pipeline, control, metricsFile)
+    else:
+        totalByteCount = 0
+
+        while not control.shouldStop():
+            # Resets the refresh timer and debug output
+            lastUpdateTime = datetime.now()
+            timeStr = lastUpdateTime.strftime("%d.%m.%Y, %H:%M:%S")
+            print(f"Starting new update at {timeStr}!")
+
+            # Resets data counter each cycle
+            fetcher.resetByteCount()
+            postsBefore = metrics.getCounterTotal("posts_saved_total")
+            errorCount = getPipelineErrorCount(pipeline)
+
+            # Loads all forums that should be observed. While the database is unavailable, the forums of the last cycle
+            # are scanned and their pages are kept in the spool.
+            try:
+                forums = getForums(mysql)
+            except TRANSIENT_ERRORS as e:
+                print(f"Database unavailable, scanning the forums of the last cycle: {e}")
+
+            completeForums = []
+
+            forumCount = 1
+            for forum in forums:
+                if control.shouldStop():
+                    break
+
+                print(f"Updating forum {forumCount}/{len(forums)}: {forum.name}")
+                forumCount += 1
+
+                try:
+                    if scanForum(mysql, fetcher, tracker, pipeline, control, forum):
+                        completeForums += [forum]
+                except TRANSIENT_ERRORS as e:
+                    print(f"Database unavailable, skipping forum {forum.name}: {e}")
+
+            # Waits until all threads of this cycle are saved
+            pipeline.join()
+            if drainer is not None and not drainer.waitUntilDrained():
+                print("The database is unavailable, saved pages are kept in the spool.")
+
+            # An unchanged index is only skipped in the next cycle if all of its threads were saved
+            if getPipelineErrorCount(pipeline) == errorCount:
+                for forum in completeForums:
+                    httpCache.confirm(forum.getURL())
+
+            # The threads of the next cycle are loaded again, so the tracker doesn't grow with every listed thread
+            tracker.clear()
+
+            byteCount = fetcher.resetByteCount()
+            totalByteCount += byteCount
+
+            if UPDATE_ROLLUPS:
+                saveRollups(pool)
+
+            print(f"Update complete! Data downloaded: {byteCount/1e+6} MB. {totalByteCount/1e+9} GB downloaded so far.")
+
+            # Saves the HTTP validators, so they survive restarts
+            httpCache.save()
+            httpStats = httpCache.getStats()
+            print(f"{httpStats['notModified']}/{httpStats['requests']} requests not modified, {httpStats['bytesSaved']/1e+6} MB saved so far.")
+            print("Pipeline statistics:")
+            print(pipeline.formatStats())
+
+            # Exports the metrics of the cycle
+            cycleDuration = (datetime.now() - lastUpdateTime).total_seconds()
+            postCount = metrics.getCounterTotal("posts_saved_total") - postsBefore
+            metrics.logEvent(
+                "cycle", duration = cycleDuration, bytes = byteCount, posts = postCount,
+                postsPerSecond = postCount / cycleDuration if cycleDuration > 0 else 0.0,
+                stages = pipeline.getStats(), http = httpStats
+            )
+            metrics.writePrometheusFile(metricsFile)
 
-            # Iterates over the posts a second time and adds the posts with the linked thread SQL ID
-            for post in thread.posts:
-                # Adds post and author to the database, or ignores it if it already exists
-                post.threadID = thread.sqlID
-                post.threadHLTVID = thread.hltvID
-                post.author.insert(mysql)
-                post.insert(mysql)
-                mysql.db.commit()
+            # Checks how long the one refresh cycle should be
+            cycleDurationMin = control.getRefreshTime()
+            nextUpdateTime = lastUpdateTime + timedelta(minutes = cycleDurationMin)
 
-            print(f"\tThread {threadCount}/{len(threads)}: {thread.title} ({len(thread.posts)-1} replies)")
-            
-            # Very conservative, slightly randomized rate limit as no high refresh rates are required
-            time.sleep(2.0 + random.random())
-            threadCount += 1
+            # Outputs time of next refresh
+            if datetime.now() < nextUpdateTime:
+                timeStr = nextUpdateTime.strftime("%d.%m.%Y, %H:%M:%S")
+                timeUntilNextUpdate = nextUpdateTime - datetime.now()
+                print(f"Next update at {timeStr}. (In {timeUntilNextUpdate.total_seconds()/60} minutes)")
 
-        # Commits changes to the database
+            # Waits until the next refresh cycle should start or an end signal is received
+            control.waitForNextCycle(lastUpdateTime)
 
-        forumCount += 1
-        totalByteCount += byteCount
+    print("Stopping...")
+    pipeline.stop()
 
-    print(f"Update complete! Data downloaded: {byteCount/1e+6} MB. {totalByteCount/1e+9} GB downloaded so far.")
+    # Pages that can't be written to the database stay in the spool until the next start
+    if drainer is not None:
+        drainer.close()
+        spool.close()
 
-    # Checks how long the one refresh cycle should be
-    cycleDurationMin = getRefreshTime(mysql)
-    nextUpdateTime = lastUpdateTime + timedelta(minutes = cycleDurationMin)
+    pool.close()
+    classifier.close()
+    fetcher.close()
 
-    # Outputs time of next refresh
-    if datetime.now() < nextUpdateTime:
-        timeStr = nextUpdateTime.strftime("%d.%m.%Y, %H:%M:%S")
-        timeUntilNextUpdate = nextUpdateTime - datetime.now()
-        print(f"Next update at {timeStr}. (In {timeUntilNextUpdate.total_seconds()/60} minutes)")
 
-    # Waits until the next refresh cycle should start or an end signal is received
-    while datetime.now() < nextUpdateTime and not getEndSignal(mysql):
-        time.sleep(5.0)
+if __name__ == "__main__":
+    main()
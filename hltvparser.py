@@ -0,0 +1,132 @@
+# This module extracts forum threads and posts from the HTML of HLTV pages.
+# It parses each page once with lxml and uses CSS selectors that are compiled once when the module is loaded.
+# This avoids the element wrappers requests_html creates for every find-call.
+# The extracted values are the same as those of requests_html: texts are built with the same pyquery function
+# that requests_html uses for Element.text, and links are resolved against the page URL.
+# Parsing a document and extracting values from it are separate steps, so a parsed thread page can be inspected
+# for the link to its next page before its posts are extracted.
+
+from lxml import html as lxmlhtml
+from lxml.cssselect import CSSSelector
+from pyquery.text import extract_text
+from urllib.parse import urljoin
+from collections import namedtuple
+from datetime import datetime
+
+# A thread as listed in the forum index
+ThreadRow = namedtuple("ThreadRow", ["url", "title", "replyCount", "authorURL", "authorName"])
+
+# A post of a thread. postID is '' and replyNum is 0 for the initial post.
+PostRow = namedtuple("PostRow", ["postID", "replyNum", "content", "timestamp", "authorName", "authorURL"])
+
+# Selectors of the forum index
+forumThreadsSelector = CSSSelector('.forumthreads')
+tableRowSelector = CSSSelector('tr.tablerow')
+nameSelector = CSSSelector('td.name')
+repliesSelector = CSSSelector('td.replies')
+authorSelector = CSSSelector('td.author')
+
+# Selectors of a thread page
+postSelector = CSSSelector('.post, .forumthread')
+replyNumSelector = CSSSelector('.replyNum')
+contentSelector = CSSSelector('.forum-middle')
+bottomBarSelector = CSSSelector('.forum-bottombar')
+authorAnchorSelector = CSSSelector('.authorAnchor')
+
+# Link to the next page of a paginated thread or forum index. On the last page, the link is marked as inactive.
+nextPageSelector = CSSSelector('.pagination-next:not(.inactive)')
+
+linkSelector = CSSSelector('a')
+
+# Returns the text of an element the same way requests_html does
+# element: lxml element
+def getText(element) -> str:
+    return extract_text(element)
+
+# Returns the first absolute link in an element, or None if it contains no link
+# element: lxml element
+# url: URL of the page, used to resolve relative links
+def getLink(element, url: str):
+    for anchor in linkSelector(element):
+        href = anchor.get('href', '').strip()
+
+        # Skips the same links requests_html skips
+        if href and not href.startswith('#') and not href.startswith(('javascript:', 'mailto:')):
+            return urljoin(url, href)
+
+    return None
+
+# Parses an HTML document
+# html: HTML of the page
+def parseDocument(html: str):
+    return lxmlhtml.document_fromstring(html)
+
+# Returns all threads listed on a forum index page
+# html: HTML of the page
+# url: URL of the page
+def parseForumThreads(html: str, url: str) -> list:
+    return extractForumThreads(parseDocument(html), url)
+
+# Returns all threads listed on a parsed forum index page
+# document: Parsed HTML document of the page
+# url: URL of the page
+def extractForumThreads(document, url: str) -> list:
+    forumDiv = forumThreadsSelector(document)[0]
+    rows = []
+
+    for row in tableRowSelector(forumDiv):
+        tdName = nameSelector(row)[0]
+        tdReplies = repliesSelector(row)[0]
+        tdAuthor = authorSelector(row)[0]
+
+        rows += [ThreadRow(
+            getLink(tdName, url),
+            getText(tdName),
+            int(getText(tdReplies)),
+            getLink(tdAuthor, url),
+            getText(tdAuthor)
+        )]
+
+    return rows
+
+# Returns the URL of the next page of a paginated page, or None if it's the last page
+# document: Parsed HTML document of the page
+# url: URL of the page
+def extractNextPageURL(document, url: str):
+    for element in nextPageSelector(document):
+        nextURL = getLink(element, url)
+
+        if nextURL is not None and nextURL != url:
+            return nextURL
+
+    return None
+
+# Returns all posts on a thread page
+# html: HTML of the page
+# url: URL of the page
+def parsePosts(html: str, url: str) -> list:
+    return extractPosts(parseDocument(html), url)
+
+# Returns all posts of a parsed thread page
+# document: Parsed HTML document of the page
+# url: URL of the page
+def extractPosts(document, url: str) -> list:
+    posts = []
+
+    for reply in postSelector(document):
+        content = getText(contentSelector(reply)[0])
+        timestamp = datetime.strptime(getText(bottomBarSelector(reply)[0]), "%Y-%m-%d %H:%M")
+        authorAnchor = authorAnchorSelector(reply)[0]
+
+        # These fields only exist for replies, not the top post
+        replyNumAnchors = replyNumSelector(reply)
+        postID = ''
+        replyNum = 0
+
+        if len(replyNumAnchors) > 0:
+            replyNum = int(getText(replyNumAnchors[0])[1:])
+            postID = reply.get('id')
+
+        posts += [PostRow(postID, replyNum, content, timestamp, getText(authorAnchor), getLink(authorAnchor, url))]
+
+    return posts
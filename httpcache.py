@@ -0,0 +1,157 @@
+# This class enables conditional HTTP requests, so pages that didn't change since the last download aren't
+# transferred again.
+# The ETag and Last-Modified headers of every response are stored per URL and sent back as If-None-Match and
+# If-Modified-Since. The server then answers with "304 Not Modified" and no body if the page is unchanged.
+# It also makes sure compressed transfer is negotiated and counts the downloaded and saved bytes per URL.
+# The validators can be saved to a JSON-file, so they survive restarts.
+# The validators of a response are only sent with later requests once the page was saved and they are confirmed.
+# Otherwise a page that was downloaded but lost, e.g. because the scan was stopped, would be reported as unchanged.
+
+from lrucache import LRUCache
+from metrics import metrics
+
+import json
+import os
+import threading
+
+# Brotli is only negotiated if a decoder is installed, otherwise responses couldn't be decompressed
+try:
+    import brotli
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# Returns the number of bytes transferred for a response. This is the compressed size if the server reports it.
+# response: Response of a request
+def getTransferredBytes(response) -> int:
+    contentLength = response.headers.get("Content-Length")
+
+    if contentLength is not None and contentLength.isdigit():
+        return int(contentLength)
+    else:
+        return len(response.content)
+
+
+class HTTPCache:
+
+    # Constructor
+    # path: Path of the JSON-file the validators are saved to, or None to only keep them in memory
+    # maxSize: Maximum number of URLs whose validators and statistics are kept
+    def __init__(self, path: str = None, maxSize: int = 50000):
+        self.path = path
+        self.entries = LRUCache(maxSize)
+
+        self.totalsLock = threading.Lock()
+        self.requestCount = 0
+        self.notModifiedCount = 0
+        self.bytesDownloaded = 0
+        self.bytesSaved = 0
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    # Returns the entry of a URL, creating it if it doesn't exist
+    # url: URL of the page
+    def getEntry(self, url: str) -> dict:
+        entry = self.entries.get(url)
+
+        if entry is None:
+            entry = {"etag": None, "lastModified": None, "pending": None, "size": 0, "requests": 0, "notModified": 0, "bytesDownloaded": 0, "bytesSaved": 0}
+            self.entries.put(url, entry)
+
+        return entry
+
+    # Returns the headers for a conditional request of a URL
+    # url: URL of the page
+    def getRequestHeaders(self, url: str) -> dict:
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        entry = self.entries.get(url)
+
+        if entry is not None:
+            if entry["etag"] is not None:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["lastModified"] is not None:
+                headers["If-Modified-Since"] = entry["lastModified"]
+
+        return headers
+
+    # Remembers the validators of a response until they are confirmed, and updates the statistics
+    # url: URL of the page
+    # response: Response of the request
+    def update(self, url: str, response):
+        entry = self.getEntry(url)
+        entry["requests"] += 1
+
+        transferredBytes = getTransferredBytes(response)
+        savedBytes = 0
+
+        if response.status_code == 304:
+            entry["notModified"] += 1
+            savedBytes = entry["size"]
+
+        elif response.status_code == 200:
+            entry["pending"] = [response.headers.get("ETag"), response.headers.get("Last-Modified")]
+            entry["size"] = transferredBytes
+
+        entry["bytesDownloaded"] += transferredBytes
+        entry["bytesSaved"] += savedBytes
+
+        metrics.increment("http_cache_requests_total", 1, {"result": "not_modified" if response.status_code == 304 else "downloaded"})
+        metrics.increment("http_cache_bytes_saved_total", savedBytes)
+
+        with self.totalsLock:
+            self.requestCount += 1
+            self.bytesDownloaded += transferredBytes
+            self.bytesSaved += savedBytes
+
+            if response.status_code == 304:
+                self.notModifiedCount += 1
+
+    # Sends the validators of the last downloaded version of a URL with later requests.
+    # Must only be called once the page was saved, so an unchanged page can be skipped.
+    # url: URL of the page
+    def confirm(self, url: str):
+        entry = self.entries.get(url)
+
+        if entry is not None and entry.get("pending") is not None:
+            entry["etag"], entry["lastModified"] = entry["pending"]
+            entry["pending"] = None
+
+    # Returns the statistics of a single URL, or None if it was never requested
+    # url: URL of the page
+    def getURLStats(self, url: str):
+        entry = self.entries.get(url)
+
+        if entry is None:
+            return None
+
+        return {key: entry[key] for key in ("requests", "notModified", "bytesDownloaded", "bytesSaved")}
+
+    # Returns the statistics of all requests
+    def getStats(self) -> dict:
+        with self.totalsLock:
+            return {
+                "requests": self.requestCount,
+                "notModified": self.notModifiedCount,
+                "bytesDownloaded": self.bytesDownloaded,
+                "bytesSaved": self.bytesSaved
+            }
+
+    # Loads the validators from the JSON-file
+    def load(self):
+        with open(self.path, "r") as f:
+            for url, entry in json.loads(f.read()).items():
+                self.entries.put(url, entry)
+
+    # Saves the validators to the JSON-file
+    def save(self):
+        if self.path is None:
+            return
+
+        # Writes to a temporary file first, so an interrupted save doesn't corrupt the existing file.
+        # The file is unique per process, as several sharded scanners may share the cache file.
+        temporaryPath = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporaryPath, "w") as f:
+            json.dump(dict(self.entries.items()), f)
+
+        os.replace(temporaryPath, self.path)
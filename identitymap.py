@@ -0,0 +1,63 @@
+# This class maps HLTVIDs to SQL IDs of rows that are known to exist in the database.
+# It lets entities skip their upsert and ID lookup if they were already written and didn't change since.
+# Each entry stores a signature of the written values (e.g. the author name), so changed entities are still updated.
+# The map is bounded and evicts the least recently used entries, evicted entities are simply looked up again.
+# Entities written in a transaction are only remembered once it's committed, so IDs of rolled back rows are never reused.
+
+from lrucache import LRUCache
+from mysqlwrapper import MySQLWrapper
+from metrics import metrics
+
+class IdentityMap:
+
+    # Constructor
+    # maxSize: Maximum number of entities that are remembered
+    # name: Name of the map used in the metrics
+    def __init__(self, maxSize: int = 10000, name: str = ""):
+        self.entries = LRUCache(maxSize)
+        self.metricLabels = {"map": name}
+
+    # Returns the SQL ID of a known entity, or None if it's unknown or changed since it was written
+    # hltvID: HLTVID of the entity
+    # signature: Values of the entity that would be written by an upsert
+    def lookup(self, hltvID, signature = None):
+        entry = self.entries.get(hltvID)
+
+        if entry is None or entry[1] != signature:
+            metrics.increment("identity_map_misses_total", 1, self.metricLabels)
+            return None
+        else:
+            metrics.increment("identity_map_hits_total", 1, self.metricLabels)
+            return entry[0]
+
+    # Remembers that an entity exists in the database
+    # hltvID: HLTVID of the entity
+    # sqlID: SQL ID of the entity
+    # signature: Values of the entity that were written
+    # mysql: Connection that wrote the entity. It's remembered once the connection commits, None if it's committed already.
+    def remember(self, hltvID, sqlID, signature = None, mysql: MySQLWrapper = None):
+        if sqlID is None:
+            return
+
+        if mysql is None:
+            self.entries.put(hltvID, (sqlID, signature))
+        else:
+            mysql.afterCommit(lambda: self.entries.put(hltvID, (sqlID, signature)))
+
+    # Removes an entity, e.g. if it was deleted from the database
+    # hltvID: HLTVID of the entity
+    def forget(self, hltvID):
+        self.entries.remove(hltvID)
+
+    # Fills the map with rows from the database
+    # mysql: Database connection
+    # operation: SQL-command selecting HLTVID, SQL ID and optionally the signature of each row
+    # params: Parameters of the SQL-command
+    def warm(self, mysql: MySQLWrapper, operation: str, params = None):
+        mysql.query(operation, params)
+        results = mysql.fetchResults()
+
+        if results is not None:
+            for row in results:
+                signature = row[2] if len(row) > 2 else None
+                self.remember(row[0], row[1], signature)
@@ -0,0 +1,63 @@
+# This class is a simple size-bounded mapping that evicts the least recently used entry once it is full.
+# It is thread-safe, so it can be shared between scanner threads.
+
+from collections import OrderedDict
+import threading
+
+class LRUCache:
+
+    # Constructor
+    # maxSize: Maximum number of entries before the least recently used ones are evicted
+    def __init__(self, maxSize: int = 10000):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the value stored for the key, or the default if there is none
+    # key: Key to be looked up
+    # default: Value returned if the key isn't cached
+    def get(self, key, default = None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    # Stores a value, evicting the least recently used entry if the cache is full
+    # key: Key of the entry
+    # value: Value to be stored
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last = False)
+
+    # Removes an entry if it exists
+    # key: Key of the entry to be removed
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    # Returns a list of all (key, value) tuples, from least to most recently used
+    def items(self) -> list:
+        with self.lock:
+            return list(self.entries.items())
+
+    # Removes all entries
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
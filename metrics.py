@@ -0,0 +1,255 @@
+# This module collects timing and throughput metrics of the scanners.
+# Counters count events (e.g. fetched bytes, cache hits), summaries record durations (e.g. fetch latency).
+# Metrics can be exported in the Prometheus text format, either to a file or through a small HTTP endpoint,
+# and events can be written as structured JSON lines.
+# All modules report to the shared 'metrics' object. It's disabled by default, in which case every call returns
+# immediately and timers are a shared no-op object, so instrumentation costs almost nothing.
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import json
+import os
+import threading
+import time
+
+# Number of recent observations per summary that are kept to calculate percentiles
+MAX_SAMPLES = 2048
+
+# Timer that does nothing, used while metrics are disabled
+class NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+NULL_TIMER = NullTimer()
+
+
+# Timer that records the time spent in a with-block
+class Timer:
+
+    def __init__(self, metrics, name: str, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.startTime, self.labels)
+        return False
+
+
+class Metrics:
+
+    # Constructor
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+
+        # Maps (name, labels) to the value of a counter
+        self.counters = {}
+
+        # Maps (name, labels) to [count, sum, recent samples] of a summary
+        self.summaries = {}
+
+        self.logPath = None
+        self.server = None
+
+    # Enables or disables collecting metrics
+    # enabled: If False, all calls return immediately
+    # logPath: Path of the file structured log events are appended to, or None to print them
+    def configure(self, enabled: bool = True, logPath: str = None):
+        self.enabled = enabled
+        self.logPath = logPath
+
+    # Converts a label dictionary into a hashable key
+    def __getLabelKey(self, labels) -> tuple:
+        if labels is None:
+            return ()
+        else:
+            return tuple(sorted(labels.items()))
+
+    # Increases a counter
+    # name: Name of the counter
+    # value: Amount by which the counter is increased
+    # labels: Dictionary of label names and values, or None
+    def increment(self, name: str, value: float = 1, labels: dict = None):
+        if not self.enabled:
+            return
+
+        key = (name, self.__getLabelKey(labels))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Records an observation of a summary, e.g. a duration
+    # name: Name of the summary
+    # value: Observed value
+    # labels: Dictionary of label names and values, or None
+    def observe(self, name: str, value: float, labels: dict = None):
+        if not self.enabled:
+            return
+
+        key = (name, self.__getLabelKey(labels))
+
+        with self.lock:
+            summary = self.summaries.get(key)
+
+            if summary is None:
+                summary = [0, 0.0, deque(maxlen = MAX_SAMPLES)]
+                self.summaries[key] = summary
+
+            summary[0] += 1
+            summary[1] += value
+            summary[2].append(value)
+
+    # Returns a context manager that records the time spent in its with-block
+    # name: Name of the summary
+    # labels: Dictionary of label names and values, or None
+    def timer(self, name: str, labels: dict = None):
+        if not self.enabled:
+            return NULL_TIMER
+
+        return Timer(self, name, labels)
+
+    # Returns the value of a counter
+    # name: Name of the counter
+    # labels: Dictionary of label names and values, or None
+    def getCounter(self, name: str, labels: dict = None) -> float:
+        with self.lock:
+            return self.counters.get((name, self.__getLabelKey(labels)), 0)
+
+    # Returns the sum of a counter over all label values
+    # name: Name of the counter
+    def getCounterTotal(self, name: str) -> float:
+        with self.lock:
+            return sum(value for (counterName, labels), value in self.counters.items() if counterName == name)
+
+    # Returns the count, sum and percentiles of a summary, or None if nothing was observed
+    # name: Name of the summary
+    # labels: Dictionary of label names and values, or None
+    # percentiles: List of percentiles between 0 and 100 calculated from the recent samples
+    def getSummary(self, name: str, labels: dict = None, percentiles: list = [50, 90, 99]):
+        with self.lock:
+            summary = self.summaries.get((name, self.__getLabelKey(labels)))
+
+            if summary is None:
+                return None
+
+            count, total, samples = summary[0], summary[1], sorted(summary[2])
+
+        result = {"count": count, "sum": total, "mean": total / count}
+
+        for percentile in percentiles:
+            index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+            result[f"p{percentile}"] = samples[index]
+
+        return result
+
+    # Returns all label dictionaries a summary was observed with
+    # name: Name of the summary
+    def getSummaryLabels(self, name: str) -> list:
+        with self.lock:
+            return [dict(labels) for (summaryName, labels) in self.summaries.keys() if summaryName == name]
+
+    # Removes all collected values
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.summaries = {}
+
+    # Returns all metrics in the Prometheus text exposition format
+    def formatPrometheus(self) -> str:
+        lines = []
+
+        def formatLabels(labels):
+            if len(labels) == 0:
+                return ""
+
+            escapedLabels = [f'{key}="{str(value)}"'.replace("\n", " ") for key, value in labels]
+            return "{" + ",".join(escapedLabels) + "}"
+
+        with self.lock:
+            counterNames = sorted(set(name for name, labels in self.counters.keys()))
+            for name in counterNames:
+                lines += [f"# TYPE {name} counter"]
+
+                for (counterName, labels), value in sorted(self.counters.items()):
+                    if counterName == name:
+                        lines += [f"{name}{formatLabels(labels)} {value}"]
+
+            summaryNames = sorted(set(name for name, labels in self.summaries.keys()))
+            for name in summaryNames:
+                lines += [f"# TYPE {name} summary"]
+
+                for (summaryName, labels), summary in sorted(self.summaries.items(), key = lambda item: item[0]):
+                    if summaryName == name:
+                        lines += [f"{name}_count{formatLabels(labels)} {summary[0]}"]
+                        lines += [f"{name}_sum{formatLabels(labels)} {summary[1]}"]
+
+        return "\n".join(lines) + "\n"
+
+    # Writes all metrics in the Prometheus text format to a file, e.g. for the node exporter's textfile collector
+    # path: Path of the file
+    def writePrometheusFile(self, path: str):
+        if not self.enabled:
+            return
+
+        # Writes to a temporary file first, so the file is never read half-written
+        temporaryPath = f"{path}.tmp"
+        with open(temporaryPath, "w") as f:
+            f.write(self.formatPrometheus())
+
+        os.replace(temporaryPath, path)
+
+    # Serves the metrics in the Prometheus text format on http://<host>:<port>/metrics in a background thread
+    # port: Port of the HTTP server
+    # host: Address the server listens on
+    def startHTTPServer(self, port: int, host: str = "127.0.0.1"):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metrics.formatPrometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Suppresses the default request logging
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target = self.server.serve_forever, name = "metrics", daemon = True).start()
+
+    # Writes a structured log event as a JSON line
+    # event: Name of the event
+    # fields: Values of the event
+    def logEvent(self, event: str, **fields):
+        if not self.enabled:
+            return
+
+        line = json.dumps({"time": time.time(), "event": event, **fields}, default = str)
+
+        if self.logPath is None:
+            print(line)
+        else:
+            with open(self.logPath, "a") as f:
+                f.write(line + "\n")
+
+
+# Metrics shared by all modules
+metrics = Metrics()
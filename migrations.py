@@ -0,0 +1,153 @@
+# This module brings the tables of an existing database up to date with the current version of initializeTables.
+# Every migration has a version number. The applied versions are stored in the SchemaVersion table, so each migration
+# runs once per database. Migrations check the schema before every step, so they can also be applied to tables that
+# initializeTables already created in their current form, and they can continue if they were interrupted.
+# Indexes are added online (LOCK=NONE) and data is converted in small batches, so scanners can keep writing while
+# a large Posts table is migrated. Only one process migrates at a time.
+#
+# Usage:
+#   python migrations.py   Applies all missing migrations, e.g. before starting updated scanners
+
+from mysqlwrapper import MySQLWrapper
+from authorization import AuthorizationInfo
+
+# Number of posts converted per transaction
+MIGRATION_BATCH_SIZE = 10000
+
+# Returns True if a table has a column with the given name
+def hasColumn(mysql: MySQLWrapper, table: str, column: str) -> bool:
+    mysql.query(
+        "SELECT COUNT(*) FROM information_schema.columns WHERE table_schema=%s AND table_name=%s AND column_name=%s;",
+        (mysql.auth.mysqlDatabase, table, column,)
+    )
+    return mysql.fetchResults()[0][0] > 0
+
+# Returns True if a table has an index with the given name
+def hasIndex(mysql: MySQLWrapper, table: str, index: str) -> bool:
+    mysql.query(
+        "SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema=%s AND table_name=%s AND index_name=%s;",
+        (mysql.auth.mysqlDatabase, table, index,)
+    )
+    return mysql.fetchResults()[0][0] > 0
+
+# Adds an index without blocking writes to the table, unless it already exists
+# mysql: Database connection
+# table: Name of the table
+# index: Name of the index
+# columns: Indexed columns, e.g. "ThreadID, ReplyNum"
+# unique: If True, the values of the columns have to be unique
+def addIndex(mysql: MySQLWrapper, table: str, index: str, columns: str, unique: bool = False):
+    if hasIndex(mysql, table, index):
+        return
+
+    indexType = "UNIQUE INDEX" if unique else "INDEX"
+    print(f"\tAdding index {index} to {table}...")
+    mysql.query(f"ALTER TABLE {table} ADD {indexType} {index} ({columns}), LOCK=NONE;")
+
+# Sets the hash of all posts that don't have one yet, in batches of consecutive PostIDs
+def fillPostHashes(mysql: MySQLWrapper):
+    mysql.query("SELECT MIN(PostID), MAX(PostID) FROM Posts WHERE HLTVHash IS NULL;")
+    results = mysql.fetchResults()
+
+    if results is None:
+        return
+
+    firstPostID, lastPostID = results[0]
+
+    for start in range(firstPostID, lastPostID + 1, MIGRATION_BATCH_SIZE):
+        mysql.query(
+            "UPDATE Posts SET HLTVHash=UNHEX(MD5(HLTVID)) WHERE PostID >= %s AND PostID < %s AND HLTVHash IS NULL;",
+            (start, start + MIGRATION_BATCH_SIZE,)
+        )
+        mysql.commit()
+
+    print(f"\tHashed posts {firstPostID} to {lastPostID}.")
+
+# Version 1: Posts are identified by the 16 byte hash of their HLTVID instead of the HLTVID of up to 511 characters
+def addPostHashes(mysql: MySQLWrapper):
+    if not hasColumn(mysql, "Posts", "HLTVHash"):
+        print("\tAdding column HLTVHash to Posts...")
+        mysql.query("ALTER TABLE Posts ADD COLUMN HLTVHash BINARY(16) DEFAULT NULL, LOCK=NONE;")
+
+    fillPostHashes(mysql)
+    addIndex(mysql, "Posts", "HLTVHash", "HLTVHash", True)
+
+    # Posts inserted by older scanners while the index was built don't have a hash yet
+    fillPostHashes(mysql)
+
+    if hasIndex(mysql, "Posts", "HLTVID"):
+        print("\tRemoving index HLTVID from Posts...")
+        mysql.query("ALTER TABLE Posts DROP INDEX HLTVID, LOCK=NONE;")
+
+# Version 2: Indexes for the joins of the scanners and the analysis, and for time ranges
+def addSecondaryIndexes(mysql: MySQLWrapper):
+    addIndex(mysql, "Posts", "ThreadReply", "ThreadID, ReplyNum")
+    addIndex(mysql, "Posts", "Author", "AuthorID")
+    addIndex(mysql, "Posts", "PostTime", "Time")
+    addIndex(mysql, "Threads", "Forum", "ForumID")
+
+# Migrations as (version, description, function), in the order in which they're applied
+MIGRATIONS = [
+    (1, "Identify posts by the hash of their HLTVID", addPostHashes),
+    (2, "Add indexes on Posts and Threads", addSecondaryIndexes)
+]
+
+# Returns the highest applied migration version, 0 if none was applied
+def getSchemaVersion(mysql: MySQLWrapper) -> int:
+    mysql.query("SELECT MAX(Version) FROM SchemaVersion;")
+    results = mysql.fetchResults()
+
+    if results is None:
+        return 0
+    else:
+        return results[0][0]
+
+# Applies all migrations that weren't applied to the database yet
+# mysql: Database connection
+def migrate(mysql: MySQLWrapper):
+    # SchemaVersion: Contains the migrations that were applied to the database
+    # Version - Version number of the migration
+    # Description - What the migration changed
+    # Time - The time at which the migration was applied
+    mysql.createTable("SchemaVersion", (
+        "Version INT NOT NULL, "
+        "Description VARCHAR(255) NOT NULL, "
+        "Time DATETIME DEFAULT NOW(), "
+        "PRIMARY KEY(Version)"
+    ),
+    "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+
+    if getSchemaVersion(mysql) >= MIGRATIONS[-1][0]:
+        return
+
+    # Other processes starting at the same time wait until the migrations are applied
+    mysql.query("SELECT GET_LOCK('SchemaMigration', 86400);")
+    mysql.fetchResults()
+
+    try:
+        currentVersion = getSchemaVersion(mysql)
+
+        for version, description, function in MIGRATIONS:
+            if version <= currentVersion:
+                continue
+
+            print(f"Migrating database to version {version}: {description}")
+            function(mysql)
+
+            mysql.query("INSERT INTO SchemaVersion (Version, Description) VALUES (%s, %s);", (version, description,))
+            mysql.commit()
+
+    finally:
+        mysql.query("SELECT RELEASE_LOCK('SchemaMigration');")
+        mysql.fetchResults()
+
+
+def main():
+    mysql = MySQLWrapper(AuthorizationInfo("auth.json"))
+    migrate(mysql)
+    print(f"Database is at version {getSchemaVersion(mysql)}.")
+    mysql.close()
+
+
+if __name__ == "__main__":
+    main()
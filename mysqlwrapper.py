@@ -1,21 +1,75 @@
 # This class is a wrapper for MySQL-database operations.
 # Its main purpose it to automatically renew the database connection if it expired.
 # Additionally it provides various helper methods to simply recurring operations.
+# MySQLPool manages several of these connections, so multiple threads can access the database in parallel.
 
 from authorization import AuthorizationInfo
+from metrics import metrics
+from contextlib import contextmanager
 import MySQLdb
+import MySQLdb.cursors
+import re
+import threading
+import time
+
+# Matches the table name of a statement
+tablePattern = re.compile(r"\b(?:INTO|FROM|UPDATE|TABLE)\s+(\w+)", re.IGNORECASE)
+
+# Error codes of a lost connection. mysqlclient passes the code as the first argument of its exceptions.
+# 2006 "MySQL server has gone away": The statement couldn't be sent, e.g. because the connection timed out while idle
+# 2013 "Lost connection to MySQL server during query": The statement may or may not have been executed
+SERVER_GONE_ERROR = 2006
+SERVER_LOST_ERROR = 2013
+
+# Errors after which the same statements may succeed later, e.g. once the database is reachable again or a deadlock
+# was resolved. Other errors, e.g. of invalid data, occur again if the statements are repeated.
+TRANSIENT_ERRORS = (MySQLdb.OperationalError, MySQLdb.InterfaceError)
+
+# Caches the metric labels of every statement, as the same statements are executed over and over
+statementLabels = {}
+
+# Returns the metric labels of a statement, e.g. {"statement": "INSERT", "table": "Posts"}
+# operation: SQL-command
+def getStatementLabels(operation: str) -> dict:
+    labels = statementLabels.get(operation)
+
+    if labels is None:
+        match = tablePattern.search(operation)
+        labels = {
+            "statement": operation.split(None, 1)[0].upper(),
+            "table": match.group(1) if match is not None else ""
+        }
+        statementLabels[operation] = labels
+
+    return labels
+
+# Returns True if an error means that the connection to the database was lost
+# error: Exception raised by MySQLdb
+def isConnectionLost(error: Exception) -> bool:
+    # mysqlclient raises InterfaceError for statements on a connection that is already closed
+    if isinstance(error, MySQLdb.InterfaceError):
+        return True
+
+    return isinstance(error, MySQLdb.OperationalError) and len(error.args) > 0 and error.args[0] in (SERVER_GONE_ERROR, SERVER_LOST_ERROR)
 
 class MySQLWrapper:
 
     # Constructor
     # Initiates a database connection using the provided authorization information
     # authorization: Authorization info object
-    def __init__(self, authorization: AuthorizationInfo):
+    # autocommit: If True, every statement is committed immediately. Connections that only read and poll for changes
+    #             made by other connections need this, as they otherwise keep reading the snapshot of their first query.
+    def __init__(self, authorization: AuthorizationInfo, autocommit: bool = False):
         self.auth = authorization
+        self.autocommit = autocommit
         self.__connectToDatabase()
 
     # Tries to connect to the database using the saved authorization information
     def __connectToDatabase(self):
+        # The transaction of a previous connection is lost, so its functions must not run anymore
+        self.commitCallbacks = []
+        self.inTransaction = False
+
         self.db = MySQLdb.connect(
             host = self.auth.mysqlIP,
             user = self.auth.mysqlUser,
@@ -24,34 +78,165 @@ class MySQLWrapper:
             charset = "utf8mb4"
         )
 
+        self.db.autocommit(self.autocommit)
         self.cursor = self.db.cursor()
 
+    # Replaces the database connection with a new one
+    def reconnect(self):
+        self.close()
+        self.__connectToDatabase()
+
+    # Closes the database connection
+    def close(self):
+        try:
+            self.db.close()
+        except MySQLdb.Error:
+            pass
+
+    # Runs a function once the current transaction is committed with commit, or right away if the connection autocommits.
+    # The function isn't run if the transaction is rolled back or the connection is lost.
+    # function: Function without parameters, e.g. one that caches the SQL ID of an inserted row
+    def afterCommit(self, function):
+        if self.autocommit:
+            function()
+        else:
+            self.commitCallbacks += [function]
+
+    # Commits the current transaction and runs the functions registered with afterCommit.
+    # Transactions must be committed with this instead of db.commit, so the wrapper knows when a new transaction starts.
+    def commit(self):
+        self.db.commit()
+        self.inTransaction = False
+
+        callbacks = self.commitCallbacks
+        self.commitCallbacks = []
+        for callback in callbacks:
+            callback()
+
+    # Rolls back the current transaction and discards the functions registered with afterCommit
+    def rollback(self):
+        self.commitCallbacks = []
+        self.inTransaction = False
+        self.db.rollback()
+
+    # Returns True if the database connection is still usable
+    def isAlive(self) -> bool:
+        try:
+            self.db.ping()
+            return True
+        except MySQLdb.Error:
+            return False
+
+    # Replaces the connection after an error if it was lost
+    # Returns True if the failed statement can be executed again on the new connection. This is only the case if the
+    # server didn't receive it and it's the first statement of its transaction, as the earlier statements of a
+    # transaction are rolled back with the lost connection. Otherwise the caller has to repeat the whole transaction.
+    # error: Exception raised by MySQLdb
+    def __recover(self, error: Exception) -> bool:
+        if not isConnectionLost(error):
+            return False
+
+        canRetry = not self.inTransaction and error.args[:1] != (SERVER_LOST_ERROR,)
+        self.reconnect()
+
+        return canRetry
+
     # Tries to execute a given operation. Restarts the database connection if it timed out.
     # operation: SQL-command to be executed
     # params: Parameters to be sanitized and inserted into the SQL-command
     def query(self, operation: str, params = None):
+        if metrics.enabled:
+            with metrics.timer("db_query_seconds", getStatementLabels(operation)):
+                self.__execute(operation, params)
+        else:
+            self.__execute(operation, params)
+
+    # Executes an operation, reconnecting once if the connection was lost
+    def __execute(self, operation: str, params):
         try:
             self.cursor.execute(operation, params)
 
-        except MySQLdb.OperationalError as opErr:
-            # Checks for error 2006: "MySQL database has gone away"
-            if opErr.errno == 2006:
-                self.__connectToDatabase()
-                self.cursor.execute(operation, params)
+        except TRANSIENT_ERRORS as error:
+            if not self.__recover(error):
+                raise
 
-            # Raises other kinds of errors
-            else:
-                raise opErr
+            self.cursor.execute(operation, params)
+
+        self.inTransaction = not self.autocommit
+
+    # Tries to execute a given operation once for every parameter tuple.
+    # For INSERT statements, the rows are sent to the database as one multi-row statement.
+    # operation: SQL-command to be executed
+    # paramsList: List of parameter tuples to be sanitized and inserted into the SQL-command
+    def queryMany(self, operation: str, paramsList: list):
+        if len(paramsList) == 0:
+            return
+
+        if metrics.enabled:
+            metrics.increment("db_rows_total", len(paramsList), getStatementLabels(operation))
+
+            with metrics.timer("db_query_seconds", getStatementLabels(operation)):
+                self.__executeMany(operation, paramsList)
+        else:
+            self.__executeMany(operation, paramsList)
+
+    # Executes an operation for every parameter tuple, reconnecting once if the connection was lost
+    def __executeMany(self, operation: str, paramsList: list):
+        try:
+            self.cursor.executemany(operation, paramsList)
+
+        except TRANSIENT_ERRORS as error:
+            if not self.__recover(error):
+                raise
+
+            self.cursor.executemany(operation, paramsList)
 
-    # Returns the results of the last query. If they are invalid, None is returned.
+        self.inTransaction = not self.autocommit
+
+    # Executes a query with a server-side cursor and yields its results in batches, so large results are read in
+    # constant memory. The connection can't be used for other queries until all results were read.
+    # operation: SQL-command to be executed
+    # params: Parameters to be sanitized and inserted into the SQL-command
+    # batchSize: Maximum number of rows per batch
+    def stream(self, operation: str, params = None, batchSize: int = 10000):
+        cursor = self.db.cursor(MySQLdb.cursors.SSCursor)
+
+        try:
+            try:
+                cursor.execute(operation, params)
+
+            except TRANSIENT_ERRORS as error:
+                if not self.__recover(error):
+                    raise
+
+                cursor = self.db.cursor(MySQLdb.cursors.SSCursor)
+                cursor.execute(operation, params)
+
+            self.inTransaction = not self.autocommit
+
+            while True:
+                rows = cursor.fetchmany(batchSize)
+                if len(rows) == 0:
+                    break
+
+                yield rows
+
+        finally:
+            cursor.close()
+
+    # Returns the results of the last query. If they are invalid or empty, None is returned.
     def fetchResults(self):
         results = self.cursor.fetchall()
 
-        if results is not None and results[0][0] is None:
+        if results is None or len(results) == 0 or results[0][0] is None:
             return None
         else:
             return results
 
+    # Returns the number of rows changed by the last query
+    def getAffectedRows(self) -> int:
+        return self.cursor.rowcount
+
     # Returns True if a table with the given name exists in the selected database.
     # name: The name of the table to be checked for
     def doesTableExist(self, name: str) -> bool:
@@ -67,9 +252,105 @@ class MySQLWrapper:
         # Checks if table exists, if overwrite is True deletes it, otherwise leaves method
         if self.doesTableExist(name):
             if overwrite:
-                self.cursor.execute(f"DROP TABLE %s;", (name,))
+                self.cursor.execute(f"DROP TABLE {name};")
             else:
                 return
 
         # Creates new table
         self.cursor.execute(f"CREATE TABLE {name} ({columns}) {characterSet};", ())
+
+
+class MySQLPool:
+
+    # Constructor
+    # Connections are opened when they are first needed, not when the pool is created.
+    # authorization: Authorization info object
+    # size: Maximum number of connections that are open at the same time
+    # healthCheckInterval: Connections that were idle for longer than this many seconds are checked before they are handed out
+    # maxIdleTime: Connections that were idle for longer than this many seconds are closed
+    # minIdle: Number of idle connections that are kept open regardless of their idle time
+    def __init__(self, authorization: AuthorizationInfo, size: int = 4, healthCheckInterval: float = 30.0, maxIdleTime: float = 300.0, minIdle: int = 1):
+        self.auth = authorization
+        self.size = size
+        self.healthCheckInterval = healthCheckInterval
+        self.maxIdleTime = maxIdleTime
+        self.minIdle = minIdle
+
+        # Idle connections as (connection, time of last use), the most recently used one last
+        self.idleConnections = []
+        self.lock = threading.Lock()
+        self.available = threading.Semaphore(size)
+
+    # Takes a connection from the pool, blocking while all connections are in use.
+    # The connection must be given back with release.
+    def acquire(self) -> MySQLWrapper:
+        self.available.acquire()
+
+        try:
+            with self.lock:
+                self.__reapIdle()
+
+                if len(self.idleConnections) == 0:
+                    return MySQLWrapper(self.auth)
+
+                # Uses the most recently used connection, so rarely needed ones become idle and get reaped
+                mysql, lastUsed = self.idleConnections.pop()
+
+            # Replaces connections that timed out while they were idle
+            if time.monotonic() - lastUsed > self.healthCheckInterval and not mysql.isAlive():
+                mysql.reconnect()
+
+            return mysql
+
+        except Exception:
+            self.available.release()
+            raise
+
+    # Gives a connection back to the pool
+    # mysql: Connection taken from the pool
+    # broken: If True, the connection is closed instead of being reused
+    def release(self, mysql: MySQLWrapper, broken: bool = False):
+        if broken:
+            mysql.close()
+        else:
+            with self.lock:
+                self.idleConnections += [(mysql, time.monotonic())]
+
+        self.available.release()
+
+    # Context manager that takes a connection from the pool and gives it back afterwards.
+    # Uncommitted changes are rolled back if an error occurs.
+    @contextmanager
+    def connection(self):
+        mysql = self.acquire()
+
+        try:
+            yield mysql
+
+        except Exception:
+            broken = False
+            try:
+                mysql.rollback()
+            except MySQLdb.Error:
+                broken = True
+
+            self.release(mysql, broken)
+            raise
+
+        self.release(mysql)
+
+    # Closes connections that were idle for too long. Must be called while holding the lock.
+    def __reapIdle(self):
+        now = time.monotonic()
+
+        while len(self.idleConnections) > self.minIdle and now - self.idleConnections[0][1] > self.maxIdleTime:
+            mysql, lastUsed = self.idleConnections.pop(0)
+            mysql.close()
+
+    # Closes all idle connections
+    def close(self):
+        with self.lock:
+            for mysql, lastUsed in self.idleConnections:
+                mysql.close()
+
+            self.idleConnections = []
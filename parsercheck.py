@@ -0,0 +1,151 @@
+# This script records HLTV pages as HTML fixtures and checks that the parsers in hltvparser.py extract the same
+# values from them as the original requests_html implementation.
+# Fixtures are saved below the fixture directory using the path of their URL, e.g. fixtures/forums/17/off-topic.html
+# The query of paginated pages is kept after an '@', e.g. fixtures/forums/threads/2331207/best-player@offset=5.html
+#
+# Usage:
+#   python parsercheck.py record <url> [<url> ...]   Downloads pages and saves them as fixtures
+#   python parsercheck.py check                       Compares both parsers on all saved fixtures
+
+from requests_html import HTML, HTMLSession
+from urllib.parse import urlparse
+from datetime import datetime
+
+import hltvparser
+
+import os
+import sys
+import time
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASE_URL = "https://www.hltv.org"
+
+# Returns the fixture path of a URL
+# url: URL of the page
+def getFixturePath(url: str) -> str:
+    parsedURL = urlparse(url)
+    relativePath = parsedURL.path.strip('/')
+
+    if parsedURL.query:
+        relativePath += "@" + parsedURL.query
+
+    return os.path.join(FIXTURE_DIR, relativePath + ".html")
+
+# Returns the URL of a fixture file
+# path: Path of the fixture file
+def getFixtureURL(path: str) -> str:
+    relativePath = os.path.relpath(path, FIXTURE_DIR)[:-len(".html")].replace(os.sep, '/')
+    return f"{BASE_URL}/{relativePath.replace('@', '?', 1)}"
+
+# Returns the paths of all saved fixtures
+def getFixturePaths() -> list:
+    paths = []
+
+    for directory, dirNames, fileNames in os.walk(FIXTURE_DIR):
+        for fileName in fileNames:
+            if fileName.endswith(".html"):
+                paths += [os.path.join(directory, fileName)]
+
+    return sorted(paths)
+
+# Downloads pages and saves them as fixtures
+# urls: List of page URLs
+def record(urls: list):
+    session = HTMLSession()
+
+    for url in urls:
+        response = session.get(url)
+        path = getFixturePath(url)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        with open(path, "w", encoding = "utf-8") as f:
+            f.write(response.text)
+
+        print(f"Saved {url} to {path}")
+        time.sleep(2.0)
+
+# Extracts the forum index with requests_html, as done by the original scanner
+# html: requests_html HTML object of the page
+def referenceForumThreads(html: HTML) -> list:
+    rows = []
+
+    for row in html.find('.forumthreads')[0].find('tr.tablerow'):
+        tdName = row.find('td.name')[0]
+        tdReplies = row.find('td.replies')[0]
+        tdAuthor = row.find('td.author')[0]
+
+        rows += [hltvparser.ThreadRow(
+            tdName.absolute_links.pop(), tdName.text, int(tdReplies.text), tdAuthor.absolute_links.pop(), tdAuthor.text
+        )]
+
+    return rows
+
+# Extracts the posts of a thread with requests_html, as done by the original scanner
+# html: requests_html HTML object of the page
+def referencePosts(html: HTML) -> list:
+    posts = []
+
+    for reply in html.find('.post, .forumthread'):
+        replyNumAnchors = reply.find('.replyNum')
+        content = reply.find('.forum-middle')[0].text
+        timestamp = datetime.strptime(reply.find('.forum-bottombar')[0].text, "%Y-%m-%d %H:%M")
+        authorAnchor = reply.find('.authorAnchor')[0]
+        postID = ''
+        replyNum = 0
+
+        if len(replyNumAnchors) > 0:
+            replyNum = int(replyNumAnchors[0].text[1:])
+            postID = reply.attrs['id']
+
+        posts += [hltvparser.PostRow(postID, replyNum, content, timestamp, authorAnchor.text, authorAnchor.absolute_links.pop())]
+
+    return posts
+
+# Compares both parsers on all fixtures. Returns True if they extract the same values from every fixture.
+def check() -> bool:
+    equivalent = True
+    paths = getFixturePaths()
+
+    if len(paths) == 0:
+        print(f"No fixtures found in {FIXTURE_DIR}")
+        return False
+
+    for path in paths:
+        url = getFixtureURL(path)
+
+        with open(path, "r", encoding = "utf-8") as f:
+            text = f.read()
+
+        reference = HTML(html = text, url = url)
+
+        if '/forums/threads/' in url:
+            expected = referencePosts(reference)
+            actual = hltvparser.parsePosts(text, url)
+        else:
+            expected = referenceForumThreads(reference)
+            actual = hltvparser.parseForumThreads(text, url)
+
+        if expected == actual:
+            print(f"OK       {path} ({len(actual)} items)")
+        else:
+            equivalent = False
+            print(f"MISMATCH {path}")
+
+            for expectedItem, actualItem in zip(expected, actual):
+                if expectedItem != actualItem:
+                    print(f"\texpected: {expectedItem}\n\tactual:   {actualItem}")
+
+            if len(expected) != len(actual):
+                print(f"\texpected {len(expected)} items, got {len(actual)}")
+
+    return equivalent
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "record":
+        record(sys.argv[2:])
+    elif len(sys.argv) == 2 and sys.argv[1] == "check":
+        sys.exit(0 if check() else 1)
+    else:
+        print("Usage: python parsercheck.py record <url> [<url> ...] | python parsercheck.py check")
+        sys.exit(2)
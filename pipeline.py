@@ -0,0 +1,201 @@
+# These classes run work in a pipeline of stages that are connected by bounded queues.
+# Every stage has its own worker threads, so e.g. downloading, classification and database writes overlap.
+# If a stage falls behind, its input queue fills up and the previous stage blocks until there is space again.
+# This backpressure keeps the memory usage bounded, even if e.g. the database is slow.
+# Each stage counts its processed items, busy time and the time it was blocked by the next stage,
+# so the bottleneck of the pipeline can be identified.
+
+import inspect
+import queue
+import threading
+import time
+import traceback
+
+# Marker that tells a worker thread to exit
+STOP = object()
+
+class PipelineStage:
+
+    # Constructor
+    # name: Name of the stage used in the statistics
+    # function: Function that is called for every item. Its return value is passed to the next stage, unless it's None.
+    #           If it's a generator function, every yielded value is passed on as soon as it's yielded.
+    # workers: Number of worker threads processing items in parallel
+    # maxQueueSize: Maximum number of items waiting in the input queue of this stage
+    def __init__(self, name: str, function, workers: int = 1, maxQueueSize: int = 16):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.inputQueue = queue.Queue(maxQueueSize)
+        self.nextStage = None
+        self.threads = []
+
+        self.statsLock = threading.Lock()
+        self.processedCount = 0
+        self.errorCount = 0
+        self.busyTime = 0.0
+        self.blockedTime = 0.0
+        self.maxDepth = 0
+        self.startTime = None
+
+    # Starts the worker threads of the stage
+    def start(self):
+        self.startTime = time.monotonic()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target = self.__work, name = f"{self.name}-{i}", daemon = True)
+            thread.start()
+            self.threads += [thread]
+
+    # Adds an item to the input queue. Blocks while the queue is full.
+    # item: Item to be processed
+    def put(self, item):
+        self.inputQueue.put(item)
+
+        depth = self.inputQueue.qsize()
+        if depth > self.maxDepth:
+            self.maxDepth = depth
+
+    # Processes items until the stop marker is received
+    def __work(self):
+        while True:
+            item = self.inputQueue.get()
+
+            if item is STOP:
+                self.inputQueue.task_done()
+                return
+
+            try:
+                if inspect.isgeneratorfunction(self.function):
+                    self.__processGenerator(item)
+                else:
+                    self.__processItem(item)
+
+            # Errors only drop the affected item, so a single broken page doesn't stop the whole pipeline
+            except Exception:
+                with self.statsLock:
+                    self.errorCount += 1
+
+                print(f"Error in pipeline stage '{self.name}':")
+                traceback.print_exc()
+
+            finally:
+                self.inputQueue.task_done()
+
+    # Processes an item with a function that returns a single result
+    # item: Item to be processed
+    def __processItem(self, item):
+        startTime = time.monotonic()
+        result = self.function(item)
+        finishTime = time.monotonic()
+
+        # Passes the result on, waiting if the next stage is full
+        if result is not None and self.nextStage is not None:
+            self.nextStage.put(result)
+
+        with self.statsLock:
+            self.processedCount += 1
+            self.busyTime += finishTime - startTime
+            self.blockedTime += time.monotonic() - finishTime
+
+    # Processes an item with a generator function, passing on every result as soon as it's yielded.
+    # While the next stage is full, the generator isn't resumed, so it doesn't produce further results.
+    # item: Item to be processed
+    def __processGenerator(self, item):
+        busyTime = 0.0
+        blockedTime = 0.0
+        results = self.function(item)
+
+        while True:
+            startTime = time.monotonic()
+            result = next(results, STOP)
+            finishTime = time.monotonic()
+            busyTime += finishTime - startTime
+
+            if result is STOP:
+                break
+
+            if self.nextStage is not None:
+                self.nextStage.put(result)
+
+            blockedTime += time.monotonic() - finishTime
+
+        with self.statsLock:
+            self.processedCount += 1
+            self.busyTime += busyTime
+            self.blockedTime += blockedTime
+
+    # Stops the worker threads once all queued items are processed
+    def stop(self):
+        for i in range(len(self.threads)):
+            self.inputQueue.put(STOP)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+
+    # Returns a dictionary with the statistics of the stage
+    def getStats(self) -> dict:
+        with self.statsLock:
+            elapsedTime = time.monotonic() - self.startTime if self.startTime is not None else 0.0
+
+            return {
+                "name": self.name,
+                "queueDepth": self.inputQueue.qsize(),
+                "maxQueueDepth": self.maxDepth,
+                "processed": self.processedCount,
+                "errors": self.errorCount,
+                "throughput": self.processedCount / elapsedTime if elapsedTime > 0 else 0.0,
+                "utilization": self.busyTime / (elapsedTime * self.workers) if elapsedTime > 0 else 0.0,
+                "blockedTime": self.blockedTime
+            }
+
+
+class Pipeline:
+
+    # Constructor
+    # stages: List of stages in the order in which items pass through them
+    def __init__(self, stages: list):
+        self.stages = stages
+
+        for stage, nextStage in zip(stages, stages[1:]):
+            stage.nextStage = nextStage
+
+    # Starts the worker threads of all stages
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    # Adds an item to the first stage. Blocks while the first stage is full.
+    # item: Item to be processed
+    def put(self, item):
+        self.stages[0].put(item)
+
+    # Blocks until all items that were added have passed through all stages
+    def join(self):
+        for stage in self.stages:
+            stage.inputQueue.join()
+
+    # Stops all stages after the queued items are processed
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+
+    # Returns a list with the statistics of every stage
+    def getStats(self) -> list:
+        return [stage.getStats() for stage in self.stages]
+
+    # Returns the statistics of every stage as a human readable string
+    def formatStats(self) -> str:
+        lines = []
+
+        for stats in self.getStats():
+            lines += [(
+                f"\t{stats['name']}: {stats['processed']} processed ({stats['errors']} errors), "
+                f"{stats['throughput']:.2f}/s, {stats['utilization']*100:.0f}% busy, "
+                f"queue {stats['queueDepth']} (max {stats['maxQueueDepth']}), "
+                f"{stats['blockedTime']:.1f}s blocked by next stage"
+            )]
+
+        return "\n".join(lines)
@@ -0,0 +1,279 @@
+# This script rates the stored posts again, e.g. with a new version of the hatesonar model, so model versions can be
+# compared on the whole corpus.
+# The ratings in Posts are set once by the model the scanner had loaded when the post was inserted. The ratings of
+# other model versions are stored separately in PostRatings, so the live scanners and the analysis aren't affected.
+# Posts are read in chunks ordered by PostID, continuing after the last PostID of the previous chunk, so every chunk is
+# a short range scan of the primary key. Each chunk is split into batches that are rated in parallel by a pool of
+# worker processes. The ratings of a chunk and the highest rated PostID are committed together in RescoreProgress, so
+# the job can be stopped at any time and continues after the last complete chunk.
+# Several connections insert posts concurrently, so a post can be committed after posts with a higher PostID were
+# already rated. Once all chunks are rated, the posts up to the saved progress that weren't rated yet are rated as well.
+# With --apply, the ratings of a version are copied into Posts in small batches and the aggregates are rebuilt. Posts
+# inserted afterwards are rated by the scanners, so they should run the same model version by then.
+#
+# Usage:
+#   python rescore.py [--version <name>] [--processes 8]   Rates all posts that weren't rated by the model version yet
+#   python rescore.py --apply                               Also replaces the ratings in Posts with the new ones
+
+from mysqlwrapper import MySQLWrapper
+from authorization import AuthorizationInfo
+from forums import initializeTables
+from classification import PostClassifier, getClassificationText
+from control import ControlChannel
+from rollups import HATE_THRESHOLD, OFF_THRESHOLD, rebuildRollups
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse
+import os
+import time
+
+# Number of posts read and committed at once
+RESCORE_CHUNK_SIZE = 10000
+
+# Number of posts rated by a worker process at once
+RESCORE_BATCH_SIZE = 500
+
+# Number of posts whose ratings are copied into Posts per transaction
+APPLY_BATCH_SIZE = 10000
+
+# Returns the highest PostID that was rated by a model version, 0 if it didn't rate any posts yet
+# mysql: Database connection
+# modelVersion: Version of the model
+def getRescoreProgress(mysql: MySQLWrapper, modelVersion: str) -> int:
+    mysql.query("SELECT LastPostID FROM RescoreProgress WHERE ModelVersion=%s;", (modelVersion,))
+    results = mysql.fetchResults()
+
+    if results is None:
+        return 0
+    else:
+        return results[0][0]
+
+# Reads the posts after a PostID
+# mysql: Database connection
+# lastPostID: PostID after which reading continues
+# limit: Maximum number of posts
+# Returns a list of (PostID, Content, author name) tuples ordered by PostID
+def getPostChunk(mysql: MySQLWrapper, lastPostID: int, limit: int) -> list:
+    mysql.query(
+        (
+            "SELECT Posts.PostID, Posts.Content, Authors.Name FROM Posts "
+            "JOIN Authors ON Authors.AuthorID = Posts.AuthorID "
+            "WHERE Posts.PostID > %s ORDER BY Posts.PostID LIMIT %s;"
+        ),
+        (lastPostID, limit,)
+    )
+    results = mysql.fetchResults()
+
+    if results is None:
+        return []
+    else:
+        return list(results)
+
+# Reads the posts up to a PostID that weren't rated by a model version, e.g. because they were committed after posts
+# with higher PostIDs were rated
+# mysql: Database connection
+# modelVersion: Version of the model
+# lastPostID: PostID after which reading continues
+# untilPostID: Highest PostID that is read
+# limit: Maximum number of posts
+# Returns a list of (PostID, Content, author name) tuples ordered by PostID
+def getUnratedPostChunk(mysql: MySQLWrapper, modelVersion: str, lastPostID: int, untilPostID: int, limit: int) -> list:
+    mysql.query(
+        (
+            "SELECT Posts.PostID, Posts.Content, Authors.Name FROM Posts "
+            "JOIN Authors ON Authors.AuthorID = Posts.AuthorID "
+            "LEFT JOIN PostRatings ON PostRatings.PostID = Posts.PostID AND PostRatings.ModelVersion=%s "
+            "WHERE Posts.PostID > %s AND Posts.PostID <= %s AND PostRatings.PostID IS NULL ORDER BY Posts.PostID LIMIT %s;"
+        ),
+        (modelVersion, lastPostID, untilPostID, limit,)
+    )
+    results = mysql.fetchResults()
+
+    if results is None:
+        return []
+    else:
+        return list(results)
+
+# Rates texts in parallel, each batch in one pass through the model
+# classifier: Classifier whose worker processes rate the batches
+# executor: Thread pool with one thread per worker process, so all processes are kept busy
+# texts: List of texts to be rated
+# Returns a list of (hateRating, offRating) tuples in the same order as the texts
+def rateInParallel(classifier: PostClassifier, executor: ThreadPoolExecutor, texts: list) -> list:
+    # Identical texts, e.g. quotes and copypastas, are only rated once
+    uniqueTexts = list(dict.fromkeys(texts))
+    batches = [uniqueTexts[start:start + RESCORE_BATCH_SIZE] for start in range(0, len(uniqueTexts), RESCORE_BATCH_SIZE)]
+
+    ratings = {}
+    for batch, batchRatings in zip(batches, executor.map(classifier.scoreBatch, batches)):
+        ratings.update(zip(batch, batchRatings))
+
+    return [ratings[text] for text in texts]
+
+# Rates a chunk of posts and stores their ratings in PostRatings without committing them
+# classifier: Classifier whose worker processes rate the batches
+# executor: Thread pool with one thread per worker process
+# mysql: Database connection
+# modelVersion: Version of the model the ratings are stored under
+# posts: List of (PostID, Content, author name) tuples
+def ratePostChunk(classifier: PostClassifier, executor: ThreadPoolExecutor, mysql: MySQLWrapper, modelVersion: str, posts: list):
+    # Rates the same text as the scanners, which includes the name of the author
+    ratings = rateInParallel(classifier, executor, [getClassificationText(authorName, content) for postID, content, authorName in posts])
+
+    mysql.queryMany(
+        "INSERT INTO PostRatings (PostID, ModelVersion, HateRating, OffRating) VALUES (%s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE HateRating=VALUES(HateRating), OffRating=VALUES(OffRating);",
+        [(postID, modelVersion, hateRating, offRating) for (postID, content, authorName), (hateRating, offRating) in zip(posts, ratings)]
+    )
+
+# Rates all posts after the saved progress of a model version and stores the ratings in PostRatings
+# mysql: Database connection without autocommit, as each chunk has to be committed with its progress
+# classifier: Classifier running the model version
+# modelVersion: Version of the model the ratings are stored under
+# control: Control channel that is checked for a stop request between chunks
+# processes: Number of batches rated at the same time
+# Returns the number of rated posts
+def rescorePosts(mysql: MySQLWrapper, classifier: PostClassifier, modelVersion: str, control: ControlChannel, processes: int) -> int:
+    lastPostID = getRescoreProgress(mysql, modelVersion)
+    postCount = 0
+    startTime = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers = max(1, processes), thread_name_prefix = "rescore") as executor:
+        while not control.isStopRequested():
+            posts = getPostChunk(mysql, lastPostID, RESCORE_CHUNK_SIZE)
+            if len(posts) == 0:
+                break
+
+            ratePostChunk(classifier, executor, mysql, modelVersion, posts)
+            lastPostID = posts[-1][0]
+
+            mysql.query(
+                "INSERT INTO RescoreProgress (ModelVersion, LastPostID) VALUES (%s, %s) "
+                "ON DUPLICATE KEY UPDATE LastPostID=VALUES(LastPostID), Time=NOW();",
+                (modelVersion, lastPostID,)
+            )
+            mysql.commit()
+
+            postCount += len(posts)
+            print(f"Rated posts up to {lastPostID} ({postCount / (time.perf_counter() - startTime):.0f} posts/s).")
+
+    return postCount
+
+# Rates the posts up to the saved progress of a model version that weren't rated, because they were committed after
+# posts with higher PostIDs were rated
+# mysql: Database connection without autocommit
+# classifier: Classifier running the model version
+# modelVersion: Version of the model the ratings are stored under
+# control: Control channel that is checked for a stop request between chunks
+# processes: Number of batches rated at the same time
+# Returns the number of rated posts
+def rescoreUnratedPosts(mysql: MySQLWrapper, classifier: PostClassifier, modelVersion: str, control: ControlChannel, processes: int) -> int:
+    untilPostID = getRescoreProgress(mysql, modelVersion)
+    lastPostID = 0
+    postCount = 0
+
+    with ThreadPoolExecutor(max_workers = max(1, processes), thread_name_prefix = "rescore") as executor:
+        while not control.isStopRequested():
+            posts = getUnratedPostChunk(mysql, modelVersion, lastPostID, untilPostID, RESCORE_CHUNK_SIZE)
+            if len(posts) == 0:
+                break
+
+            ratePostChunk(classifier, executor, mysql, modelVersion, posts)
+            mysql.commit()
+
+            lastPostID = posts[-1][0]
+            postCount += len(posts)
+
+    return postCount
+
+# Prints how the ratings of a model version differ from the ratings in Posts
+# mysql: Database connection
+# modelVersion: Version of the model
+def printComparison(mysql: MySQLWrapper, modelVersion: str):
+    mysql.query(
+        "SELECT COUNT(*), AVG(ABS(Posts.HateRating - PostRatings.HateRating)), AVG(ABS(Posts.OffRating - PostRatings.OffRating)), "
+        "SUM(Posts.HateRating >= %s), SUM(PostRatings.HateRating >= %s), SUM(Posts.OffRating >= %s), SUM(PostRatings.OffRating >= %s) "
+        "FROM PostRatings JOIN Posts ON Posts.PostID = PostRatings.PostID WHERE PostRatings.ModelVersion=%s;",
+        (HATE_THRESHOLD, HATE_THRESHOLD, OFF_THRESHOLD, OFF_THRESHOLD, modelVersion,)
+    )
+    results = mysql.fetchResults()
+
+    if results is None or results[0][0] == 0:
+        print(f"No posts were rated by {modelVersion}.")
+        return
+
+    postCount, hateDiff, offDiff, oldHateCount, newHateCount, oldOffCount, newOffCount = results[0]
+    print(f"{modelVersion} rated {postCount} posts:")
+    print(f"\tMean difference to Posts: hate {hateDiff:.4f}, offensive {offDiff:.4f}")
+    print(f"\tHate speech: {oldHateCount} in Posts, {newHateCount} by {modelVersion}")
+    print(f"\tOffensive: {oldOffCount} in Posts, {newOffCount} by {modelVersion}")
+
+# Replaces the ratings in Posts with the ratings of a model version, one batch of PostIDs per transaction, so the
+# scanners aren't blocked for long
+# mysql: Database connection without autocommit
+# modelVersion: Version of the model
+# Returns the number of changed posts
+def applyRatings(mysql: MySQLWrapper, modelVersion: str) -> int:
+    mysql.query("SELECT MIN(PostID), MAX(PostID) FROM PostRatings WHERE ModelVersion=%s;", (modelVersion,))
+    results = mysql.fetchResults()
+
+    if results is None:
+        return 0
+
+    firstPostID, lastPostID = results[0]
+    postCount = 0
+
+    for start in range(firstPostID, lastPostID + 1, APPLY_BATCH_SIZE):
+        mysql.query(
+            "UPDATE Posts JOIN PostRatings ON PostRatings.PostID = Posts.PostID AND PostRatings.ModelVersion=%s "
+            "SET Posts.HateRating=PostRatings.HateRating, Posts.OffRating=PostRatings.OffRating "
+            "WHERE Posts.PostID >= %s AND Posts.PostID < %s;",
+            (modelVersion, start, start + APPLY_BATCH_SIZE,)
+        )
+        postCount += mysql.getAffectedRows()
+        mysql.commit()
+
+    return postCount
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Rates the stored posts again with the installed model")
+    parser.add_argument("--version", default = None, help = "name the ratings are stored under, by default the version of the loaded model")
+    parser.add_argument("--processes", type = int, default = os.cpu_count() or 1, help = "number of worker processes running the model")
+    parser.add_argument("--apply", action = "store_true", help = "replaces the ratings in Posts once all posts are rated and rebuilds the aggregates")
+    args = parser.parse_args()
+
+    # Runs with lower CPU priority than the live scanner on the same host
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+    mysql = MySQLWrapper(AuthorizationInfo("auth.json"))
+    initializeTables(mysql, False)
+
+    classifier = PostClassifier(processes = args.processes)
+    modelVersion = args.version if args.version is not None else classifier.version
+
+    # Only reacts to signals of this process, so stopping the job doesn't affect the scanners
+    control = ControlChannel(mysql, controlFile = None)
+    control.installSignalHandlers()
+
+    print(f"Rating posts with {modelVersion} after post {getRescoreProgress(mysql, modelVersion)}...")
+    rescorePosts(mysql, classifier, modelVersion, control, args.processes)
+
+    # The whole corpus is only compared and applied once the posts that were committed late are rated as well
+    if not control.isStopRequested():
+        print(f"Rated {rescoreUnratedPosts(mysql, classifier, modelVersion, control, args.processes)} posts that were committed late.")
+
+    classifier.close()
+
+    printComparison(mysql, modelVersion)
+
+    if args.apply and not control.isStopRequested():
+        print(f"Replaced the ratings of {applyRatings(mysql, modelVersion)} posts.")
+        print(f"Aggregated {rebuildRollups(mysql)} posts.")
+
+    mysql.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# This module maintains aggregated hate speech statistics per author, forum, thread and day, so dashboards and the
+# research questions don't have to scan and group all posts.
+# The aggregates are stored in the AuthorStats, ForumStats, ThreadStats and DailyStats tables. Posts are only ever
+# inserted, so the aggregates are updated incrementally: RollupState holds a watermark below which all posts are
+# aggregated, and every update adds the posts after it in batches.
+# PostIDs are assigned when a post is inserted, but the post is only visible once its transaction is committed, so a
+# post can appear after posts with higher PostIDs were already aggregated. The aggregated posts after the watermark
+# are therefore listed in RollupPosts, and every update adds the posts after the watermark that aren't listed yet.
+# The watermark only moves past a post once it was aggregated ROLLUP_SAFETY_SECONDS ago, so every transaction that
+# could still insert lower PostIDs has been committed and its posts were aggregated.
+# Each batch, its entries in RollupPosts and the new watermark are committed together, so no post is counted twice,
+# even if several scanners update the aggregates at the same time.
+# If ratings of stored posts change (e.g. the posts were rescored) or the thresholds change, the aggregates have to
+# be rebuilt with rebuildRollups.
+#
+# Usage:
+#   python rollups.py             Adds new posts to the aggregates and prints the statistics of all forums
+#   python rollups.py --rebuild   Recalculates the aggregates from all posts
+
+from mysqlwrapper import MySQLWrapper
+from authorization import AuthorizationInfo
+from collections import namedtuple
+
+import argparse
+
+# Posts with a rating of at least these thresholds are counted as hate speech or offensive language
+HATE_THRESHOLD = 0.5
+OFF_THRESHOLD = 0.5
+
+# Maximum number of posts aggregated in one transaction
+ROLLUP_BATCH_SIZE = 50000
+
+# Maximum time in seconds between the insert of a post and the commit of its transaction.
+# The watermark is held back by this time, as posts with lower PostIDs may appear until then.
+ROLLUP_SAFETY_SECONDS = 300
+
+# Aggregate of a group of posts
+# key: ID of the group, e.g. the AuthorID, or (Day, ForumID) for daily statistics
+# name: Name of the group, e.g. the author name
+# posts: Number of posts
+# meanHate, meanOff: Mean ratings of the posts
+# hateCount, offCount: Number of posts whose rating is at least the threshold
+RollupRow = namedtuple("RollupRow", ["key", "name", "posts", "meanHate", "meanOff", "hateCount", "offCount"])
+
+# Aggregates as (table, key columns, key expressions, joined tables)
+ROLLUP_TABLES = [
+    ("AuthorStats", "AuthorID", "Posts.AuthorID", ""),
+    ("ThreadStats", "ThreadID", "Posts.ThreadID", ""),
+    ("ForumStats", "ForumID", "Threads.ForumID", "JOIN Threads ON Threads.ThreadID = Posts.ThreadID "),
+    ("DailyStats", "Day, ForumID", "DATE(Posts.Time), Threads.ForumID", "JOIN Threads ON Threads.ThreadID = Posts.ThreadID ")
+]
+
+# Adds the posts that weren't aggregated yet to the aggregates, one batch per transaction
+# Returns the number of aggregated posts
+# mysql: Database connection without autocommit, as each batch has to be committed at once
+# batchSize: Maximum number of posts per batch
+def updateRollups(mysql: MySQLWrapper, batchSize: int = ROLLUP_BATCH_SIZE) -> int:
+    mysql.query("INSERT IGNORE INTO RollupState (Name, LastPostID) VALUES ('Posts', 0);")
+    mysql.commit()
+
+    postCount = 0
+
+    while True:
+        # Locks the watermark, so concurrent updates wait for each other instead of adding the same posts
+        mysql.query("SELECT LastPostID FROM RollupState WHERE Name='Posts' FOR UPDATE;")
+        lastPostID = mysql.fetchResults()[0][0]
+
+        # Only the posts up to the highest PostID are locked while they are aggregated, so new posts can still be inserted
+        mysql.query("SELECT MAX(PostID) FROM Posts;")
+        results = mysql.fetchResults()
+
+        if results is None:
+            mysql.commit()
+            return postCount
+
+        maxPostID = results[0][0]
+
+        # The batch consists of the lowest PostIDs after the watermark that weren't aggregated yet
+        mysql.query(
+            (
+                "INSERT INTO RollupPosts (PostID, Pending) "
+                "SELECT Posts.PostID, 1 FROM Posts LEFT JOIN RollupPosts ON RollupPosts.PostID = Posts.PostID "
+                "WHERE Posts.PostID > %s AND Posts.PostID <= %s AND RollupPosts.PostID IS NULL ORDER BY Posts.PostID LIMIT %s;"
+            ),
+            (lastPostID, maxPostID, batchSize,)
+        )
+        batchCount = mysql.getAffectedRows()
+
+        mysql.query("SELECT MAX(PostID) FROM RollupPosts WHERE Pending=1;")
+        results = mysql.fetchResults()
+        batchEnd = None if results is None else results[0][0]
+
+        for table, keyColumns, keyExpressions, joins in ROLLUP_TABLES:
+            # The grouped posts are selected in a derived table, as columns of a grouped SELECT can't be referenced
+            # in the UPDATE clause
+            mysql.query(
+                (
+                    f"INSERT INTO {table} ({keyColumns}, NumPosts, HateSum, OffSum, HateCount, OffCount) "
+                    "SELECT * FROM ("
+                    f"SELECT {keyExpressions}, COUNT(*), SUM(HateRating), SUM(OffRating), "
+                    "SUM(HateRating >= %s), SUM(OffRating >= %s) "
+                    f"FROM RollupPosts JOIN Posts ON Posts.PostID = RollupPosts.PostID {joins}"
+                    f"WHERE RollupPosts.Pending=1 GROUP BY {keyExpressions}"
+                    ") AS Batch "
+                    "ON DUPLICATE KEY UPDATE NumPosts=NumPosts+VALUES(NumPosts), HateSum=HateSum+VALUES(HateSum), "
+                    "OffSum=OffSum+VALUES(OffSum), HateCount=HateCount+VALUES(HateCount), OffCount=OffCount+VALUES(OffCount);"
+                ),
+                (HATE_THRESHOLD, OFF_THRESHOLD,)
+            )
+
+        mysql.query("UPDATE RollupPosts SET Pending=0 WHERE Pending=1;")
+
+        # Posts before a post that was aggregated long enough ago are all visible by now. They are all aggregated as
+        # well, unless the batch was full and ended before that post.
+        mysql.query(
+            "SELECT MAX(PostID) FROM RollupPosts WHERE AggregatedAt <= NOW() - INTERVAL %s SECOND;",
+            (ROLLUP_SAFETY_SECONDS,)
+        )
+        results = mysql.fetchResults()
+
+        if results is not None:
+            settledPostID = results[0][0]
+            if batchCount >= batchSize:
+                settledPostID = min(settledPostID, batchEnd)
+
+            mysql.query("UPDATE RollupState SET LastPostID=%s WHERE Name='Posts';", (settledPostID,))
+            mysql.query("DELETE FROM RollupPosts WHERE PostID <= %s;", (settledPostID,))
+
+        mysql.commit()
+
+        postCount += batchCount
+        if batchCount < batchSize:
+            return postCount
+
+# Removes all aggregates and calculates them again from all posts
+# Returns the number of aggregated posts
+# mysql: Database connection without autocommit
+def rebuildRollups(mysql: MySQLWrapper) -> int:
+    mysql.query("INSERT IGNORE INTO RollupState (Name, LastPostID) VALUES ('Posts', 0);")
+    mysql.commit()
+
+    # Holds the watermark lock while clearing, so a concurrent update can't add posts in between
+    mysql.query("SELECT LastPostID FROM RollupState WHERE Name='Posts' FOR UPDATE;")
+
+    for table, keyColumns, keyExpressions, joins in ROLLUP_TABLES:
+        mysql.query(f"DELETE FROM {table};")
+
+    mysql.query("DELETE FROM RollupPosts;")
+    mysql.query("UPDATE RollupState SET LastPostID=0 WHERE Name='Posts';")
+    mysql.commit()
+
+    return updateRollups(mysql)
+
+# Converts rows of (key, name, NumPosts, HateSum, OffSum, HateCount, OffCount) into RollupRows
+def toRollupRows(results) -> list:
+    if results is None:
+        return []
+
+    return [
+        RollupRow(row[0], row[1], row[2], row[3] / row[2], row[4] / row[2], row[5], row[6])
+        for row in results if row[2] > 0
+    ]
+
+# Returns the statistics of all forums
+# mysql: Database connection
+def getForumStats(mysql: MySQLWrapper) -> list:
+    mysql.query(
+        "SELECT ForumStats.ForumID, Forums.Name, NumPosts, HateSum, OffSum, HateCount, OffCount FROM ForumStats "
+        "JOIN Forums ON Forums.ForumID = ForumStats.ForumID ORDER BY Forums.Name;"
+    )
+    return toRollupRows(mysql.fetchResults())
+
+# Returns the authors with the most posts above the hate speech threshold
+# mysql: Database connection
+# minPosts: Authors with fewer posts are left out, as their rates aren't meaningful
+# limit: Maximum number of authors
+def getTopAuthors(mysql: MySQLWrapper, minPosts: int = 20, limit: int = 50) -> list:
+    mysql.query(
+        "SELECT AuthorStats.AuthorID, Authors.Name, NumPosts, HateSum, OffSum, HateCount, OffCount FROM AuthorStats "
+        "JOIN Authors ON Authors.AuthorID = AuthorStats.AuthorID "
+        "WHERE NumPosts >= %s ORDER BY HateCount DESC LIMIT %s;",
+        (minPosts, limit,)
+    )
+    return toRollupRows(mysql.fetchResults())
+
+# Returns the threads with the most posts above the hate speech threshold
+# mysql: Database connection
+# forumID: SQL ID of the forum whose threads are returned, or None for all forums
+# limit: Maximum number of threads
+def getTopThreads(mysql: MySQLWrapper, forumID = None, limit: int = 50) -> list:
+    forumCondition = "" if forumID is None else "WHERE Threads.ForumID=%s "
+    params = (limit,) if forumID is None else (forumID, limit,)
+
+    mysql.query(
+        "SELECT ThreadStats.ThreadID, Threads.Title, NumPosts, HateSum, OffSum, HateCount, OffCount FROM ThreadStats "
+        "JOIN Threads ON Threads.ThreadID = ThreadStats.ThreadID "
+        f"{forumCondition}ORDER BY HateCount DESC LIMIT %s;",
+        params
+    )
+    return toRollupRows(mysql.fetchResults())
+
+# Returns the statistics of every day, the key of each row is (Day, ForumID)
+# mysql: Database connection
+# forumID: SQL ID of the forum, or None for all forums
+# since: Earliest day to be returned, or None for all days
+def getDailyStats(mysql: MySQLWrapper, forumID = None, since = None) -> list:
+    conditions = ["1=1"]
+    params = ()
+
+    if forumID is not None:
+        conditions += ["DailyStats.ForumID=%s"]
+        params += (forumID,)
+
+    if since is not None:
+        conditions += ["DailyStats.Day >= %s"]
+        params += (since,)
+
+    mysql.query(
+        "SELECT DailyStats.Day, DailyStats.ForumID, Forums.Name, NumPosts, HateSum, OffSum, HateCount, OffCount FROM DailyStats "
+        "JOIN Forums ON Forums.ForumID = DailyStats.ForumID "
+        f"WHERE {' AND '.join(conditions)} ORDER BY DailyStats.Day, DailyStats.ForumID;",
+        params
+    )
+    results = mysql.fetchResults()
+
+    if results is None:
+        return []
+
+    return toRollupRows([((row[0], row[1]),) + tuple(row[2:]) for row in results])
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Maintains the aggregated hate speech statistics")
+    parser.add_argument("--rebuild", action = "store_true", help = "recalculates the aggregates from all posts")
+    args = parser.parse_args()
+
+    mysql = MySQLWrapper(AuthorizationInfo("auth.json"))
+
+    if args.rebuild:
+        postCount = rebuildRollups(mysql)
+    else:
+        postCount = updateRollups(mysql)
+
+    print(f"Aggregated {postCount} posts.")
+
+    for row in getForumStats(mysql):
+        print(f"{row.name}: {row.posts} posts, mean hate {row.meanHate:.3f}, mean offensive {row.meanOff:.3f}, "
+              f"{row.hateCount / row.posts:.2%} hate speech, {row.offCount / row.posts:.2%} offensive")
+
+    mysql.close()
+
+
+if __name__ == "__main__":
+    main()
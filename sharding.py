@@ -0,0 +1,171 @@
+# This class coordinates several scanners that observe the forums in parallel, on one or several hosts.
+# Forums are claimed through leases in the ForumClaims table: a worker scans a forum only while it holds its claim,
+# so no forum is scanned twice at the same time. Claims are renewed in the background and expire if a worker crashes,
+# after which another worker takes the forum over. Once a forum was scanned, it's due again after the refresh time.
+# Every worker sends a heartbeat to the ScanWorkers table. The global request budget for HLTV is split evenly
+# between all live workers, so adding workers speeds up a cycle without increasing the load on HLTV.
+# All claims and heartbeats are single statements on an autocommitting connection, so they are atomic.
+
+from authorization import AuthorizationInfo
+from mysqlwrapper import MySQLWrapper
+from forums import Forum
+
+import os
+import socket
+import threading
+
+# Returns the path of a local file or directory of a worker, so several workers on the same host don't share it
+# path: Path used by a single scanner, e.g. "spool" or "http_cache.json"
+# worker: Name of the worker, or None to keep the path
+def getWorkerPath(path: str, worker: str = None) -> str:
+    if path is None or worker is None:
+        return path
+
+    root, extension = os.path.splitext(path)
+    return f"{root}-{worker}{extension}"
+
+
+class ShardCoordinator:
+
+    # Constructor
+    # authorization: Authorization info object. The coordinator opens its own connection, as it's used by a background thread.
+    # globalRequestsPerSecond: Request rate to HLTV shared by all workers
+    # leaseTime: Time in seconds after which claims and heartbeats of a worker that stopped renewing them expire
+    # owner: Name of the worker, by default the host name and process ID
+    def __init__(self, authorization: AuthorizationInfo, globalRequestsPerSecond: float = 0.4, leaseTime: float = 300.0, owner: str = None):
+        self.mysql = MySQLWrapper(authorization, autocommit = True)
+        self.globalRequestsPerSecond = globalRequestsPerSecond
+        self.leaseTime = int(leaseTime)
+
+        if owner is None:
+            owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.owner = owner
+
+        # The connection is shared by the caller and the heartbeat thread
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.heartbeatThread = None
+        self.workerCount = 1
+
+    # Registers the worker and starts renewing its heartbeat and claims in the background
+    def start(self):
+        self.heartbeat()
+        self.heartbeatThread = threading.Thread(target = self.__renewLoop, name = "heartbeat", daemon = True)
+        self.heartbeatThread.start()
+
+    # Renews the claims often enough that they never expire while the worker is alive
+    def __renewLoop(self):
+        while not self.stopEvent.wait(self.leaseTime / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"Failed to renew claims: {e}")
+
+    # Reports that the worker is alive, extends its claims and counts the live workers
+    # Returns the number of live workers
+    def heartbeat(self) -> int:
+        with self.lock:
+            self.mysql.query(
+                "INSERT INTO ScanWorkers (Owner, Heartbeat) VALUES (%s, NOW()) ON DUPLICATE KEY UPDATE Heartbeat=NOW();",
+                (self.owner,)
+            )
+            self.mysql.query(
+                "UPDATE ForumClaims SET ExpiresAt=NOW() + INTERVAL %s SECOND WHERE Owner=%s;",
+                (self.leaseTime, self.owner,)
+            )
+
+            # Removes workers that crashed, so their share of the request budget is given to the others
+            self.mysql.query("DELETE FROM ScanWorkers WHERE Heartbeat < NOW() - INTERVAL %s SECOND;", (self.leaseTime,))
+
+            self.mysql.query("SELECT COUNT(*) FROM ScanWorkers;")
+            results = self.mysql.fetchResults()
+            self.workerCount = max(1, results[0][0] if results is not None else 1)
+
+        return self.workerCount
+
+    # Returns the request rate this worker may use, its share of the global budget
+    def getRequestRate(self) -> float:
+        return self.globalRequestsPerSecond / self.workerCount
+
+    # Adds claim entries for forums that don't have one yet, so they can be claimed
+    # forums: List of forums with their SQL IDs
+    def register(self, forums: list):
+        with self.lock:
+            self.mysql.queryMany("INSERT IGNORE INTO ForumClaims (ForumID) VALUES (%s);", [(forum.sqlID,) for forum in forums])
+
+    # Claims the forum that has been due for the longest time
+    # forums: Forums that may be claimed
+    # Returns the claimed forum, or None if no forum is due or all due forums are claimed by other workers
+    def claimNextForum(self, forums: list):
+        forumsBySQLID = {forum.sqlID: forum for forum in forums}
+
+        with self.lock:
+            self.mysql.query(
+                "SELECT ForumID FROM ForumClaims WHERE (Owner IS NULL OR ExpiresAt < NOW()) AND NextScan <= NOW() ORDER BY NextScan;"
+            )
+            results = self.mysql.fetchResults()
+
+            if results is None:
+                return None
+
+            for row in results:
+                forum = forumsBySQLID.get(row[0])
+                if forum is None:
+                    continue
+
+                # Only succeeds if no other worker claimed the forum in the meantime
+                self.mysql.query(
+                    (
+                        "UPDATE ForumClaims SET Owner=%s, ExpiresAt=NOW() + INTERVAL %s SECOND, ClaimedAt=NOW() "
+                        "WHERE ForumID=%s AND (Owner IS NULL OR ExpiresAt < NOW()) AND NextScan <= NOW();"
+                    ),
+                    (self.owner, self.leaseTime, forum.sqlID,)
+                )
+
+                if self.mysql.getAffectedRows() == 1:
+                    return forum
+
+        return None
+
+    # Releases the claim of a forum
+    # forum: Forum claimed by this worker
+    # refreshTime: Minutes after the start of the scan at which the forum is due again, or None if the scan
+    #              didn't complete and the forum should be taken over right away
+    def release(self, forum: Forum, refreshTime = None):
+        with self.lock:
+            if refreshTime is None:
+                self.mysql.query(
+                    "UPDATE ForumClaims SET Owner=NULL, ExpiresAt=NULL WHERE ForumID=%s AND Owner=%s;",
+                    (forum.sqlID, self.owner,)
+                )
+            else:
+                self.mysql.query(
+                    (
+                        "UPDATE ForumClaims SET Owner=NULL, ExpiresAt=NULL, NextScan=ClaimedAt + INTERVAL %s MINUTE "
+                        "WHERE ForumID=%s AND Owner=%s;"
+                    ),
+                    (refreshTime, forum.sqlID, self.owner,)
+                )
+
+    # Returns the number of seconds until the next forum is due, 0 if one is due already, or None if there are no forums
+    def getSecondsUntilNextScan(self):
+        with self.lock:
+            self.mysql.query("SELECT GREATEST(0, TIMESTAMPDIFF(SECOND, NOW(), MIN(NextScan))) FROM ForumClaims;")
+            results = self.mysql.fetchResults()
+
+        if results is None:
+            return None
+        else:
+            return results[0][0]
+
+    # Stops the heartbeat, releases all claims of the worker and unregisters it
+    def close(self):
+        self.stopEvent.set()
+        if self.heartbeatThread is not None:
+            self.heartbeatThread.join()
+
+        with self.lock:
+            self.mysql.query("UPDATE ForumClaims SET Owner=NULL, ExpiresAt=NULL WHERE Owner=%s;", (self.owner,))
+            self.mysql.query("DELETE FROM ScanWorkers WHERE Owner=%s;", (self.owner,))
+
+        self.mysql.close()
@@ -0,0 +1,337 @@
+# This module keeps scraped and classified posts on disk until they are stored in the database.
+# Instead of writing to MySQL directly, the scanners append records to a local spool. A background drainer replays the
+# records into MySQL in the order in which they were written. While MySQL is unreachable, e.g. during maintenance,
+# records pile up in the spool and are replayed once it's back, so the work of fetching and classifying isn't lost.
+# The spool consists of numbered JSON lines segments. Records are appended to the newest segment, older segments are
+# replayed and deleted once all of their records are committed. If the drainer is interrupted while replaying a
+# segment, the segment is replayed again. This is safe, as posts, authors, threads and cursors are all upserted.
+# Records that the database rejects, e.g. because of invalid data, are moved to a dead letter file, so they don't
+# block the spool. Only errors after which the database may accept them later keep the records in the spool.
+# A spool directory can only be used by one process at a time, which is ensured by a lock file.
+
+from mysqlwrapper import MySQLWrapper, TRANSIENT_ERRORS
+from authorization import AuthorizationInfo
+from forums import ForumAuthor, ForumThread, ForumPost
+from metrics import metrics
+from datetime import datetime
+
+import MySQLdb
+import json
+import os
+import threading
+import time
+import traceback
+
+# The spool directory is locked with fcntl on Unix and msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Name of the file in the spool directory that rejected records are appended to
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+# Name of the lock file in the spool directory
+LOCK_FILE = "spool.lock"
+
+# Returns a JSON-compatible representation of an author
+def encodeAuthor(author: ForumAuthor) -> dict:
+    return {"name": author.name, "hltvID": author.hltvID}
+
+# Creates an author from its JSON representation
+def decodeAuthor(record: dict) -> ForumAuthor:
+    return ForumAuthor(record["name"], record["hltvID"])
+
+# Returns a JSON-compatible representation of a post
+def encodePost(post: ForumPost) -> dict:
+    return {
+        "shortID": post.shortID,
+        "threadID": post.threadID,
+        "index": post.index,
+        "author": encodeAuthor(post.author),
+        "content": post.content,
+        "timestamp": post.timestamp.isoformat() if post.timestamp is not None else None,
+        "hateRating": post.hateRating,
+        "offRating": post.offRating
+    }
+
+# Creates a post from its JSON representation
+def decodePost(record: dict) -> ForumPost:
+    timestamp = datetime.fromisoformat(record["timestamp"]) if record["timestamp"] is not None else None
+
+    return ForumPost(
+        record["shortID"], record["threadID"], record["index"], decodeAuthor(record["author"]),
+        record["content"], timestamp, record["hateRating"], record["offRating"]
+    )
+
+# Returns a JSON-compatible representation of a thread without its posts
+def encodeThread(thread: ForumThread) -> dict:
+    return {
+        "title": thread.title,
+        "author": encodeAuthor(thread.author),
+        "forumID": thread.forumID,
+        "hltvID": thread.hltvID,
+        "replyCount": thread.replyCount,
+        "timestamp": thread.timestamp.isoformat() if thread.timestamp is not None else None
+    }
+
+# Creates a thread from its JSON representation
+def decodeThread(record: dict) -> ForumThread:
+    thread = ForumThread(record["title"], decodeAuthor(record["author"]), record["forumID"], hltvID = record["hltvID"], replyCount = record["replyCount"])
+
+    if record["timestamp"] is not None:
+        thread.timestamp = datetime.fromisoformat(record["timestamp"])
+
+    return thread
+
+
+class PostSpool:
+
+    # Constructor
+    # Continues with the segments left by a previous run, so their records are replayed as well.
+    # Raises a RuntimeError if another process uses the directory.
+    # path: Directory of the segment files
+    # maxSegmentSize: Size in bytes after which a new segment is started
+    def __init__(self, path: str = "spool", maxSegmentSize: int = 16000000):
+        self.path = path
+        self.maxSegmentSize = maxSegmentSize
+        self.lock = threading.Lock()
+
+        os.makedirs(path, exist_ok = True)
+
+        # Another process would write to the same segment numbers and replay or delete the segment this one writes to
+        self.lockFile = open(os.path.join(path, LOCK_FILE), "a")
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self.lockFile.fileno(), msvcrt.LK_NBLCK, 1)
+
+        except OSError:
+            self.lockFile.close()
+            raise RuntimeError(f"The spool {path} is used by another process. Scanners on the same host need different worker names.")
+
+        # Always starts a new segment, so a segment written by a crashed run is never appended to
+        segmentNumbers = [self.__getSegmentNumber(fileName) for fileName in os.listdir(path)]
+        self.segmentNumber = max([number for number in segmentNumbers if number is not None], default = 0) + 1
+        self.file = None
+        self.segmentSize = 0
+
+    # Returns the number of a segment file, or None if it isn't one
+    def __getSegmentNumber(self, fileName: str):
+        if fileName.startswith("segment-") and fileName.endswith(".jsonl"):
+            return int(fileName[len("segment-"):-len(".jsonl")])
+        else:
+            return None
+
+    # Returns the path of a segment
+    def __getSegmentPath(self, number: int) -> str:
+        return os.path.join(self.path, f"segment-{number:012d}.jsonl")
+
+    # Appends a record to the newest segment. It's on disk once this returns.
+    # record: JSON-compatible dictionary
+    def append(self, record: dict):
+        line = (json.dumps(record) + "\n").encode("utf-8")
+
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.__getSegmentPath(self.segmentNumber), "ab")
+                self.segmentSize = 0
+
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.segmentSize += len(line)
+
+            if self.segmentSize >= self.maxSegmentSize:
+                self.__closeSegment()
+
+        metrics.increment("spool_records_total")
+
+    # Closes the newest segment. Must be called while holding the lock.
+    def __closeSegment(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.segmentNumber += 1
+
+    # Closes the newest segment if it contains records, so they can be replayed
+    def rotate(self):
+        with self.lock:
+            self.__closeSegment()
+
+    # Returns the paths of all closed segments, the oldest first
+    def getClosedSegments(self) -> list:
+        with self.lock:
+            openNumber = self.segmentNumber if self.file is not None else None
+            numbers = [self.__getSegmentNumber(fileName) for fileName in os.listdir(self.path)]
+
+        return [self.__getSegmentPath(number) for number in sorted(number for number in numbers if number is not None and number != openNumber)]
+
+    # Returns True if there are no records that weren't replayed yet
+    def isEmpty(self) -> bool:
+        with self.lock:
+            if self.file is not None:
+                return False
+
+        return len(self.getClosedSegments()) == 0
+
+    # Returns all records of a segment in the order in which they were written
+    # path: Path of the segment
+    def readSegment(self, path: str) -> list:
+        records = []
+
+        with open(path, "rb") as f:
+            for line in f:
+                # The last line of a segment can be incomplete if the process crashed while writing it
+                try:
+                    records += [json.loads(line.decode("utf-8"))]
+                except (UnicodeDecodeError, ValueError):
+                    print(f"Skipping incomplete record in {path}.")
+
+        return records
+
+    # Deletes a segment whose records were all replayed
+    def removeSegment(self, path: str):
+        os.remove(path)
+
+    # Appends records that the database rejected to the dead letter file, so they can be inspected and replayed by hand
+    # records: Rejected records
+    # error: Error raised while replaying them
+    def addDeadLetters(self, records: list, error: Exception):
+        with self.lock:
+            with open(os.path.join(self.path, DEAD_LETTER_FILE), "a", encoding = "utf-8") as f:
+                for record in records:
+                    f.write(json.dumps({"error": str(error), "record": record}) + "\n")
+
+                f.flush()
+                os.fsync(f.fileno())
+
+        metrics.increment("spool_records_dead_lettered_total", len(records))
+
+    # Closes the newest segment and releases the directory
+    def close(self):
+        self.rotate()
+
+        if self.lockFile is not None:
+            self.lockFile.close()
+            self.lockFile = None
+
+
+class SpoolDrainer:
+
+    # Constructor
+    # spool: Spool whose records are replayed
+    # authorization: Authorization info object. The drainer uses its own connection, which is replaced after errors.
+    # replay: Function that writes a list of records to the database and commits them, called as replay(mysql, records)
+    # batchSize: Maximum number of records passed to replay at once
+    # interval: Time in seconds between checks for new records
+    # retryDelay: Time in seconds to wait after the database couldn't be reached
+    def __init__(self, spool: PostSpool, authorization: AuthorizationInfo, replay, batchSize: int = 50, interval: float = 1.0, retryDelay: float = 10.0):
+        self.spool = spool
+        self.auth = authorization
+        self.replay = replay
+        self.batchSize = batchSize
+        self.interval = interval
+        self.retryDelay = retryDelay
+
+        self.mysql = None
+        self.thread = None
+        self.stopEvent = threading.Event()
+        self.wakeEvent = threading.Event()
+
+    # Starts replaying records in the background
+    def start(self):
+        self.thread = threading.Thread(target = self.__run, name = "spooldrainer", daemon = True)
+        self.thread.start()
+
+    # Replays records until the drainer is closed
+    def __run(self):
+        while not self.stopEvent.is_set():
+            delay = self.interval
+
+            try:
+                self.drain()
+            except TRANSIENT_ERRORS as e:
+                print(f"Database unavailable, keeping records in the spool: {e}")
+                delay = self.retryDelay
+            except Exception:
+                print("Failed to replay spooled records:")
+                traceback.print_exc()
+                delay = self.retryDelay
+
+            self.wakeEvent.wait(delay)
+            self.wakeEvent.clear()
+
+    # Replays all records that are in the spool, the oldest segment first
+    def drain(self):
+        self.spool.rotate()
+
+        for segment in self.spool.getClosedSegments():
+            records = self.spool.readSegment(segment)
+
+            if self.mysql is None:
+                self.mysql = MySQLWrapper(self.auth)
+
+            try:
+                for start in range(0, len(records), self.batchSize):
+                    self.__replayBatch(records[start:start + self.batchSize])
+
+            except TRANSIENT_ERRORS:
+                # The connection may be broken, so a new one is opened for the next attempt
+                self.mysql.close()
+                self.mysql = None
+                raise
+
+            self.spool.removeSegment(segment)
+            metrics.increment("spool_records_replayed_total", len(records))
+
+    # Replays a batch of records. If the database rejects the batch, its records are replayed one at a time, so only
+    # the rejected ones are moved to the dead letter file.
+    def __replayBatch(self, records: list):
+        try:
+            self.replay(self.mysql, records)
+            return
+
+        except TRANSIENT_ERRORS:
+            raise
+
+        except MySQLdb.Error as e:
+            self.mysql.rollback()
+
+            if len(records) == 1:
+                print(f"Moving a spooled record to the dead letter file: {e}")
+                self.spool.addDeadLetters(records, e)
+                return
+
+        for record in records:
+            self.__replayBatch([record])
+
+    # Waits until all records that were in the spool are replayed
+    # timeout: Maximum time to wait in seconds, e.g. while the database is unavailable
+    # Returns True if the spool is empty
+    def waitUntilDrained(self, timeout: float = 60.0) -> bool:
+        deadline = time.monotonic() + timeout
+
+        while not self.spool.isEmpty():
+            if time.monotonic() > deadline:
+                return False
+
+            self.wakeEvent.set()
+            time.sleep(0.1)
+
+        return True
+
+    # Replays the remaining records and stops the drainer
+    # timeout: Maximum time to wait for the remaining records. Records that couldn't be replayed stay in the spool.
+    def close(self, timeout: float = 60.0):
+        self.waitUntilDrained(timeout)
+
+        self.stopEvent.set()
+        self.wakeEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+
+        if self.mysql is not None:
+            self.mysql.close()
@@ -1,8 +1,20 @@
 from mysqlwrapper import MySQLWrapper
 from authorization import AuthorizationInfo
+from control import setEndSignal, sendLocalCommand, CONTROL_FILE
+from sharding import getWorkerPath
+
+import argparse
+
+parser = argparse.ArgumentParser(description = "Stops the scrapers after the thread they are currently processing")
+parser.add_argument("--worker", default = None, help = "name of the scanner in this directory that is notified directly, as passed to hltv_scan.py")
+args = parser.parse_args()
 
 auth = AuthorizationInfo("auth.json")
 mysql = MySQLWrapper(auth)
 
-mysql.query("UPDATE Signals SET Active=1 WHERE SignalName=%s;", ('End'))
-print('Sent end signal to scraper. It will terminate after the current cycle is complete.')
\ No newline at end of file
+setEndSignal(mysql, True)
+
+# Also notifies a scraper running in this directory directly, so it doesn't have to wait for its next signal check
+sendLocalCommand("stop", getWorkerPath(CONTROL_FILE, args.worker))
+
+print('Sent end signal to scraper. It will terminate after the thread it is currently processing.')
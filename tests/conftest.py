@@ -0,0 +1,6 @@
+# Makes the modules in the repository root importable by the tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+# Checks the classification cache statistics of PostClassifier
+
+import numpy as np
+import pytest
+
+from classification import PostClassifier, getClassificationText
+from classificationcache import ClassificationCache
+from classifierbackends import ClassifierBackend
+from metrics import metrics
+
+# Rates every text by its length, so no model has to be loaded
+class LengthBackend(ClassifierBackend):
+
+    version = "length-1"
+
+    def __init__(self):
+        self.texts = []
+
+    def score(self, texts: list) -> tuple:
+        self.texts += texts
+        lengths = np.array([len(text) for text in texts], dtype = np.float64)
+        return (lengths / 100, lengths / 200)
+
+@pytest.fixture
+def enabledMetrics():
+    metrics.configure(True)
+    metrics.reset()
+    yield metrics
+    metrics.reset()
+    metrics.configure(False)
+
+def test_cache_hits_are_counted_when_all_texts_are_cached(enabledMetrics):
+    backend = LengthBackend()
+    classifier = PostClassifier(backend = backend, cache = ClassificationCache(modelVersion = backend.version))
+
+    assert classifier.rateBatch(["gg", "wp", "gg"]) == [(0.02, 0.01), (0.02, 0.01), (0.02, 0.01)]
+    assert backend.texts == ["gg", "wp"]
+    assert enabledMetrics.getCounter("classification_cache_requests_total", {"result": "miss"}) == 3
+
+    classifier.rateBatch(["gg", "wp"])
+    assert backend.texts == ["gg", "wp"]
+    assert enabledMetrics.getCounter("classification_cache_requests_total", {"result": "hit"}) == 2
+    assert enabledMetrics.getCounter("classification_cache_requests_total", {"result": "miss"}) == 3
+
+def test_classification_text_includes_author_name():
+    assert getClassificationText("fragmaster_99", "gg wp") == "fragmaster 99: gg wp"
+    assert getClassificationText("s1mple", "") == "s1mple: "
+
+def test_cache_uses_version_of_backend():
+    cache = ClassificationCache()
+    classifier = PostClassifier(backend = LengthBackend(), cache = cache)
+
+    assert classifier.version == "length-1"
+    assert cache.modelVersion == "length-1"
@@ -0,0 +1,158 @@
+# Checks that every classifier backend rates a few texts like the model it runs
+
+import numpy as np
+import pytest
+import sys
+import types
+
+from classificationcache import getModelVersion
+from classifierbackends import SonarBackend, OnnxBackend, LinearModelBackend, exportSonarModel, getProbabilityArray
+from classifierbackends import CHECK_TEXTS, compareWithSonar
+
+TEXTS = [
+    "",
+    "gg wp",
+    "You are a fucking idiot, uninstall the game",
+    "Greetings from Germany! Great match yesterday :)",
+    "GG GG gg wp"
+]
+
+# Class probabilities of the texts, in the format of the ONNX model without a ZipMap
+PROBABILITIES = [
+    [0.1, 0.2, 0.7],
+    [0.05, 0.15, 0.8],
+    [0.3, 0.6, 0.1],
+    [0.0, 0.1, 0.9],
+    [0.2, 0.2, 0.6]
+]
+
+# Stands in for the scikit-learn model of hatesonar 0.0.7, trained on a few texts.
+# Current scikit-learn versions can't fit one-vs-rest liblinear models with three classes like the pickled model of
+# hatesonar, so it's assembled from one binary model per class.
+class FakeSklearnSonar:
+
+    def __init__(self, **vectorizerOptions):
+        feature_extraction = pytest.importorskip("sklearn.feature_extraction.text")
+        linear_model = pytest.importorskip("sklearn.linear_model")
+        multiclass = pytest.importorskip("sklearn.multiclass")
+
+        trainingTexts = [
+            "you are an idiot", "stupid idiot go away", "I hate you all",
+            "fuck off you idiot", "this game is shit", "what a stupid shit team",
+            "great match", "gg wp everyone", "greetings from brazil"
+        ]
+        labels = [0, 0, 0, 1, 1, 1, 2, 2, 2]
+
+        self.preprocessor = feature_extraction.TfidfVectorizer(**vectorizerOptions)
+        self.oneVsRest = multiclass.OneVsRestClassifier(linear_model.LogisticRegression(solver = "liblinear"))
+        self.oneVsRest.fit(self.preprocessor.fit_transform(trainingTexts), labels)
+
+        self.estimator = linear_model.LogisticRegression(solver = "liblinear")
+        self.estimator.classes_ = np.array([0, 1, 2])
+        self.estimator.coef_ = np.vstack([estimator.coef_ for estimator in self.oneVsRest.estimators_])
+        self.estimator.intercept_ = np.concatenate([estimator.intercept_ for estimator in self.oneVsRest.estimators_])
+
+    # Returns the probabilities of the texts as rated by hatesonar 0.0.7, which normalizes the one-vs-rest probabilities
+    def getExpectedProbabilities(self, texts: list) -> np.ndarray:
+        return self.oneVsRest.predict_proba(self.preprocessor.transform(texts))
+
+class FakeInput:
+
+    def __init__(self, name: str):
+        self.name = name
+
+# Returns the probabilities of the hatesonar 0.1.0 model, which ends with a ZipMap
+class FakeZipMapSession:
+
+    def __init__(self, inputName: str = "text"):
+        self.inputName = inputName
+
+    def get_inputs(self) -> list:
+        return [FakeInput(self.inputName)]
+
+    def run(self, outputNames, inputs: dict):
+        texts = inputs[self.inputName].tolist()
+        return [
+            np.array([int(np.argmax(PROBABILITIES[TEXTS.index(text)])) for text in texts], dtype = np.int64),
+            [{modelClass: probability for modelClass, probability in enumerate(PROBABILITIES[TEXTS.index(text)])} for text in texts]
+        ]
+
+class FakeOnnxSonar:
+
+    def __init__(self):
+        self.sess = FakeZipMapSession()
+
+def test_probability_array_accepts_zipmap_output():
+    zipMap = [{0: 0.1, 1: 0.2, 2: 0.7}, {2: 0.8, 1: 0.15, 0: 0.05}]
+
+    assert getProbabilityArray(zipMap).tolist() == [[0.1, 0.2, 0.7], [0.05, 0.15, 0.8]]
+    assert getProbabilityArray(np.array(PROBABILITIES)).shape == (len(TEXTS), 3)
+
+def test_sonar_backend_rates_with_sklearn_model():
+    sonar = FakeSklearnSonar()
+    hateRatings, offRatings = SonarBackend(sonar).score(TEXTS)
+
+    expected = sonar.estimator.predict_proba(sonar.preprocessor.transform(TEXTS))
+    assert np.allclose(hateRatings, expected[:, 0])
+    assert np.allclose(offRatings, expected[:, 1])
+
+def test_sonar_backend_rates_with_onnx_session():
+    hateRatings, offRatings = SonarBackend(FakeOnnxSonar()).score(TEXTS)
+
+    assert hateRatings.tolist() == [row[0] for row in PROBABILITIES]
+    assert offRatings.tolist() == [row[1] for row in PROBABILITIES]
+
+def test_onnx_backend_rates_zipmap_output(monkeypatch):
+    # onnxruntime is replaced, as the real session needs the model of hatesonar 0.1.0
+    onnxruntime = types.ModuleType("onnxruntime")
+    onnxruntime.SessionOptions = types.SimpleNamespace
+    onnxruntime.InferenceSession = lambda modelFile, options, providers: FakeZipMapSession("input_text")
+    monkeypatch.setitem(sys.modules, "onnxruntime", onnxruntime)
+
+    backend = OnnxBackend("model.onnx", 1)
+    hateRatings, offRatings = backend.score(TEXTS)
+
+    assert hateRatings.tolist() == [row[0] for row in PROBABILITIES]
+    assert offRatings.tolist() == [row[1] for row in PROBABILITIES]
+
+def test_linear_model_backend_rates_like_exported_model(tmp_path):
+    sonar = FakeSklearnSonar()
+    path = str(tmp_path / "sonar_model.npz")
+    exportSonarModel(path, sonar)
+
+    backend = LinearModelBackend(path, getModelVersion())
+    hateRatings, offRatings = backend.score(TEXTS)
+
+    expected = sonar.getExpectedProbabilities(TEXTS)
+    assert backend.version == getModelVersion()
+    assert np.allclose(hateRatings, expected[:, 0], atol = 1e-9)
+    assert np.allclose(offRatings, expected[:, 1], atol = 1e-9)
+
+def test_export_of_another_version_is_refused(tmp_path):
+    path = str(tmp_path / "sonar_model.npz")
+    exportSonarModel(path, FakeSklearnSonar())
+
+    with pytest.raises(ValueError):
+        LinearModelBackend(path, "hatesonar-0.0.0")
+
+def test_export_requires_default_tokenizer():
+    with pytest.raises(ValueError):
+        exportSonarModel(sonar = FakeSklearnSonar(tokenizer = str.split, token_pattern = None))
+
+def test_backends_rate_like_installed_sonar(tmp_path):
+    hatesonar = pytest.importorskip("hatesonar")
+    import hatesonar.api
+
+    sonar = hatesonar.Sonar()
+    backends = [SonarBackend(sonar)]
+
+    # hatesonar 0.1.0 and newer run an ONNX model, older versions can be exported for LinearModelBackend
+    if hasattr(hatesonar.api, "DEFAULT_MODEL_FILE"):
+        backends += [OnnxBackend(hatesonar.api.DEFAULT_MODEL_FILE, 1)]
+    else:
+        path = str(tmp_path / "sonar_model.npz")
+        exportSonarModel(path, sonar)
+        backends += [LinearModelBackend(path, getModelVersion())]
+
+    for backend in backends:
+        assert compareWithSonar(backend, CHECK_TEXTS + TEXTS) <= 1e-6
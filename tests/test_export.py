@@ -0,0 +1,94 @@
+# Checks that incremental exports don't skip posts that are committed after posts with higher PostIDs
+
+import csv
+import os
+import pytest
+
+pytest.importorskip("MySQLdb")
+
+import export
+
+COLUMNS = [("PostID", "Posts.PostID", "int")]
+
+# Posts table whose rows only become visible once they are committed
+class FakeMySQL:
+
+    def __init__(self):
+        self.committedPostIDs = []
+        self.results = None
+
+    def query(self, operation: str, params = None):
+        assert operation == "SELECT MAX(PostID) FROM Posts;"
+        self.results = [(max(self.committedPostIDs, default = None),)]
+
+    def fetchResults(self):
+        return None if self.results[0][0] is None else self.results
+
+    def commit(self):
+        pass
+
+    def stream(self, operation: str, params, batchSize: int):
+        lastPostID, settledPostID = params
+        rows = [(postID,) for postID in sorted(self.committedPostIDs) if lastPostID < postID <= settledPostID]
+
+        if len(rows) > 0:
+            yield rows
+
+class FakeTime:
+
+    def __init__(self, now: float):
+        self.now = now
+        self.sleepCallbacks = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+        for callback in self.sleepCallbacks:
+            callback()
+
+def readExportedPostIDs(outputDir: str) -> list:
+    postIDs = []
+
+    for fileName in sorted(os.listdir(outputDir)):
+        if fileName.endswith(".csv"):
+            with open(os.path.join(outputDir, fileName), "r", encoding = "utf-8") as f:
+                postIDs += [int(row["PostID"]) for row in csv.DictReader(f)]
+
+    return postIDs
+
+def test_post_committed_late_is_exported(tmp_path, monkeypatch):
+    clock = FakeTime(1000)
+    monkeypatch.setattr(export, "time", clock)
+    mysql = FakeMySQL()
+    outputDir = str(tmp_path)
+
+    # Post 2 is still being inserted while post 3 is already committed
+    mysql.committedPostIDs = [1, 3]
+    clock.sleepCallbacks += [lambda: mysql.committedPostIDs.append(2)]
+
+    assert export.exportPosts(mysql, outputDir, "csv", COLUMNS) == 3
+    assert readExportedPostIDs(outputDir) == [1, 2, 3]
+
+def test_export_stops_at_post_seen_before_safety_time(tmp_path, monkeypatch):
+    clock = FakeTime(1000)
+    monkeypatch.setattr(export, "time", clock)
+    mysql = FakeMySQL()
+    outputDir = str(tmp_path)
+
+    # An earlier export saw post 2 as the newest post, posts 3 and 4 may still have uncommitted neighbours
+    export.saveWatermark(outputDir, 0, [[1000 - export.EXPORT_SAFETY_SECONDS - 1, 2]])
+    mysql.committedPostIDs = [1, 2, 4]
+
+    assert export.exportPosts(mysql, outputDir, "csv", COLUMNS) == 2
+    assert clock.now == 1000
+    assert export.loadWatermark(outputDir) == (2, [[1000, 4]])
+
+    # Post 3 commits late, and is exported once post 4 is older than the safety time
+    mysql.committedPostIDs += [3]
+    clock.now += export.EXPORT_SAFETY_SECONDS
+
+    assert export.exportPosts(mysql, outputDir, "csv", COLUMNS) == 2
+    assert readExportedPostIDs(outputDir) == [1, 2, 3, 4]
@@ -0,0 +1,129 @@
+# Checks how the scanner walks the pages of a thread
+
+import pytest
+
+pytest.importorskip("MySQLdb")
+pytest.importorskip("lxml")
+
+import MySQLdb
+import numpy as np
+import hltv_scan
+import parsercheck
+from classification import PostClassifier
+from classifierbackends import ClassifierBackend
+from forums import Forum, ForumThread, ForumAuthor
+from spool import PostSpool
+from threadtracker import ThreadTracker
+
+THREAD_URL = "https://www.hltv.org/forums/threads/2331207/best-player-of-the-decade"
+
+class FakeResponse:
+
+    def __init__(self, url: str, statusCode: int, text: str = ""):
+        self.url = url
+        self.status_code = statusCode
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.headers = {}
+
+# Serves the fixtures and answers conditional requests with 304, as if no page had changed
+class FakeFetcher:
+
+    def __init__(self):
+        self.requests = []
+        self.httpCache = None
+
+    def fetch(self, url: str, conditional: bool = True):
+        self.requests += [(url, conditional)]
+
+        if conditional:
+            return FakeResponse(url, 304)
+
+        with open(parsercheck.getFixturePath(url), "r", encoding = "utf-8") as f:
+            return FakeResponse(url, 200, f.read())
+
+class FakeControl:
+
+    def __init__(self):
+        self.stopRequested = False
+
+    def isStopRequested(self) -> bool:
+        return self.stopRequested
+
+# Serves every fixture in full, as if the pages were requested for the first time
+class UnconditionalFetcher(FakeFetcher):
+
+    def fetch(self, url: str, conditional: bool = True):
+        return super().fetch(url, False)
+
+class FakeScanControl(FakeControl):
+
+    def shouldStop(self) -> bool:
+        return self.stopRequested
+
+# Fails to load the stored threads, as if the connection was lost during the query
+class UnavailableTracker(ThreadTracker):
+
+    def loadThreads(self, mysql, threads: list):
+        raise MySQLdb.OperationalError(2013, "Lost connection to MySQL server during query")
+
+class ConstantBackend(ClassifierBackend):
+
+    version = "constant-1"
+
+    def score(self, texts: list) -> tuple:
+        return (np.zeros(len(texts)), np.zeros(len(texts)))
+
+def createThread() -> ForumThread:
+    return ForumThread("Best player of the decade?", ForumAuthor("fragmaster_99"), 1, url = THREAD_URL, replyCount = 7)
+
+def test_start_page_is_downloaded_even_if_unchanged():
+    fetcher = FakeFetcher()
+    pages = list(hltv_scan.iterThreadPages(fetcher, createThread(), THREAD_URL, 5))
+
+    assert fetcher.requests == [(THREAD_URL, False), (f"{THREAD_URL}?offset=5", True)]
+    assert [page.url for page in pages] == [THREAD_URL]
+
+def test_all_pages_are_read_unconditionally():
+    fetcher = FakeFetcher()
+    pages = list(hltv_scan.iterThreadPages(fetcher, createThread(), THREAD_URL, None, False))
+
+    assert [page.url for page in pages] == [THREAD_URL, f"{THREAD_URL}?offset=5"]
+    assert [page.isLastPage for page in pages] == [False, True]
+
+def test_no_page_is_requested_after_a_stop():
+    fetcher = FakeFetcher()
+    control = FakeControl()
+    pages = hltv_scan.iterThreadPages(fetcher, createThread(), THREAD_URL, None, False, control)
+
+    assert next(pages).url == THREAD_URL
+    control.stopRequested = True
+
+    assert list(pages) == []
+    assert len(fetcher.requests) == 1
+
+def test_pages_are_spooled_while_database_is_unavailable(tmp_path):
+    fetcher = UnconditionalFetcher()
+    control = FakeScanControl()
+    tracker = UnavailableTracker()
+    spool = PostSpool(str(tmp_path))
+    pipeline = hltv_scan.createScanPipeline(fetcher, PostClassifier(backend = ConstantBackend()), None, tracker, control, spool)
+    pipeline.start()
+
+    try:
+        assert hltv_scan.scanForum(None, fetcher, tracker, pipeline, control, Forum("Offtopic", "17/off-topic"))
+        pipeline.join()
+    finally:
+        pipeline.stop()
+
+    spool.rotate()
+    records = [record for segment in spool.getClosedSegments() for record in spool.readSegment(segment)]
+    spool.close()
+
+    # Every page of both listed threads is read from the first page on
+    assert sorted(record["url"] for record in records) == [
+        "https://www.hltv.org/forums/threads/2330412/greetings-from-brazil",
+        THREAD_URL,
+        f"{THREAD_URL}?offset=5"
+    ]
+    assert all(len(record["posts"]) > 0 for record in records)
@@ -0,0 +1,32 @@
+# Checks the link to the next page on the index and thread page fixtures. The fixtures were assembled by hand after
+# HLTV's markup, they aren't captured pages.
+
+import pytest
+
+pytest.importorskip("lxml")
+
+import hltvparser
+import parsercheck
+
+THREAD_URL = "https://www.hltv.org/forums/threads/2331207/best-player-of-the-decade"
+
+# Parses a fixture and returns its document and URL
+def loadFixture(url: str):
+    with open(parsercheck.getFixturePath(url), "r", encoding = "utf-8") as f:
+        return hltvparser.parseDocument(f.read())
+
+def test_next_page_of_first_thread_page():
+    document = loadFixture(THREAD_URL)
+    assert hltvparser.extractNextPageURL(document, THREAD_URL) == f"{THREAD_URL}?offset=5"
+
+def test_last_thread_page_has_no_next_page():
+    url = f"{THREAD_URL}?offset=5"
+    assert hltvparser.extractNextPageURL(loadFixture(url), url) is None
+
+def test_single_page_thread_has_no_next_page():
+    url = "https://www.hltv.org/forums/threads/2330412/greetings-from-brazil"
+    assert hltvparser.extractNextPageURL(loadFixture(url), url) is None
+
+def test_next_page_of_forum_index():
+    url = "https://www.hltv.org/forums/17/off-topic"
+    assert hltvparser.extractNextPageURL(loadFixture(url), url) == f"{url}?offset=50"
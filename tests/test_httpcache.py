@@ -0,0 +1,39 @@
+# Checks that validators are only sent once the page is confirmed as saved
+
+from httpcache import HTTPCache
+
+class FakeResponse:
+
+    def __init__(self, statusCode: int, headers: dict = None, content: bytes = b""):
+        self.status_code = statusCode
+        self.headers = headers or {}
+        self.content = content
+
+URL = "https://www.hltv.org/forums/threads/2331207/best-player-of-the-decade"
+
+def test_validators_are_sent_after_confirm():
+    cache = HTTPCache()
+    cache.update(URL, FakeResponse(200, {"ETag": '"abc"', "Last-Modified": "Mon, 28 Sep 2020 16:20:00 GMT"}, b"<html></html>"))
+
+    assert "If-None-Match" not in cache.getRequestHeaders(URL)
+
+    cache.confirm(URL)
+    headers = cache.getRequestHeaders(URL)
+    assert headers["If-None-Match"] == '"abc"'
+    assert headers["If-Modified-Since"] == "Mon, 28 Sep 2020 16:20:00 GMT"
+
+def test_unconfirmed_download_keeps_previous_validators():
+    cache = HTTPCache()
+    cache.update(URL, FakeResponse(200, {"ETag": '"old"'}))
+    cache.confirm(URL)
+    cache.update(URL, FakeResponse(200, {"ETag": '"new"'}))
+
+    assert cache.getRequestHeaders(URL)["If-None-Match"] == '"old"'
+
+def test_not_modified_counts_saved_bytes():
+    cache = HTTPCache()
+    cache.update(URL, FakeResponse(200, {"ETag": '"abc"'}, b"x" * 100))
+    cache.confirm(URL)
+    cache.update(URL, FakeResponse(304))
+
+    assert cache.getURLStats(URL) == {"requests": 2, "notModified": 1, "bytesDownloaded": 100, "bytesSaved": 100}
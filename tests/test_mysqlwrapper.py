@@ -0,0 +1,127 @@
+# Checks how the MySQL wrapper recovers from a dropped connection
+
+import pytest
+
+MySQLdb = pytest.importorskip("MySQLdb")
+
+import mysqlwrapper
+from authorization import AuthorizationInfo
+from mysqlwrapper import MySQLWrapper, SERVER_GONE_ERROR, SERVER_LOST_ERROR
+
+# Raises the queued errors for the next statements, as if the server had dropped the connection
+class FakeServer:
+
+    def __init__(self):
+        self.errors = []
+        self.statements = []
+        self.connections = []
+
+    def connect(self, **kwargs):
+        connection = FakeConnection(self)
+        self.connections += [connection]
+        return connection
+
+class FakeConnection:
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.closed = False
+        self.commits = 0
+
+    def autocommit(self, enable: bool):
+        pass
+
+    def cursor(self, cursorClass = None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+class FakeCursor:
+
+    def __init__(self, connection: FakeConnection):
+        self.connection = connection
+        self.rowcount = 0
+
+    def execute(self, operation: str, params = None):
+        if self.connection.closed:
+            raise MySQLdb.InterfaceError(0, "")
+
+        if len(self.connection.server.errors) > 0:
+            raise self.connection.server.errors.pop(0)
+
+        self.connection.server.statements += [operation]
+
+    def fetchall(self):
+        return ()
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(mysqlwrapper.MySQLdb, "connect", server.connect, raising = False)
+    return server
+
+def test_autocommit_statement_is_retried_after_reconnect(server):
+    mysql = MySQLWrapper(AuthorizationInfo(), autocommit = True)
+    server.errors += [MySQLdb.OperationalError(SERVER_GONE_ERROR, "MySQL server has gone away")]
+
+    mysql.query("SELECT 1;")
+
+    assert server.statements == ["SELECT 1;"]
+    assert len(server.connections) == 2
+    assert server.connections[0].closed
+
+def test_first_statement_of_transaction_is_retried(server):
+    mysql = MySQLWrapper(AuthorizationInfo())
+    server.errors += [MySQLdb.OperationalError(SERVER_GONE_ERROR, "MySQL server has gone away")]
+
+    mysql.query("INSERT INTO Posts VALUES (1);")
+    mysql.commit()
+
+    assert server.statements == ["INSERT INTO Posts VALUES (1);"]
+    assert server.connections[1].commits == 1
+
+def test_transaction_is_not_continued_on_new_connection(server):
+    mysql = MySQLWrapper(AuthorizationInfo())
+    callbacks = []
+
+    mysql.query("INSERT INTO Posts VALUES (1);")
+    mysql.afterCommit(lambda: callbacks.append("committed"))
+    server.errors += [MySQLdb.OperationalError(SERVER_GONE_ERROR, "MySQL server has gone away")]
+
+    # The first insert was rolled back with the lost connection, so the second one alone must not be committed
+    with pytest.raises(MySQLdb.OperationalError):
+        mysql.query("INSERT INTO Posts VALUES (2);")
+
+    assert server.statements == ["INSERT INTO Posts VALUES (1);"]
+    assert len(server.connections) == 2
+
+    mysql.commit()
+    assert callbacks == []
+
+def test_statement_is_not_retried_if_it_may_have_been_executed(server):
+    mysql = MySQLWrapper(AuthorizationInfo(), autocommit = True)
+    server.errors += [MySQLdb.OperationalError(SERVER_LOST_ERROR, "Lost connection to MySQL server during query")]
+
+    with pytest.raises(MySQLdb.OperationalError):
+        mysql.query("UPDATE Threads SET NumResponses=NumResponses+1;")
+
+    # The next statement uses the new connection
+    mysql.query("SELECT 1;")
+    assert server.statements == ["SELECT 1;"]
+    assert len(server.connections) == 2
+
+def test_other_errors_are_raised_without_reconnect(server):
+    mysql = MySQLWrapper(AuthorizationInfo(), autocommit = True)
+    server.errors += [MySQLdb.IntegrityError(1062, "Duplicate entry")]
+
+    with pytest.raises(MySQLdb.IntegrityError):
+        mysql.query("INSERT INTO Posts VALUES (1);")
+
+    assert len(server.connections) == 1
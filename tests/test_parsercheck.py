@@ -0,0 +1,21 @@
+# Checks that hltvparser extracts the same values as the original requests_html implementation on the fixtures
+
+import pytest
+
+pytest.importorskip("requests_html")
+
+import parsercheck
+
+def test_fixture_paths_round_trip():
+    for path in parsercheck.getFixturePaths():
+        assert parsercheck.getFixturePath(parsercheck.getFixtureURL(path)) == path
+
+def test_fixtures_include_index_and_threads():
+    urls = [parsercheck.getFixtureURL(path) for path in parsercheck.getFixturePaths()]
+
+    assert any('/forums/threads/' not in url for url in urls)
+    assert any('/forums/threads/' in url and '?' in url for url in urls)
+    assert any('/forums/threads/' in url and '?' not in url for url in urls)
+
+def test_parsers_match_reference():
+    assert parsercheck.check()
@@ -0,0 +1,15 @@
+# Checks that scanners on the same host get separate local files
+
+import pytest
+
+pytest.importorskip("MySQLdb")
+
+from sharding import getWorkerPath
+
+def test_worker_name_is_appended_before_the_extension():
+    assert getWorkerPath("http_cache.json", "2") == "http_cache-2.json"
+    assert getWorkerPath("spool", "2") == "spool-2"
+
+def test_paths_are_kept_without_worker_name():
+    assert getWorkerPath("control.txt") == "control.txt"
+    assert getWorkerPath(None, "2") is None
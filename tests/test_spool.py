@@ -0,0 +1,91 @@
+# Checks that spooled records survive database outages and rejected records don't block the spool
+
+import json
+import os
+import pytest
+
+MySQLdb = pytest.importorskip("MySQLdb")
+
+import spool
+from authorization import AuthorizationInfo
+from spool import PostSpool, SpoolDrainer, DEAD_LETTER_FILE
+
+class FakeMySQL:
+
+    def __init__(self, authorization):
+        self.closed = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+# Stores replayed records, failing with the queued errors first
+class FakeDatabase:
+
+    def __init__(self):
+        self.errors = []
+        self.records = []
+
+    def replay(self, mysql, records: list):
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+
+        for record in records:
+            if record.get("invalid"):
+                raise MySQLdb.IntegrityError(1452, "Cannot add or update a child row")
+
+        self.records += records
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(spool, "MySQLWrapper", FakeMySQL)
+    return FakeDatabase()
+
+def test_records_are_kept_while_connection_is_lost(tmp_path, database):
+    postSpool = PostSpool(str(tmp_path))
+    drainer = SpoolDrainer(postSpool, AuthorizationInfo(), database.replay)
+    postSpool.append({"post": 1})
+    postSpool.append({"post": 2})
+
+    database.errors += [MySQLdb.OperationalError(2006, "MySQL server has gone away")]
+    with pytest.raises(MySQLdb.OperationalError):
+        drainer.drain()
+
+    assert not postSpool.isEmpty()
+    assert drainer.mysql is None
+
+    drainer.drain()
+    assert database.records == [{"post": 1}, {"post": 2}]
+    assert postSpool.isEmpty()
+    postSpool.close()
+
+def test_rejected_records_are_dead_lettered(tmp_path, database):
+    postSpool = PostSpool(str(tmp_path))
+    drainer = SpoolDrainer(postSpool, AuthorizationInfo(), database.replay)
+    postSpool.append({"post": 1})
+    postSpool.append({"post": 2, "invalid": True})
+    postSpool.append({"post": 3})
+
+    drainer.drain()
+
+    assert database.records == [{"post": 1}, {"post": 3}]
+    assert postSpool.isEmpty()
+
+    with open(os.path.join(str(tmp_path), DEAD_LETTER_FILE), "r", encoding = "utf-8") as f:
+        deadLetters = [json.loads(line) for line in f]
+
+    assert [deadLetter["record"] for deadLetter in deadLetters] == [{"post": 2, "invalid": True}]
+    assert "1452" in deadLetters[0]["error"]
+    postSpool.close()
+
+def test_spool_directory_is_locked(tmp_path):
+    postSpool = PostSpool(str(tmp_path))
+
+    with pytest.raises(RuntimeError):
+        PostSpool(str(tmp_path))
+
+    postSpool.close()
+    PostSpool(str(tmp_path)).close()
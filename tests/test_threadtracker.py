@@ -0,0 +1,49 @@
+# Checks the reply counts and cursors the thread tracker saves for scanned threads
+
+import pytest
+
+pytest.importorskip("MySQLdb")
+
+from forums import ForumThread, ForumAuthor
+from threadtracker import ThreadTracker
+
+THREAD_URL = "https://www.hltv.org/forums/threads/2331207/best-player-of-the-decade"
+
+class FakeMySQL:
+
+    def __init__(self):
+        self.queries = []
+
+    def query(self, operation: str, params = None):
+        self.queries += [(operation, params)]
+
+def createThread(replyCount = 7) -> ForumThread:
+    thread = ForumThread("Best player of the decade?", ForumAuthor("fragmaster_99"), 1, url = THREAD_URL, replyCount = replyCount)
+    thread.sqlID = 42
+    return thread
+
+def test_scanned_thread_is_unchanged_until_new_replies():
+    mysql = FakeMySQL()
+    tracker = ThreadTracker()
+    thread = createThread()
+
+    tracker.saveCursor(mysql, thread, 7, f"{THREAD_URL}?offset=5")
+    tracker.markUpdated(mysql, thread)
+
+    assert mysql.queries[-1][1] == (8, 42)
+    assert tracker.getLastReplyNum(thread) == 7
+    assert tracker.getResumeURL(thread) == f"{THREAD_URL}?offset=5"
+    assert not tracker.hasChanged(thread)
+    assert tracker.hasChanged(createThread(replyCount = 8))
+
+def test_reply_count_of_thread_without_index_count_is_unknown():
+    mysql = FakeMySQL()
+    tracker = ThreadTracker()
+    thread = createThread(replyCount = None)
+
+    tracker.saveCursor(mysql, thread, 3, THREAD_URL)
+    tracker.markUpdated(mysql, thread)
+
+    assert mysql.queries[-1][1] == (None, 42)
+    assert tracker.getLastReplyNum(thread) == 3
+    assert tracker.hasChanged(thread)
@@ -0,0 +1,146 @@
+# This class keeps track of which threads changed since they were last scanned.
+# The forum index lists the number of replies of every thread. By comparing it to the number of posts stored
+# in the database, threads without new replies can be skipped without downloading or classifying them again.
+# For threads that changed, it remembers a cursor: the highest stored reply and the page it is on.
+# Reading can continue on that page, so only pages with new replies are downloaded.
+# The state is persisted in the Threads, Posts and ThreadCursors tables, so it survives restarts of the scraper.
+# Only the threads listed on the index pages that are being scanned are loaded, and the tracker is cleared once they
+# are saved, so neither the queries nor the memory grow with the size of a forum.
+
+from mysqlwrapper import MySQLWrapper
+from forums import ForumThread, MAX_IDS_PER_QUERY
+
+class ThreadTracker:
+
+    # Constructor
+    def __init__(self):
+        # Maps thread HLTVID to a tuple of (NumResponses, highest stored ReplyNum, cursor page URL)
+        self.storedThreads = {}
+
+    # Loads the stored reply counts and cursors of some threads from the database
+    # mysql: Database connection
+    # threads: Threads that should be loaded, e.g. the ones listed on a forum index page
+    def loadThreads(self, mysql: MySQLWrapper, threads: list):
+        hltvIDs = [thread.hltvID for thread in threads]
+
+        for start in range(0, len(hltvIDs), MAX_IDS_PER_QUERY):
+            chunk = hltvIDs[start:start + MAX_IDS_PER_QUERY]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            self.__loadRows(mysql, f"Threads.HLTVID IN ({placeholders})", tuple(chunk))
+
+    # Removes all loaded threads. Must only be called once the loaded threads are saved.
+    def clear(self):
+        self.storedThreads = {}
+
+    # Loads the stored reply counts and cursors of the threads matching a condition
+    def __loadRows(self, mysql: MySQLWrapper, condition: str, params: tuple):
+        mysql.query(
+            (
+                "SELECT Threads.HLTVID, Threads.NumResponses, MAX(Posts.ReplyNum), ThreadCursors.PageURL FROM Threads "
+                "LEFT JOIN Posts ON Posts.ThreadID = Threads.ThreadID "
+                "LEFT JOIN ThreadCursors ON ThreadCursors.ThreadID = Threads.ThreadID "
+                f"WHERE {condition} GROUP BY Threads.ThreadID, ThreadCursors.PageURL;"
+            ),
+            params
+        )
+
+        results = mysql.fetchResults()
+
+        if results is not None:
+            for row in results:
+                self.storedThreads[row[0]] = (row[1], row[2], row[3])
+
+    # Returns True if the thread has to be (re-)scanned
+    # thread: Thread as listed on the forum index
+    def hasChanged(self, thread: ForumThread) -> bool:
+        # Threads without a reply count from the index can't be compared
+        if thread.replyCount is None:
+            return True
+
+        stored = self.storedThreads.get(thread.hltvID)
+        if stored is None:
+            return True
+
+        numResponses, maxReplyNum, pageURL = stored
+
+        # No posts stored yet, e.g. because the last scan was interrupted
+        if maxReplyNum is None:
+            return True
+
+        # NumResponses also counts the initial post of the thread
+        return numResponses != thread.replyCount + 1
+
+    # Returns the highest reply number stored for a thread, or None if none of its posts are stored
+    # thread: Thread to be looked up
+    def getLastReplyNum(self, thread: ForumThread):
+        stored = self.storedThreads.get(thread.hltvID)
+
+        if stored is None:
+            return None
+        else:
+            return stored[1]
+
+    # Returns the URL of the page where reading of a thread should continue
+    # thread: Thread to be looked up
+    def getResumeURL(self, thread: ForumThread) -> str:
+        stored = self.storedThreads.get(thread.hltvID)
+
+        if stored is None or stored[2] is None:
+            return thread.getURL()
+        else:
+            return stored[2]
+
+    # Saves how far a thread was read. Must be called after the posts of the page have been inserted.
+    # The cursor only moves forward, as pages of a thread may be saved out of order.
+    # mysql: Database connection
+    # thread: Thread that was read
+    # lastReplyNum: Highest reply number on the page
+    # pageURL: URL of the page
+    def saveCursor(self, mysql: MySQLWrapper, thread: ForumThread, lastReplyNum: int, pageURL: str):
+        # PageURL is assigned first, as it's compared against the LastReplyNum before the update
+        mysql.query(
+            (
+                "INSERT INTO ThreadCursors (ThreadID, LastReplyNum, PageURL) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE "
+                "PageURL=IF(VALUES(LastReplyNum) > LastReplyNum, VALUES(PageURL), PageURL), "
+                "LastReplyNum=GREATEST(LastReplyNum, VALUES(LastReplyNum));"
+            ),
+            (thread.sqlID, lastReplyNum, pageURL,)
+        )
+
+        numResponses = None
+        stored = self.storedThreads.get(thread.hltvID)
+        if stored is not None:
+            numResponses = stored[0]
+
+            if stored[1] is not None and stored[1] >= lastReplyNum:
+                return
+
+        self.storedThreads[thread.hltvID] = (numResponses, lastReplyNum, pageURL)
+
+    # Saves the number of posts of a scanned thread, so it's skipped until new replies appear.
+    # Must be called after the posts and the cursor of the thread's last page have been saved.
+    # mysql: Database connection
+    # thread: Thread that was scanned
+    def markUpdated(self, mysql: MySQLWrapper, thread: ForumThread):
+        # Uses the count from the index, so threads whose visible posts differ from it (e.g. deleted replies)
+        # aren't re-scanned every cycle. Threads without a count from the index are always re-scanned anyway.
+        if thread.replyCount is None:
+            numResponses = None
+        else:
+            numResponses = thread.replyCount + 1
+
+        # saveCursor already stored the highest reply of the last page
+        maxReplyNum = None
+        pageURL = None
+        stored = self.storedThreads.get(thread.hltvID)
+        if stored is not None:
+            maxReplyNum = stored[1]
+            pageURL = stored[2]
+
+        mysql.query(
+            "UPDATE Threads SET NumResponses=%s WHERE ThreadID=%s;",
+            (numResponses, thread.sqlID,)
+        )
+
+        self.storedThreads[thread.hltvID] = (numResponses, maxReplyNum, pageURL)